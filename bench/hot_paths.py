@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+"""
+Micro-benchmarks of pure-Python code run on every request: mint key derivation, address validation and building
+of JSON responses. Each benchmark is timed together with its reference - the straightforward code it replaces
+or builds on - and fails the run if it takes more than the allowed share of the reference's time. Both are measured
+in the same run, so the result doesn't depend on the machine.
+
+Usage: hot_paths.py [benchmark ...]
+"""
+
+import os
+import sys
+import timeit
+import itertools
+
+from web3 import Web3
+from flask import Flask, jsonify
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), '..', 'lib')))
+
+from mixbytes.minter import MinterService
+from mixbytes.web import REVALIDATE_CACHE_CONTROL, is_address, not_modified, with_cache_headers
+
+
+REPEAT = 9
+
+CONTRACT_ADDRESS = '0x' + '3c' * 20
+INVESTOR_ADDRESS = '0xfB6916095ca1df60bB79Ce92cE3Ea74c37c5d359'
+
+
+def main():
+    names = sys.argv[1:]
+
+    benchmarks = _benchmarks()
+    unknown = set(names) - set(benchmarks)
+    if unknown:
+        sys.exit('unknown benchmarks: ' + ', '.join(sorted(unknown)))
+
+    regressions = []
+    for name, (fn, reference_fn, number, max_ratio) in benchmarks.items():
+        if names and name not in names:
+            continue
+
+        result, reference = _time(fn, reference_fn, number)
+        ratio = result / reference
+        if ratio > max_ratio:
+            regressions.append(name)
+        print('{:<24} {:>10.0f} ns/op   reference {:>10.0f} ns/op ({:.2f}x, allowed {:.2f}x){}'.format(
+            name, result, reference, ratio, max_ratio, '   REGRESSION' if ratio > max_ratio else ''))
+
+    if regressions:
+        sys.exit('regressions: ' + ', '.join(regressions))
+
+
+def _benchmarks():
+    """
+    :return: dict name -> (function to time, reference function, calls per measurement,
+                           allowed ratio of function time to reference time)
+    """
+    minter = MinterService.create_offline(CONTRACT_ADDRESS)
+    prepared_mint_id = MinterService._prepare_mint_id('mint-1')
+    fresh_mint_ids = ('mint-{}'.format(number) for number in itertools.count())
+    fresh_reference_ids = ('mint-{}'.format(number) for number in itertools.count())
+
+    app = Flask(__name__)
+    status = {'status': 'minting', 'confirmations': 3, 'rest_confirmations': 9}
+
+    def status_response():
+        with app.test_request_context('/getMintingStatus?mint_id=mint-1'):
+            return not_modified('5000000-1', REVALIDATE_CACHE_CONTROL) or \
+                with_cache_headers(jsonify(status), '5000000-1', REVALIDATE_CACHE_CONTROL)
+
+    def plain_status_response():
+        with app.test_request_context('/getMintingStatus?mint_id=mint-1'):
+            return jsonify(status)
+
+    def height_response():
+        with app.test_request_context('/blockChainHeight'):
+            return with_cache_headers(jsonify(5000000), '5000000', REVALIDATE_CACHE_CONTROL)
+
+    def plain_height_response():
+        with app.test_request_context('/blockChainHeight'):
+            return jsonify(5000000)
+
+    # memoized derivations must stay much cheaper than computing anew, conversions of a cache miss must not add up,
+    # cache headers must stay cheap next to building the response
+    return {
+        'prepare_mint_id': (lambda: MinterService._prepare_mint_id('mint-1'),
+                            lambda: _derive_mint_id('mint-1'), 20000, 0.25),
+        'prepare_new_mint_id': (lambda: MinterService._prepare_mint_id(next(fresh_mint_ids)),
+                                lambda: _derive_mint_id(next(fresh_reference_ids)), 5000, 1.25),
+        'redis_mint_tx_key': (lambda: minter._redis_mint_tx_key(prepared_mint_id),
+                              lambda: _derive_mint_tx_key(prepared_mint_id), 20000, 0.25),
+        'redis_contract_key': (lambda: minter._redis_contract_key(b'mi', b'12345'),
+                               lambda: _derive_contract_key(b'mi', b'12345'), 20000, 0.5),
+        'is_address': (lambda: is_address(INVESTOR_ADDRESS), lambda: Web3.isAddress(INVESTOR_ADDRESS), 20000, 0.25),
+        'status_response': (status_response, plain_status_response, 5000, 1.5),
+        'height_response': (height_response, plain_height_response, 5000, 1.5),
+    }
+
+
+def _time(fn, reference_fn, number):
+    """
+    Measurements of the function and the reference alternate, so that both see the same load of the machine
+    :return: tuple (best time of a function call, best time of a reference call), in nanoseconds
+    """
+    timers = (timeit.Timer(fn), timeit.Timer(reference_fn))
+    best = [float('inf'), float('inf')]
+    for _ in range(REPEAT):
+        for i, timer in enumerate(timers):
+            best[i] = min(best[i], timer.timeit(number))
+    return tuple(elapsed / number * 1e9 for elapsed in best)
+
+
+def _derive_mint_id(mint_id):
+    return Web3.toBytes(hexstr=Web3.sha3(mint_id.encode('utf-8')))
+
+
+def _derive_mint_tx_key(prepared_mint_id):
+    contract_address_bytes = Web3.toBytes(hexstr=CONTRACT_ADDRESS)
+    return Web3.toBytes(hexstr=Web3.sha3(contract_address_bytes + prepared_mint_id))
+
+
+def _derive_contract_key(name, hash_tag):
+    address = Web3.toHex(Web3.toBytes(hexstr=CONTRACT_ADDRESS)).encode('ascii')
+    return name + b':' + address + b':{' + hash_tag + b'}'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+"""
+Compares redis memory taken by the index of mint transactions in the former layout (a list and a cached block
+string per mint) and in MintIndex.
+
+Usage: mint_index_memory.py [mints [multi_tx_percent [redis_host [redis_port [redis_db]]]]]
+multi_tx_percent of mints (10 by default) have a second transaction, as after a re-mint.
+The db should be a scratch one: used_memory of the whole server is measured.
+"""
+
+import os
+import sys
+import struct
+import hashlib
+from collections import Counter
+
+import redis
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), '..', 'lib')))
+
+from mixbytes.mint_index import MintIndex
+
+
+BATCH_SIZE = 1000
+CONTRACT_ADDRESS = b'0x' + b'11' * 20
+
+
+def main():
+    mints = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    multi_tx_percent = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    redis_client = redis.StrictRedis(host=sys.argv[3] if len(sys.argv) > 3 else '127.0.0.1',
+                                     port=int(sys.argv[4]) if len(sys.argv) > 4 else 6379,
+                                     db=int(sys.argv[5]) if len(sys.argv) > 5 else 15)
+
+    index = MintIndex(redis_client, _bucket_key)
+
+    def write_legacy(pipe, mint_key, tx_hashes, block):
+        # the layout of earlier versions: a list of transactions, the block the mint was seen processed at
+        for tx_hash in tx_hashes:
+            pipe.lpush(mint_key, tx_hash)
+        pipe.set(b'bh' + mint_key, block, ex=3600)
+
+    def write_index(pipe, mint_key, tx_hashes, block):
+        # the same values MintIndex.add_tx and set_block produce, without a script call per mint
+        key, field = index._locate(mint_key)
+        pipe.hset(key, field, struct.pack(MintIndex.BLOCK_FORMAT, block, tx_hashes[0][:8], block) + tx_hashes[0])
+        if len(tx_hashes) > 1:
+            pipe.rpush(index._overflow_key(key, field), *tx_hashes[1:])
+
+    legacy, _ = _measure(redis_client, mints, multi_tx_percent, write_legacy)
+    compact, encodings = _measure(redis_client, mints, multi_tx_percent, write_index, b'mi:*')
+
+    print('{} mints, {:g}% with two transactions'.format(mints, multi_tx_percent))
+    print('former layout: {:.1f} bytes per mint'.format(legacy / mints))
+    print('MintIndex:     {:.1f} bytes per mint ({:.0f}% less)'.format(compact / mints, 100 - compact * 100 / legacy))
+    print('bucket encodings: {}'.format(', '.join('{} {}'.format(count, encoding.decode('ascii'))
+                                                  for encoding, count in sorted(encodings.items()))))
+
+
+def _measure(redis_client, mints, multi_tx_percent, write_fn, buckets_pattern=None):
+    """
+    :return: tuple (bytes used, Counter of encodings of keys matching buckets_pattern)
+    """
+    redis_client.flushdb()
+    before = redis_client.info('memory')['used_memory']
+
+    pipe = redis_client.pipeline(transaction=False)
+    multi_tx_every = int(100 / multi_tx_percent) if multi_tx_percent > 0 else 0
+    for mint in range(mints):
+        tx_hashes = [_digest(b'tx', mint)]
+        if multi_tx_every and 0 == mint % multi_tx_every:
+            tx_hashes.append(_digest(b'retx', mint))
+        write_fn(pipe, _digest(b'mint', mint), tx_hashes, 5000000 + mint)
+        if 0 == (mint + 1) % BATCH_SIZE:
+            pipe.execute()
+    pipe.execute()
+
+    used = redis_client.info('memory')['used_memory'] - before
+    encodings = Counter()
+    if buckets_pattern is not None:
+        for key in redis_client.scan_iter(match=buckets_pattern, count=1000):
+            encodings[redis_client.object('encoding', key)] += 1
+    redis_client.flushdb()
+    return used, encodings
+
+
+def _digest(kind, number):
+    return hashlib.sha256(kind + str(number).encode('ascii')).digest()
+
+
+def _bucket_key(name, hash_tag):
+    # the same as MinterService._redis_contract_key
+    return name + b':' + CONTRACT_ADDRESS + b':{' + hash_tag + b'}'
+
+
+if __name__ == '__main__':
+    main()
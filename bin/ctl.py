@@ -3,12 +3,15 @@
 import sys
 import os
 import logging
+import threading
 
 from web3 import Web3
 
 sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), '..', 'lib')))
 
 from mixbytes.minter import MinterService, UsageError
+from mixbytes.bulk import BulkMinter
+from mixbytes.leader import NotLeaderError
 
 
 conf_filename = os.path.join(os.path.dirname(__file__), '..', 'conf', 'minter.conf')
@@ -21,9 +24,14 @@ def _fatal(message, *args):
 
 
 def main():
+    tenant = None
+    if len(sys.argv) > 2 and '--tenant' == sys.argv[1]:
+        tenant = sys.argv[2]
+        del sys.argv[1:3]
+
     if len(sys.argv) > 1 and sys.argv[1] in ('help', '-h', '--help'):
         print("""
-    Usage:
+    Usage: ctl.py [--tenant <tenant>] <command> ... (the tenant is required if tenants are configured)
 
     step 1: ctl.py init_account - initializes new account to use for minting
     step 1.1: * send ether to and periodically refill balance of minting account
@@ -33,6 +41,16 @@ def main():
 
     step 3: * use wsgi_app:app as a WSGI app (to mint and check minting status)
 
+    step 3.1: ctl.py dispatch_webhooks - deliver outcomes of mints requested with callback_url (runs forever,
+              for all tenants if none is given)
+
+    step 3.2: ctl.py bulk_mint <file.csv|file.jsonl> [max_in_flight [priority]] - mint tokens for every
+              mint_id,address,amount row of the file (can be restarted, progress is kept in <file>.checkpoint;
+              the service must be stopped)
+
+    ctl.py migrate_mint_index - move the index of mint transactions kept in redis by earlier versions
+              to the current layout (run it once, with the service stopped)
+
     step 4: ctl.py recover_ether <address_to_send_ether_to> - recover ether remaining on minting account
                 """.strip())
         sys.exit(0)
@@ -40,7 +58,8 @@ def main():
     if len(sys.argv) > 1 and 'init_account' == sys.argv[1]:
         logging.basicConfig(level=logging.INFO)
         try:
-            print('Generated new account: {}'.format(MinterService(conf_filename, contracts_directory).init_account()))
+            print('Generated new account: {}'.format(
+                MinterService(conf_filename, contracts_directory, tenant=tenant).init_account()))
         except UsageError as exc:
             _fatal('{}', exc.message)
 
@@ -54,7 +73,7 @@ def main():
 
         try:
             print('ReenterableMinter deployed at: {}'.format(
-                MinterService(conf_filename, contracts_directory).deploy_contract(token_address)))
+                MinterService(conf_filename, contracts_directory, tenant=tenant).deploy_contract(token_address)))
         except UsageError as exc:
             _fatal('{}', exc.message)
 
@@ -67,7 +86,7 @@ def main():
             _fatal('bad address: {}', target_address)
 
         try:
-            tx_hash = MinterService(conf_filename, contracts_directory).recover_ether(target_address)
+            tx_hash = MinterService(conf_filename, contracts_directory, tenant=tenant).recover_ether(target_address)
             if tx_hash is None:
                 print("Nothing could be sent")
             else:
@@ -75,6 +94,70 @@ def main():
         except UsageError as exc:
             _fatal('{}', exc.message)
 
+    elif len(sys.argv) > 1 and 'dispatch_webhooks' == sys.argv[1]:
+        logging.basicConfig(level=logging.INFO)
+        try:
+            minters = [] if tenant is not None else \
+                list(MinterService.create_tenants(conf_filename, contracts_directory, wsgi_mode=True).values())
+            minters = minters or [MinterService(conf_filename, contracts_directory, wsgi_mode=True, tenant=tenant)]
+            for minter in minters[1:]:
+                threading.Thread(target=minter.webhooks().run, args=(minter.head_tracker(), ), daemon=True).start()
+            minters[0].webhooks().run(minters[0].head_tracker())
+        except UsageError as exc:
+            _fatal('{}', exc.message)
+        except KeyboardInterrupt:
+            pass
+
+    elif len(sys.argv) > 1 and 'bulk_mint' == sys.argv[1]:
+        logging.basicConfig(level=logging.INFO)
+        if len(sys.argv) not in (3, 4, 5):
+            _fatal('usage: {} bulk_mint <file.csv|file.jsonl> [max_in_flight [priority]]', sys.argv[0])
+        filename = sys.argv[2]
+        try:
+            max_in_flight = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+        except ValueError:
+            _fatal('bad max_in_flight: {}', sys.argv[3])
+        if max_in_flight <= 0:
+            _fatal('bad max_in_flight: {}', max_in_flight)
+        priority = sys.argv[4] if len(sys.argv) > 4 else None
+
+        try:
+            # nonces are assigned locally: the service must not send transactions meanwhile
+            minter = MinterService(conf_filename, contracts_directory, wsgi_mode=True, tenant=tenant, exclusive=True)
+            bulk_minter = BulkMinter(minter, max_in_flight, priority)
+
+            rows, errors = bulk_minter.validate(filename)
+            if errors:
+                _fatal('{} of {} rows are invalid:\n{}', len(errors), rows, '\n'.join(errors[:100]))
+            print('{} rows are valid'.format(rows))
+
+            def progress(stats, elapsed):
+                print('sent {}, mined {}, failed {}, skipped {} in {:.0f}s: {:.1f} tx/s'.format(
+                    stats['sent'], stats['mined'], stats['failed'], stats['skipped'], elapsed,
+                    stats['sent'] / elapsed if elapsed else 0))
+
+            stats = bulk_minter.run(filename, progress)
+            print('Done: {} rows minted, {} failed, {} not mined in time, {} sent by previous runs'.format(
+                stats['mined'], stats['failed'], stats['unresolved'], stats['skipped']))
+            if stats['unresolved']:
+                print('Transactions of unresolved rows are listed in {}.checkpoint'.format(filename))
+            if stats['failed'] or stats['unresolved']:
+                sys.exit(2)
+        except UsageError as exc:
+            _fatal('{}', exc.message)
+        except NotLeaderError:
+            _fatal('Lost the leadership to another instance (is the service running?), '
+                   'run bulk_mint again to continue')
+
+    elif len(sys.argv) > 1 and 'migrate_mint_index' == sys.argv[1]:
+        logging.basicConfig(level=logging.INFO)
+        try:
+            minter = MinterService(conf_filename, contracts_directory, wsgi_mode=True, tenant=tenant)
+            migrated, dropped = minter.migrate_mint_index()
+            print('Migrated {} mints, dropped {} cached blocks'.format(migrated, dropped))
+        except UsageError as exc:
+            _fatal('{}', exc.message)
+
     else:
         _fatal('no command given, see {} help', sys.argv[0])
 
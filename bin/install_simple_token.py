@@ -6,7 +6,6 @@ from shutil import rmtree
 from os.path import join
 import logging
 import json
-from time import sleep
 from plumbum import cli
 from plumbum import local
 from plumbum.cmd import truffle
@@ -17,31 +16,29 @@ import logging
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
 
 from mixbytes.minter import MinterService, UsageError, get_receipt_status
+from mixbytes.blocks import HeadTracker, ReceiptWaiter
 
 def _token_json():
          with open(os.path.join('build', 'contracts', 'SimpleMintableToken.json')) as fh:
              return json.load(fh)
 
-def _get_receipt_blocking(tx_hash, w3):
+def _get_receipt_blocking(tx_hash, receipt_waiter):
     logging.info("Wait for transaction %s" % tx_hash)
-    while True:
-        receipt = w3.eth.getTransactionReceipt(tx_hash)
-        if receipt is not None:
-            return receipt
-
-        sleep(0.5)
+    return receipt_waiter.wait(tx_hash)
 
-def _blocking_to_wait_ethers(account, w3):
+def _blocking_to_wait_ethers(account, w3, head_tracker):
     gas_price = w3.eth.gasPrice
     gas_limit = int(w3.eth.getBlock('latest').gasLimit * 0.9)
     expected_balance = gas_price * gas_limit
     logging.info("Wait for sufficient balance %s on account %s" % (expected_balance, account))
+    head = None
     while True:
         balance = w3.eth.getBalance(account)
         if balance > expected_balance:
             return balance
-      
-        sleep(0.5)
+
+        # balance can only change with a new block
+        head = head_tracker.wait_for_change(head, 60)
             
 
 class SimpleTokenInstaller(cli.Application):
@@ -97,11 +94,12 @@ class SimpleTokenInstaller(cli.Application):
         
 
             w3 = minter_service.create_web3()
-
+            head_tracker = HeadTracker(w3, 0.5)
+            receipt_waiter = ReceiptWaiter(w3, head_tracker)
 
             if not minter_service.is_contract_deployed():
                 logging.info("Init minter contracts")
-                _blocking_to_wait_ethers(minter_address, w3)            
+                _blocking_to_wait_ethers(minter_address, w3, head_tracker)            
                 get_bytecode = lambda json_: json_.get('bytecode') or json_['unlinked_binary']
 
                 contract_json = _token_json()            
@@ -113,7 +111,7 @@ class SimpleTokenInstaller(cli.Application):
                 logging.info("Deploy token contract...")
                 tx_hash = token_contract.deploy(transaction={'from': minter_address, 'gasPrice': gas_price, 'gas': gas_limit})
 
-                token_address = _get_receipt_blocking(tx_hash, w3).contractAddress
+                token_address = _get_receipt_blocking(tx_hash, receipt_waiter).contractAddress
 
                 logging.info("Deploy minter contract...")
                 address = minter_service.deploy_contract(token_address)
@@ -122,7 +120,7 @@ class SimpleTokenInstaller(cli.Application):
 
                 logging.info("Transfer ownership to minter...")
                 
-                _get_receipt_blocking(tx_hash, w3)
+                _get_receipt_blocking(tx_hash, receipt_waiter)
             print("Token address: %s" % (minter_service.token_address()))
         
         os.remove(conf_file)
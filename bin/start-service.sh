@@ -10,4 +10,6 @@ chmod -R 777 /app/data
         --mount /minter-service=/app/bin/wsgi_app.py --callable app \
         --uid uwsgi --gid uwsgi \
         --die-on-term \
-        --processes 4
+        --processes 4 \
+        --enable-threads \
+        --threads 16
@@ -1,14 +1,30 @@
 #!/usr/bin/env python3
 
 import os
+import math
 import logging
 import logging.config
 
-from web3 import Web3
+import redis.exceptions
 from flask import Flask, abort, request, jsonify
 
-from uwsgidecorators import timer
 from mixbytes.minter import MinterService
+from mixbytes.leader import NotLeaderError
+from mixbytes.deadline import DeadlineExceededError
+from mixbytes.lanes import LaneBusyError
+from mixbytes.webhooks import validate_callback_url
+from mixbytes.web import REVALIDATE_CACHE_CONTROL, IMMUTABLE_CACHE_CONTROL, MINTED_ETAG, is_address, not_modified, \
+    with_cache_headers
+
+try:
+    from uwsgidecorators import timer, postfork
+except ImportError:
+    # outside of uwsgi (flask development server, tests) there are no workers to fork and no timers
+    def timer(seconds):
+        return lambda fn: fn
+
+    def postfork(fn):
+        return fn
 
 logging.config.dictConfig({
         'version': 1,
@@ -34,32 +50,158 @@ logging.config.dictConfig({
 
 logger = logging.getLogger(__name__)
 
-conf_filename = os.path.join(os.path.dirname(__file__), '..', 'conf', 'minter.conf')
-contracts_directory = os.path.join(os.path.dirname(__file__), '..', 'built_contracts')
+conf_filename = os.environ.get('MINTER_CONF', os.path.join(os.path.dirname(__file__), '..', 'conf', 'minter.conf'))
+contracts_directory = os.environ.get('MINTER_CONTRACTS_DIRECTORY',
+                                     os.path.join(os.path.dirname(__file__), '..', 'built_contracts'))
 
 app = Flask(__name__)
-wsgi_minter = MinterService(conf_filename, contracts_directory, wsgi_mode=True)
+# With tenants configured requests choose one by path (/<tenant>/mintTokens) or tenant parameter.
+tenant_minters = MinterService.create_tenants(conf_filename, contracts_directory, wsgi_mode=True)
+wsgi_minter = None if tenant_minters else MinterService(conf_filename, contracts_directory, wsgi_mode=True)
+all_minters = list(tenant_minters.values()) if tenant_minters else [wsgi_minter]
+admission = MinterService.create_admission_controller(all_minters)
+
+# Mints are not limited: shedding status polling is what keeps them flowing under overload.
+ADMISSION_CONTROLLED_ENDPOINTS = ('get_minting_status', 'wait_minting_status', 'get_blockchain_height')
+
+
+@postfork
+def init_worker():
+    # the app is loaded by uwsgi master before forking workers, so respawned workers start instantly
+    for minter in all_minters:
+        minter.after_fork()
 
 
 @timer(300)
 def unlock_account(signum):
-    wsgi_minter.unlockAccount()
+    for minter in all_minters:
+        minter.unlockAccount()
+
+
+@timer(60)
+def replay_mint_journal(signum):
+    # segments of crashed workers and rotated ones
+    for minter in all_minters:
+        minter.replay_mint_journal()
+
+
+@app.before_request
+def admit_request():
+    if admission is None or request.endpoint not in ADMISSION_CONTROLLED_ENDPOINTS:
+        return None
+
+    retry_after = admission.admit(admission.client_id(request.remote_addr, request.headers.get('X-Forwarded-For')))
+    if retry_after is None:
+        return None
+
+    response = jsonify({'success': False, 'error': 'too many requests'})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, int(math.ceil(retry_after))))
+    return response
+
+
+@app.errorhandler(NotLeaderError)
+def not_leader(exc):
+    # a load balancer is expected to retry with another instance
+    response = jsonify({'success': False, 'error': str(exc)})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+
+@app.errorhandler(DeadlineExceededError)
+def deadline_exceeded(exc):
+    response = jsonify({'status': 'deadline_exceeded'})
+    response.status_code = 504
+    return response
+
+
+@app.errorhandler(redis.exceptions.RedisError)
+def redis_error(exc):
+    # raised only where redis is essential, e.g. watching a mint for its callback
+    logger.error('redis failed: %s', exc)
+    response = jsonify({'success': False, 'error': 'storage is not available'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '5'
+    return response
+
+
+@app.errorhandler(LaneBusyError)
+def lane_busy(exc):
+    response = jsonify({'success': False, 'error': str(exc)})
+    response.status_code = 503
+    response.headers['Retry-After'] = '60'
+    return response
 
 
 @app.route('/mintTokens')
-def mint_tokens():
-    wsgi_minter.mint_tokens(_get_mint_id(), _get_address(), _get_tokens())
+@app.route('/<tenant>/mintTokens')
+def mint_tokens(tenant=None):
+    minter = _get_minter(tenant)
+    if minter.read_only:
+        abort(403, 'read-only instance')
+    minter.mint_tokens(_get_mint_id(), _get_address(), _get_tokens(), _get_callback_url(), _get_priority(minter))
     return jsonify({'success': True})
 
 
 @app.route('/getMintingStatus')
-def get_minting_status():
-    return jsonify(wsgi_minter.get_minting_status(_get_mint_id()))
+@app.route('/<tenant>/getMintingStatus')
+def get_minting_status(tenant=None):
+    minter = _get_minter(tenant)
+    mint_id = _get_mint_id()
+    minted_is_final = minter.is_minted_status_final()
+
+    # one deadline for the version and the status
+    with minter.request_deadline():
+        # taken before the status: the status may only be newer than the version
+        version = minter.minting_status_version(mint_id)
+        response = (not_modified(MINTED_ETAG, IMMUTABLE_CACHE_CONTROL) if minted_is_final else None) or \
+            not_modified(version, REVALIDATE_CACHE_CONTROL)
+        if response is not None:
+            return response
+
+        status = minter.get_minting_status(mint_id)
+    if minted_is_final and 'minted' == status['status']:
+        return with_cache_headers(jsonify(status), MINTED_ETAG, IMMUTABLE_CACHE_CONTROL)
+    return with_cache_headers(jsonify(status), version, REVALIDATE_CACHE_CONTROL)
+
+
+@app.route('/waitMintingStatus')
+@app.route('/<tenant>/waitMintingStatus')
+def wait_minting_status(tenant=None):
+    return jsonify(_get_minter(tenant).wait_minting_status(_get_mint_id(), request.args.get('since'),
+                                                           _get_optional_int('confirmations'),
+                                                           _get_optional_int('timeout')))
 
 
 @app.route('/blockChainHeight')
-def get_blockchain_height():
-    return jsonify(wsgi_minter.blockchain_height())
+@app.route('/<tenant>/blockChainHeight')
+def get_blockchain_height(tenant=None):
+    minter = _get_minter(tenant)
+
+    head = minter.head_tracker().head
+    response = not_modified(None if head is None else str(head), REVALIDATE_CACHE_CONTROL)
+    if response is not None:
+        return response
+
+    height = minter.blockchain_height()
+    return with_cache_headers(jsonify(height), str(height), REVALIDATE_CACHE_CONTROL)
+
+
+def _get_minter(tenant):
+    """
+    :param tenant: tenant from the request path (None - take it from the parameters)
+    :return: MinterService serving the request
+    """
+    if not tenant_minters:
+        if tenant is not None:
+            abort(404)
+        return wsgi_minter
+
+    tenant = tenant or request.args.get('tenant')
+    if tenant not in tenant_minters:
+        abort(404, 'unknown tenant')
+    return tenant_minters[tenant]
 
 
 def _get_mint_id():
@@ -89,8 +231,35 @@ def _get_tokens():
         abort(400, 'bad tokens_amount')
 
 
+def _get_priority(minter):
+    priority = request.args.get('priority')
+    if priority is not None and priority not in minter.priority_lanes():
+        abort(400, 'bad priority')
+    return priority
+
+
+def _get_callback_url():
+    callback_url = request.args.get('callback_url')
+    if callback_url is not None:
+        try:
+            validate_callback_url(callback_url)
+        except ValueError:
+            abort(400, 'bad callback_url')
+    return callback_url
+
+
+def _get_optional_int(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        abort(400, 'bad ' + name)
+
+
 def _validate_address(address):
-    if not Web3.isAddress(address):
+    if not is_address(address):
         abort(400, 'bad address')
     return address
 
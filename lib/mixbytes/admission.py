@@ -0,0 +1,158 @@
+
+import logging
+import threading
+from time import time
+
+import redis.exceptions
+
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionController(object):
+    """
+    Protects the service (and the node behind it) from being overwhelmed by status polling.
+
+    Status requests are admitted by per-client and global token buckets kept in redis (so limits hold across
+    workers and hosts), and are shed altogether while the minting account has too many pending transactions
+    or the node is too slow. Mint requests are never shed, so they keep flowing under overload.
+    """
+
+    # Refills the bucket in KEYS[1] and takes ARGV[3] tokens if possible.
+    # ARGV: rate (tokens per second), capacity, cost.
+    # Returns {1, 0} if admitted, {0, seconds to wait} otherwise.
+    # Time is taken from redis, clocks of the hosts sharing the buckets may differ.
+    _TOKEN_BUCKET_SCRIPT = """
+        if redis.replicate_commands then
+            redis.replicate_commands()  -- TIME before writes, needed before redis 5
+        end
+        local rate = tonumber(ARGV[1])
+        local capacity = tonumber(ARGV[2])
+        local cost = tonumber(ARGV[3])
+        local time = redis.call('time')
+        local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+        local bucket = redis.call('hmget', KEYS[1], 'tokens', 'ts')
+        local tokens = tonumber(bucket[1]) or capacity
+        local ts = tonumber(bucket[2]) or now
+        tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+
+        local admitted = 0
+        local retry_after = 0
+        if tokens >= cost then
+            tokens = tokens - cost
+            admitted = 1
+        else
+            retry_after = (cost - tokens) / rate
+        end
+
+        redis.call('hset', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+        redis.call('pexpire', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+        return {admitted, tostring(retry_after)}
+    """
+
+    def __init__(self, redis_client, conf, pending_transactions_fn=None, node_latency_fn=None):
+        """
+        :param conf: admission section of the configuration
+        :param pending_transactions_fn: callable returning number of pending transactions of the minting account
+        :param node_latency_fn: callable returning typical node latency in seconds
+        """
+        self._redis = redis_client
+        # proxies in front of the service, each appending the address of its peer to X-Forwarded-For
+        self._trusted_proxies = int(conf.get('trusted_proxies', 0))
+        if 'client_header' in conf:
+            logger.warning('admission: client_header setting is not supported anymore, see trusted_proxies')
+        self._script = redis_client.register_script(self._TOKEN_BUCKET_SCRIPT)
+
+        self._client_rate = float(conf.get('client_rate', 20))
+        self._client_burst = float(conf.get('client_burst', self._client_rate * 2))
+        self._global_rate = conf.get('global_rate')
+        self._global_burst = conf.get('global_burst')
+        if self._global_rate is not None:
+            self._global_rate = float(self._global_rate)
+            self._global_burst = float(self._global_burst or self._global_rate * 2)
+
+        self._max_pending_transactions = conf.get('max_pending_transactions')
+        self._max_node_latency = conf.get('max_node_latency')
+        self._shed_retry_after = float(conf.get('shed_retry_after', 5))
+        self._load_check_interval = float(conf.get('load_check_interval', 1))
+
+        self._pending_transactions_fn = pending_transactions_fn
+        self._node_latency_fn = node_latency_fn
+
+        self._load_lock = threading.Lock()
+        self._load_checked_at = 0
+        self._overloaded = False
+
+    def client_id(self, remote_addr, forwarded_for=None):
+        """
+        Identifies the client of a request: by the address the outermost trusted proxy has seen
+        (entries added before it are sent by the client, so anything can be there), or by the remote address
+        if there are no trusted proxies
+        :param remote_addr: address of the peer
+        :param forwarded_for: value of X-Forwarded-For header
+        :return: str
+        """
+        if self._trusted_proxies > 0:
+            forwarded = [address.strip() for address in (forwarded_for or '').split(',') if address.strip()]
+            if len(forwarded) >= self._trusted_proxies:
+                return forwarded[-self._trusted_proxies]
+            # a proxy hasn't added the header: the request came around the proxies
+        return remote_addr or 'unknown'
+
+    def admit(self, client_id, cost=1):
+        """
+        Decides on a status request
+        :param client_id: str identifying the client (e.g. its address)
+        :param cost: tokens the request takes
+        :return: None if admitted, otherwise seconds after which the client may retry
+        """
+        if self._is_overloaded():
+            return self._shed_retry_after
+
+        try:
+            retry_after = self._take(b'adm:c:' + client_id.encode('utf-8'),
+                                     self._client_rate, self._client_burst, cost)
+            if retry_after is None and self._global_rate is not None:
+                retry_after = self._take(b'adm:g', self._global_rate, self._global_burst, cost)
+        except redis.exceptions.RedisError as exc:
+            logger.warning('could not contact redis, admitting without limits: %s', exc)
+            return None
+
+        return retry_after
+
+
+    def _take(self, key, rate, capacity, cost):
+        admitted, retry_after = self._script(keys=[key], args=[rate, capacity, cost])
+        return None if admitted else float(retry_after)
+
+    def _is_overloaded(self):
+        # Load is estimated at most once per load_check_interval, by one thread at a time.
+        if time() - self._load_checked_at < self._load_check_interval:
+            return self._overloaded
+        if not self._load_lock.acquire(blocking=False):
+            return self._overloaded
+        try:
+            self._load_checked_at = time()
+            self._overloaded = self._check_load()
+        finally:
+            self._load_lock.release()
+        return self._overloaded
+
+    def _check_load(self):
+        try:
+            if self._max_pending_transactions is not None and self._pending_transactions_fn is not None:
+                pending = self._pending_transactions_fn()
+                if pending > int(self._max_pending_transactions):
+                    logger.warning('shedding status requests: %d pending transactions', pending)
+                    return True
+
+            if self._max_node_latency is not None and self._node_latency_fn is not None:
+                latency = self._node_latency_fn()
+                if latency is not None and latency > float(self._max_node_latency):
+                    logger.warning('shedding status requests: node latency %.3fs', latency)
+                    return True
+        except Exception as exc:
+            logger.warning('could not estimate load: %s', exc)
+
+        return False
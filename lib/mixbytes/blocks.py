@@ -0,0 +1,256 @@
+
+import os
+import logging
+import threading
+from time import time
+from collections import OrderedDict
+
+from web3 import Web3
+
+
+logger = logging.getLogger(__name__)
+
+
+class HeadTracker(object):
+    """
+    Follows blockchain head in a background thread and wakes up everybody interested in new blocks.
+    The node is polled once per process no matter how many waiters there are.
+    """
+
+    def __init__(self, w3, poll_interval=1):
+        self._w3 = w3
+        self._poll_interval = poll_interval
+
+        self._cond = threading.Condition()
+        self._head = None
+        self._listeners = []
+
+        self._thread = None
+        self._pid = None
+        self._stopped = threading.Event()
+
+    @property
+    def head(self):
+        """
+        :return: last seen block number or None if the node was not polled yet
+        """
+        self.ensure_started()
+        return self._head
+
+    def wait_for_change(self, known_head, timeout):
+        """
+        Blocks until head differs from known_head.
+        :param known_head: block number known to the caller (or None)
+        :param timeout: seconds to wait
+        :return: current head (which may be equal to known_head in case of timeout)
+        """
+        self.ensure_started()
+        with self._cond:
+            self._cond.wait_for(lambda: self._head is not None and self._head != known_head, timeout)
+            return self._head
+
+    def add_listener(self, listener):
+        """
+        Registers callable to be invoked in the tracker thread as listener(previous_head, new_head)
+        on every head change. previous_head is None for the first observed block.
+        """
+        with self._cond:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self._cond:
+            self._listeners.remove(listener)
+
+    def stop(self):
+        """
+        Stops polling the node for good: the head isn't updated anymore, waiters wake up only on their timeouts.
+        """
+        self._stopped.set()
+
+
+    def ensure_started(self):
+        # Threads do not survive fork(), so the tracker has to be (re)started in the process which uses it.
+        if self._thread is not None and self._pid == os.getpid() or self._stopped.is_set():
+            return
+        with self._cond:
+            if self._thread is not None and self._pid == os.getpid() or self._stopped.is_set():
+                return
+            self._head = None
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='HeadTracker', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                head = self._w3.eth.blockNumber
+            except Exception as exc:
+                logger.warning('could not get block number: %s', exc)
+                head = None
+
+            if head is not None and head != self._head:
+                with self._cond:
+                    previous, self._head = self._head, head
+                    self._cond.notify_all()
+                    listeners = list(self._listeners)
+
+                for listener in listeners:
+                    try:
+                        listener(previous, head)
+                    except Exception:
+                        logger.exception('head listener failed')
+
+            self._stopped.wait(self._poll_interval)
+
+
+class ReceiptWaiter(object):
+    """
+    Waits for transaction receipts on behalf of any number of threads.
+    All outstanding waits are resolved on a new block at once: its transactions are matched against the waited ones,
+    so the node is asked for a block per block instead of a receipt per waiter per poll.
+    """
+
+    # Blocks are checked one by one unless the head jumped too far (e.g. after a pause), in which case it's cheaper
+    # to ask for receipts directly.
+    MAX_BLOCKS_TO_SCAN = 16
+
+    def __init__(self, w3, head_tracker, recheck_interval=30):
+        self._w3 = w3
+        self._head_tracker = head_tracker
+        self._recheck_interval = recheck_interval
+
+        self._lock = threading.Lock()
+        self._waits = dict()    # tx hash -> list of _ReceiptWait
+
+        head_tracker.add_listener(self._on_new_head)
+
+    def wait(self, tx_hash, timeout=None):
+        """
+        Blocks until transaction is mined
+        :param tx_hash: hash of the transaction
+        :param timeout: seconds to wait (None - forever)
+        :return: receipt
+        """
+        tx_hash = _normalize_tx_hash(tx_hash)
+        deadline = None if timeout is None else time() + timeout
+
+        wait = _ReceiptWait()
+        with self._lock:
+            self._waits.setdefault(tx_hash, []).append(wait)
+        self._head_tracker.ensure_started()
+
+        try:
+            while True:
+                # Checking directly once in a while: the transaction could have been mined before we registered,
+                # or in a block which was replaced by a reorg while we were looking at it.
+                receipt = self._w3.eth.getTransactionReceipt(tx_hash)
+                if receipt is not None:
+                    return receipt
+
+                remaining = None if deadline is None else deadline - time()
+                if remaining is not None and remaining <= 0:
+                    raise ReceiptTimeoutError(tx_hash)
+
+                if wait.event.wait(self._recheck_interval if remaining is None
+                                   else min(remaining, self._recheck_interval)):
+                    return wait.receipt
+        finally:
+            with self._lock:
+                waits = self._waits.get(tx_hash, [])
+                if wait in waits:
+                    waits.remove(wait)
+                if not waits:
+                    self._waits.pop(tx_hash, None)
+
+
+    def _on_new_head(self, previous, head):
+        with self._lock:
+            if not self._waits:
+                return
+            waited = set(self._waits)
+
+        if previous is None or not 0 < head - previous <= self.MAX_BLOCKS_TO_SCAN:
+            mined = waited
+        else:
+            mined = set()
+            for block_number in range(previous + 1, head + 1):
+                block = self._w3.eth.getBlock(block_number)
+                if block is not None:
+                    mined.update(waited.intersection(_normalize_tx_hash(tx) for tx in block.transactions))
+
+        for tx_hash in mined:
+            receipt = self._w3.eth.getTransactionReceipt(tx_hash)
+            if receipt is None:
+                continue
+            with self._lock:
+                waits = self._waits.get(tx_hash, [])
+                for wait in waits:
+                    wait.receipt = receipt
+                    wait.event.set()
+
+
+class SharedResults(object):
+    """
+    Shares results of computations between threads asking for the same key (e.g. status of a mint at a block):
+    the value is computed by the first thread, the rest wait for it. The latest max_entries results are kept.
+    """
+
+    def __init__(self, max_entries=4096):
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._results = OrderedDict()   # key -> _SharedResult, oldest first
+
+    def get(self, key, compute_fn):
+        """
+        :param key: hashable key of the result
+        :param compute_fn: callable computing the result, called once for the key unless it fails
+        :return: result of compute_fn()
+        """
+        while True:
+            with self._lock:
+                result = self._results.get(key)
+                owner = result is None
+                if owner:
+                    result = self._results[key] = _SharedResult()
+                    while len(self._results) > self._max_entries:
+                        self._results.popitem(last=False)
+
+            if owner:
+                try:
+                    result.value = compute_fn()
+                    result.computed = True
+                finally:
+                    if not result.computed:
+                        # the rest try on their own
+                        with self._lock:
+                            if self._results.get(key) is result:
+                                del self._results[key]
+                    result.event.set()
+                return result.value
+
+            result.event.wait()
+            if result.computed:
+                return result.value
+
+
+class ReceiptTimeoutError(RuntimeError):
+    def __init__(self, tx_hash):
+        super().__init__('transaction {} was not mined in time'.format(tx_hash))
+        self.tx_hash = tx_hash
+
+
+class _SharedResult(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.computed = False
+        self.value = None
+
+
+class _ReceiptWait(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.receipt = None
+
+
+def _normalize_tx_hash(tx_hash):
+    return (Web3.toHex(tx_hash) if isinstance(tx_hash, bytes) else tx_hash).lower()
@@ -0,0 +1,229 @@
+
+import os
+import csv
+import json
+import logging
+from collections import deque, Counter
+from time import time
+
+from web3 import Web3
+
+from mixbytes.minter import get_receipt_status
+from mixbytes.blocks import ReceiptTimeoutError
+
+
+logger = logging.getLogger(__name__)
+
+
+class BulkMinter(object):
+    """
+    Mints tokens for every row of a CSV (mint_id,address,amount) or JSONL ({"mint_id":..., "address":..., "amount":...})
+    file, e.g. for airdrops.
+
+    Transactions are sent one after another with locally assigned nonces, without waiting for them to be mined,
+    but no more than max_in_flight of them are unmined at a time. A transaction which is not mined
+    within receipt_timeout is recorded as unresolved and left to the operator.
+    Progress is recorded in a checkpoint file next to the input, so a restarted run skips rows which were sent.
+    """
+
+    PROGRESS_EVERY = 100
+
+    def __init__(self, minter, max_in_flight=50, priority=None, receipt_timeout=600):
+        """
+        :param receipt_timeout: seconds to wait for a transaction to be mined
+        """
+        self._minter = minter
+        self._max_in_flight = max_in_flight
+        self._priority = priority
+        self._receipt_timeout = receipt_timeout
+
+    def validate(self, filename):
+        """
+        Checks all rows in a streaming pass
+        :return: tuple (number of rows, list of error messages)
+        """
+        errors = []
+        seen_mint_ids = set()
+        rows = 0
+        for row_number, row in read_rows(filename):
+            rows += 1
+            error = _validate_row(row)
+            if error is None and row['mint_id'] in seen_mint_ids:
+                error = 'duplicate mint_id'
+            if error is not None:
+                errors.append('row {}: {}'.format(row_number, error))
+            else:
+                seen_mint_ids.add(row['mint_id'])
+        return rows, errors
+
+    def run(self, filename, progress_fn=None):
+        """
+        Sends all rows which were not sent by the previous runs and waits for them to be mined
+        :param progress_fn: optional callable(stats, seconds elapsed) invoked periodically
+        :return: Counter of outcomes: mined, failed, unresolved (not mined in time), skipped (sent by a previous run)
+        """
+        checkpoint = _Checkpoint(filename + '.checkpoint')
+        stats = Counter()
+        in_flight = deque()
+        nonce = None
+        started = time()
+
+        try:
+            for row_number, row in read_rows(filename):
+                if row_number <= checkpoint.sent_upto:
+                    stats['skipped'] += 1
+                    continue
+
+                error = _validate_row(row)
+                if error is not None:
+                    raise ValueError('row {}: {}'.format(row_number, error))
+
+                if row_number == checkpoint.interrupted and \
+                        self._minter.get_minting_status(row['mint_id'])['status'] != 'not_minted':
+                    # the previous run crashed right after sending it
+                    # (if it crashed before remembering the transaction, the row is sent again: it costs gas,
+                    # but the contract mints it only once)
+                    stats['skipped'] += 1
+                    checkpoint.sent(row_number, None)
+                    continue
+
+                while len(in_flight) >= self._max_in_flight:
+                    self._wait_mined(checkpoint, in_flight.popleft(), stats)
+
+                if nonce is None:
+                    nonce = self._minter.next_nonce()
+
+                # The row which is being sent has to survive a crash, so it's synced. That makes the "sent" records
+                # written before it durable too, so they are not synced.
+                checkpoint.sending(row_number)
+                tx_hash, nonce = self._send(row, nonce)
+                checkpoint.sent(row_number, tx_hash)
+                in_flight.append((row_number, tx_hash))
+
+                stats['sent'] += 1
+                if progress_fn is not None and 0 == stats['sent'] % self.PROGRESS_EVERY:
+                    progress_fn(stats, time() - started)
+
+            while in_flight:
+                self._wait_mined(checkpoint, in_flight.popleft(), stats)
+        finally:
+            checkpoint.close()
+
+        if progress_fn is not None:
+            progress_fn(stats, time() - started)
+        return stats
+
+
+    def _send(self, row, nonce):
+        try:
+            return self._minter.mint_tokens(row['mint_id'], row['address'], row['amount'],
+                                            priority=self._priority, nonce=nonce), nonce + 1
+        except ValueError as exc:
+            if 'nonce' not in str(exc).lower():
+                raise
+            # somebody else is sending from the account too
+            nonce = self._minter.next_nonce()
+            logger.warning('nonce conflict, continuing with %d: %s', nonce, exc)
+            return self._minter.mint_tokens(row['mint_id'], row['address'], row['amount'],
+                                            priority=self._priority, nonce=nonce), nonce + 1
+
+    def _wait_mined(self, checkpoint, sent, stats):
+        row_number, tx_hash = sent
+        try:
+            receipt = self._minter.receipt_waiter().wait(tx_hash, self._receipt_timeout)
+        except ReceiptTimeoutError:
+            logger.warning('row %d: transaction %s was not mined in %ds', row_number, tx_hash, self._receipt_timeout)
+            checkpoint.unresolved(row_number, tx_hash)
+            stats['unresolved'] += 1
+            return
+        stats['mined' if get_receipt_status(receipt) else 'failed'] += 1
+
+
+def read_rows(filename):
+    """
+    Streams rows of the input file
+    :return: generator of tuples (row number, dict with mint_id, address, amount)
+    """
+    with open(filename, newline='') as fh:
+        if filename.endswith('.csv'):
+            row_number = 0
+            for values in csv.reader(fh):
+                if not values or (0 == row_number and values[:3] == ['mint_id', 'address', 'amount']):
+                    continue    # empty line or header
+                row_number += 1
+                yield row_number, dict(zip(('mint_id', 'address', 'amount'), values))
+        else:
+            row_number = 0
+            for line in fh:
+                if not line.strip():
+                    continue
+                row_number += 1
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield row_number, row if isinstance(row, dict) else {}
+
+
+def _validate_row(row):
+    mint_id = row.get('mint_id')
+    if not isinstance(mint_id, str) or 0 == len(mint_id):
+        return 'bad mint_id'
+    if not isinstance(row.get('address'), str) or not Web3.isAddress(row['address']):
+        return 'bad address'
+    try:
+        amount = int(row.get('amount'))
+    except (TypeError, ValueError):
+        return 'bad amount'
+    if amount <= 0:
+        return 'bad amount'
+    row['amount'] = amount
+    return None
+
+
+class _Checkpoint(object):
+    """
+    Append-only log of the progress: {"sending": row} before a row is sent (synced), {"sent": row, "tx": hash} after,
+    {"unresolved": row, "tx": hash} if the transaction was not mined in time.
+    Rows are sent in order, so the log boils down to the last sent row and, maybe, the row which was being sent
+    when the previous run crashed.
+    """
+
+    def __init__(self, filename):
+        self.sent_upto = 0
+        self.interrupted = None
+
+        if os.path.isfile(filename):
+            with open(filename) as fh:
+                for line in fh:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break   # torn write
+                    if 'sending' in record:
+                        self.interrupted = record['sending']
+                    elif 'sent' in record:
+                        self.sent_upto = max(self.sent_upto, record['sent'])
+                        self.interrupted = None
+
+        self._fh = open(filename, 'a')
+
+    def sending(self, row_number):
+        self._write({'sending': row_number}, True)
+
+    def sent(self, row_number, tx_hash):
+        self._write({'sent': row_number, 'tx': tx_hash}, False)
+
+    def unresolved(self, row_number, tx_hash):
+        self._write({'unresolved': row_number, 'tx': tx_hash}, True)
+
+    def close(self):
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        self._fh.close()
+
+    def _write(self, record, sync):
+        self._fh.write(json.dumps(record) + '\n')
+        self._fh.flush()
+        if sync:
+            os.fsync(self._fh.fileno())
@@ -44,6 +44,14 @@ class ConfigurationBase(object):
             except ValueError:
                 raise ValueError(name + ' is not an integer')
 
+    def _check_numbers(self, names):
+        self._check_existence(names)
+        for name in names if isinstance(names, (list, tuple)) else (names, ):
+            try:
+                float(self._conf[name])
+            except ValueError:
+                raise ValueError(name + ' is not a number')
+
     def _check_dirs(self, names, writable=False):
         self._check_strings(names)
         for name in names if isinstance(names, (list, tuple)) else (names, ):
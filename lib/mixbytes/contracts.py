@@ -0,0 +1,49 @@
+
+import os
+import json
+import threading
+
+
+# Truffle artifacts carry sources, AST and debugging data, the service needs only these.
+MINIMAL_FIELDS = ('contractName', 'abi', 'bytecode')
+MINIMAL_SUFFIX = '.min.json'
+
+_cache = dict()
+_cache_lock = threading.Lock()
+
+
+def minimize_built_contract(contracts_directory, contract_name):
+    """
+    Writes <contract_name>.min.json next to the truffle artifact <contract_name>.json (done by bin/deploy)
+    """
+    with open(os.path.join(contracts_directory, contract_name + '.json')) as fh:
+        artifact = json.load(fh)
+
+    minimal = {name: artifact[name] for name in MINIMAL_FIELDS if name in artifact}
+    if 'bytecode' not in minimal:
+        minimal['bytecode'] = artifact['unlinked_binary']     # older truffle
+
+    with open(os.path.join(contracts_directory, contract_name + MINIMAL_SUFFIX), 'w') as fh:
+        json.dump(minimal, fh, separators=(',', ':'))
+
+
+def load_built_contract(contracts_directory, contract_name):
+    """
+    Loads compiled contract, preferring the minimal version. Contracts are parsed once per process
+    (and inherited by forked uwsgi workers), callers must not modify the result.
+    :return: dict with abi and bytecode
+    """
+    path = os.path.join(contracts_directory, contract_name)
+    try:
+        return _cache[path]
+    except KeyError:
+        pass
+
+    with _cache_lock:
+        if path not in _cache:
+            filename = path + MINIMAL_SUFFIX
+            if not os.path.isfile(filename):
+                filename = path + '.json'
+            with open(filename) as fh:
+                _cache[path] = json.load(fh)
+        return _cache[path]
@@ -0,0 +1,47 @@
+
+import threading
+from contextlib import contextmanager
+from time import time
+
+
+_local = threading.local()
+
+
+@contextmanager
+def deadline(seconds):
+    """
+    Limits the time of everything done by the current thread within the block: node and redis calls check remaining().
+    Nested deadlines can only make the current one tighter.
+    :param seconds: time limit (None - no limit)
+    """
+    previous = getattr(_local, 'deadline', None)
+    if seconds is not None:
+        _local.deadline = time() + seconds if previous is None else min(previous, time() + seconds)
+    try:
+        yield
+    finally:
+        _local.deadline = previous
+
+
+def remaining():
+    """
+    :return: seconds left till the deadline of the current thread (None - no deadline)
+    :raises DeadlineExceededError: if the deadline has passed
+    """
+    current = getattr(_local, 'deadline', None)
+    if current is None:
+        return None
+
+    left = current - time()
+    if left <= 0:
+        raise DeadlineExceededError()
+    return left
+
+
+def check():
+    remaining()
+
+
+class DeadlineExceededError(RuntimeError):
+    def __init__(self):
+        super().__init__('deadline exceeded')
@@ -0,0 +1,213 @@
+
+import os
+import json
+import binascii
+import fcntl
+import logging
+import threading
+from time import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class MintJournal(object):
+    """
+    Append-only local journal of sent mints: the record of a transaction survives a crash between sending it
+    and indexing it in redis (or a redis failure).
+
+    Writes are group-committed: records appended by all threads within max_delay seconds (or max_batch of them)
+    are written and fsync'ed at once by a background thread, so mints don't pay for an fsync each.
+
+    Every process writes its own segment file in the directory and holds an exclusive lock on it. Once a segment
+    has max_segment_records records, the process continues in a new one and unlocks the old one.
+    Unlocked segments (rotated ones and the ones left by dead processes) are replayed by replay(), which is called
+    by a starting process and periodically: records of mined transactions are dropped.
+
+    Intents are not synced (that would cost the mint another fsync), so a mint which was being sent when the process
+    died is not necessarily reported by replay(), and after a power loss the last intents are lost. Only the
+    blockchain knows if such mints were sent.
+    """
+
+    def __init__(self, directory, max_delay=0.005, max_batch=512, max_segment_records=10000):
+        self._directory = directory
+        self._max_delay = max_delay
+        self._max_batch = max_batch
+        self._max_segment_records = max_segment_records
+
+        self._cond = threading.Condition()
+        self._buffer = []       # tuples (line, outcome): outcome is [None] till the line is written, then [error]
+        self._writing = False
+
+        self._fd = None
+        self._segment_records = 0
+        self._thread = None
+        self._pid = None
+
+    def intent(self, mint_id):
+        """
+        Records that a mint is about to be sent (doesn't wait for the record to be written, nor syncs it)
+        :param mint_id: prepared mint id (bytes)
+        """
+        self._append({'t': 'i', 'm': _hex(mint_id), 'ts': int(time())}, durable=False)
+
+    def sent(self, mint_id, tx_hash):
+        """
+        Records that a mint was sent, returns when the record is durable
+        :param mint_id: prepared mint id (bytes)
+        :param tx_hash: hex hash of the transaction
+        :raises OSError: if the journal could not be written
+        """
+        self._append({'t': 's', 'm': _hex(mint_id), 'tx': tx_hash, 'ts': int(time())}, durable=True)
+
+    def replay(self, resolve_fn):
+        """
+        Processes segments which are not written anymore: of dead processes and rotated ones
+        :param resolve_fn: callable(mint_id, tx_hash, sent_at) returning True if the sent transaction needs no more
+                           tracking (it was indexed and mined or dropped), False if it's still pending
+        :return: number of pending transactions left in the replayed segments
+        """
+        os.makedirs(self._directory, exist_ok=True)
+        pending_total = 0
+
+        for name in sorted(os.listdir(self._directory)):
+            if not name.endswith('.log'):
+                continue
+            path = os.path.join(self._directory, name)
+            with open(path, 'r+') as fh:
+                try:
+                    fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue    # its process is alive
+                if 0 == os.fstat(fh.fileno()).st_nlink:
+                    continue    # replayed by another process while we were opening it
+
+                sent, unsent = _read_segment(fh)
+                for mint_id in unsent:
+                    logger.warning('mint %s was about to be sent when the process died, '
+                                   'its status is known only by the blockchain', mint_id)
+
+                pending = [record for record in sent
+                           if not resolve_fn(binascii.unhexlify(record['m']), record['tx'], record['ts'])]
+                pending_total += len(pending)
+
+                if pending:
+                    # still tracked by the next replay
+                    fh.seek(0)
+                    fh.truncate()
+                    fh.write(''.join(json.dumps(record) + '\n' for record in pending))
+                    fh.flush()
+                    os.fsync(fh.fileno())
+                else:
+                    os.unlink(path)
+
+        return pending_total
+
+    def close(self):
+        with self._cond:
+            if self._fd is not None and self._pid == os.getpid():
+                self._cond.wait_for(lambda: not self._buffer and not self._writing, 10)
+                os.close(self._fd)
+            self._fd = None
+
+
+    def _append(self, record, durable):
+        self._ensure_started()
+        line = (json.dumps(record) + '\n').encode('utf-8')
+        outcome = [None]
+        with self._cond:
+            self._buffer.append((line, outcome))
+            self._cond.notify_all()
+
+            if durable:
+                self._cond.wait_for(lambda: outcome[0] is not None)
+                if outcome[0] is not True:
+                    raise outcome[0]
+
+    def _ensure_started(self):
+        # Threads do not survive fork(), so every process opens its own segment.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._fd = self._open_segment()
+            self._segment_records = 0
+            self._buffer = []
+            self._writing = False
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='MintJournal', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._buffer)
+                # letting concurrent mints join the batch
+                self._cond.wait_for(lambda: len(self._buffer) >= self._max_batch, self._max_delay)
+                batch, self._buffer = self._buffer, []
+                self._writing = True
+                fd = self._fd
+
+            result = True
+            try:
+                os.write(fd, b''.join(line for line, _ in batch))
+                _fdatasync(fd)
+            except OSError as exc:
+                logger.error('could not write mint journal: %s', exc)
+                result = exc
+
+            with self._cond:
+                for _, outcome in batch:
+                    outcome[0] = result
+                self._segment_records += len(batch)
+                if self._segment_records >= self._max_segment_records and self._fd is not None:
+                    self._rotate()
+                self._writing = False
+                self._cond.notify_all()
+
+    def _rotate(self):
+        # The full segment is unlocked, so that replay() compacts it.
+        try:
+            fd = self._open_segment()
+        except OSError as exc:
+            logger.error('could not rotate mint journal: %s', exc)
+            return
+        os.close(self._fd)
+        self._fd = fd
+        self._segment_records = 0
+
+    def _open_segment(self):
+        os.makedirs(self._directory, exist_ok=True)
+        path = os.path.join(self._directory, '{}.{:x}'.format(os.getpid(), int(time() * 1000000)))
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        # only locked segments are visible to replay()
+        os.rename(path, path + '.log')
+        return fd
+
+
+def _read_segment(fh):
+    """
+    :return: tuple (list of sent records, list of hex ids of mints which were being sent)
+    """
+    sent = []
+    intents = dict()
+    for line in fh:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            break   # torn write of the last batch
+        if 'i' == record['t']:
+            intents[record['m']] = record
+        else:
+            intents.pop(record['m'], None)
+            sent.append(record)
+    return sent, list(intents)
+
+
+def _hex(data):
+    return binascii.hexlify(data).decode('ascii')
+
+
+_fdatasync = getattr(os, 'fdatasync', os.fsync)
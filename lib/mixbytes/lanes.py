@@ -0,0 +1,180 @@
+
+import logging
+import threading
+import itertools
+from contextlib import contextmanager
+from time import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class MintScheduler(object):
+    """
+    Orders sending of mint transactions by priority lanes.
+
+    Each lane has a priority (lower is more important), a gas price tier and a share of sending concurrency.
+    When a sending slot frees up it goes to the most important waiting mint whose lane is not over its share.
+    A lane with max_gas_price waits until network gas price drops to it, so bulk mints run opportunistically
+    when gas is cheap.
+
+    Sending slots only cover sending. Transactions sent but not yet mined are limited service-wide by max_pending:
+    the pending transactions of the minting account, whoever has sent them. A lane with a lower max_pending stops
+    sending earlier, leaving room for more important lanes.
+
+    Nothing waits for longer than max_wait of its lane.
+
+    All transactions share the nonce sequence of the minting account, and a transaction can't be mined before
+    the ones with lower nonces: a bulk mint which became underpriced (gas price went up after it was sent) holds up
+    the mints sent after it, critical ones included, until gas price drops back. Keep max_pending of bulk lanes low
+    to limit how many transactions can get stuck that way.
+    """
+
+    DEFAULT_LANE = 'normal'
+
+    # seconds, default max_wait of a lane
+    DEFAULT_MAX_WAIT = 30
+
+    def __init__(self, conf, gas_price_fn, head_tracker, pending_transactions_fn=None):
+        """
+        :param conf: priority_lanes section of the configuration
+        :param gas_price_fn: callable returning current network gas price
+        :param head_tracker: HeadTracker to wait for cheaper gas and mined transactions with
+        :param pending_transactions_fn: callable returning number of pending transactions of the minting account
+                                        (None - not limited)
+        """
+        self._gas_price_fn = gas_price_fn
+        self._head_tracker = head_tracker
+        self._pending_transactions_fn = pending_transactions_fn
+
+        self._max_concurrency = conf.get('max_concurrency')
+        self._default_lane = conf.get('default', self.DEFAULT_LANE)
+
+        lanes_conf = conf.get('lanes') or {self.DEFAULT_LANE: {}}
+        self._lanes = dict()
+        for name, lane_conf in lanes_conf.items():
+            self._lanes[name] = _Lane(name, lane_conf or dict(), self._max_concurrency, conf.get('max_pending'),
+                                      self.DEFAULT_MAX_WAIT)
+        if self._default_lane not in self._lanes:
+            raise ValueError('default priority lane {} is not configured'.format(self._default_lane))
+
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._waiting = []      # tickets: (priority, sequence number, lane)
+        self._sequence = itertools.count()
+
+    @property
+    def lanes(self):
+        return sorted(self._lanes)
+
+    @contextmanager
+    def slot(self, lane_name=None):
+        """
+        Waits for the turn of a mint in the lane
+        :param lane_name: priority lane (None - default one)
+        :return: context manager yielding gas price to send the transaction with
+        :raises LaneBusyError: if the mint could not be sent within max_wait of the lane
+        """
+        lane = self._get_lane(lane_name)
+        deadline = time() + lane.max_wait
+
+        network_gas_price = self._wait_for_chain(lane, deadline)
+        self._acquire(lane, deadline)
+        try:
+            if lane.max_gas_price is not None:
+                # the price could change while we were waiting in the queue
+                network_gas_price = self._gas_price_fn()
+            yield lane.gas_price(network_gas_price)
+        finally:
+            self._release(lane)
+
+
+    def _get_lane(self, lane_name):
+        lane_name = lane_name or self._default_lane
+        if lane_name not in self._lanes:
+            raise ValueError('unknown priority lane: {}'.format(lane_name))
+        return self._lanes[lane_name]
+
+    def _wait_for_chain(self, lane, deadline):
+        # Waits for gas price to drop to max_gas_price of the lane and pending transactions to fit in its max_pending,
+        # both change with new blocks.
+        head = None
+        while True:
+            gas_price = self._gas_price_fn()
+            busy = None
+            if lane.max_gas_price is not None and gas_price > lane.max_gas_price:
+                busy = 'gas price {} is above {}'.format(gas_price, lane.max_gas_price)
+            elif lane.max_pending is not None and self._pending_transactions_fn is not None:
+                # mints being sent by this process are not seen by the node yet
+                with self._cond:
+                    in_flight = self._in_flight
+                pending = self._pending_transactions_fn() + in_flight
+                if pending >= lane.max_pending:
+                    busy = '{} transactions are pending'.format(pending)
+            if busy is None:
+                return gas_price
+
+            remaining = deadline - time()
+            if remaining <= 0:
+                raise LaneBusyError(lane.name, busy)
+            head = self._head_tracker.wait_for_change(head, min(remaining, 60))
+
+    def _acquire(self, lane, deadline):
+        ticket = (lane.priority, next(self._sequence), lane)
+        with self._cond:
+            self._waiting.append(ticket)
+            try:
+                while not self._is_turn_of(ticket):
+                    remaining = deadline - time()
+                    if remaining <= 0:
+                        raise LaneBusyError(lane.name, 'too many mints in progress')
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting.remove(ticket)
+                # the next best ticket might be able to go now
+                self._cond.notify_all()
+
+            self._in_flight += 1
+            lane.in_flight += 1
+
+    def _release(self, lane):
+        with self._cond:
+            self._in_flight -= 1
+            lane.in_flight -= 1
+            self._cond.notify_all()
+
+    def _is_turn_of(self, ticket):
+        if self._max_concurrency is not None and self._in_flight >= self._max_concurrency:
+            return False
+        eligible = [waiting for waiting in self._waiting if waiting[2].has_capacity()]
+        return bool(eligible) and min(eligible, key=lambda waiting: waiting[:2]) is ticket
+
+
+class _Lane(object):
+
+    def __init__(self, name, conf, max_concurrency, max_pending, default_max_wait):
+        self.name = name
+        self.priority = int(conf.get('priority', 0))
+        self.gas_price_multiplier = float(conf.get('gas_price_multiplier', 1))
+        self.max_gas_price = None if conf.get('max_gas_price') is None else int(conf['max_gas_price'])
+        self.max_wait = float(conf.get('max_wait') or default_max_wait)
+        max_pending = conf.get('max_pending', max_pending)
+        self.max_pending = None if max_pending is None else int(max_pending)
+
+        share = conf.get('share')
+        self.max_in_flight = None if share is None or max_concurrency is None \
+            else max(1, int(float(share) * int(max_concurrency)))
+        self.in_flight = 0
+
+    def has_capacity(self):
+        return self.max_in_flight is None or self.in_flight < self.max_in_flight
+
+    def gas_price(self, network_gas_price):
+        gas_price = int(network_gas_price * self.gas_price_multiplier)
+        return gas_price if self.max_gas_price is None else min(gas_price, self.max_gas_price)
+
+
+class LaneBusyError(RuntimeError):
+    def __init__(self, lane_name, reason):
+        super().__init__('mint in priority lane {} was not sent: {}'.format(lane_name, reason))
+        self.lane_name = lane_name
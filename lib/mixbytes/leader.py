@@ -0,0 +1,203 @@
+
+import os
+import abc
+import socket
+import logging
+import threading
+import binascii
+from time import sleep, time
+
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderElectionBase(abc.ABC):
+    """
+    Lease-based election of the only service instance allowed to send transactions (i.e. to own the nonce sequence
+    of the minting account), while any instance serves reads.
+
+    An instance is identified by instance_id, which is shared by all worker processes forked from the process
+    which created the election object (uwsgi workers): they hold the lease together and are all leaders.
+
+    The lease is renewed by a background thread of every process every ttl/3 seconds. An instance considers itself
+    a leader only while the lease has at least ttl/3 seconds left, so a leader which stopped renewing steps down
+    before anybody else is able to take over.
+    """
+
+    def __init__(self, key, ttl=10, instance_id=None, clock=time):
+        """
+        :param instance_id: id of the service instance (None - unique id of the instance)
+        :param clock: callable returning current time in seconds
+        """
+        self._key = key
+        self._ttl = float(ttl)
+        self._clock = clock
+
+        self._lease_until = 0
+        self._instance_id = instance_id or '{}:{}:{}'.format(socket.gethostname(), os.getpid(),
+                                                             binascii.hexlify(os.urandom(8)).decode('ascii'))
+        self._thread = None
+        self._pid = None
+        self._creator_pid = os.getpid()
+        self._lock = threading.Lock()
+        self._released = False
+
+    @property
+    def instance_id(self):
+        return self._instance_id
+
+    def is_leader(self):
+        if self._released:
+            return False
+        self._ensure_started()
+        return self._clock() < self._lease_until - self._ttl / 3
+
+    def release(self):
+        """
+        Stops campaigning and gives leadership up (if held) so another instance can take over right away.
+        A forked process shares the lease with the rest of the instance: it only stops renewing it.
+        """
+        self._released = True
+        if self._pid == os.getpid() == self._creator_pid and self._lease_until:
+            try:
+                self._release()
+            except Exception as exc:
+                logger.warning('could not release leadership: %s', exc)
+        self._lease_until = 0
+
+
+    def _ensure_started(self):
+        # Threads do not survive fork(): every process renews the lease of the instance on its own.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._lease_until = 0
+            self._campaign()    # answering the first is_leader() without waiting for the thread
+            self._thread = threading.Thread(target=self._run, name='LeaderElection', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            sleep(self._ttl / 3)
+            if self._released:
+                break
+            self._campaign()
+
+    def _campaign(self):
+        started = self._clock()
+        was_leader = started < self._lease_until
+        try:
+            acquired = self._renew() if was_leader else self._acquire()
+        except Exception as exc:
+            logger.warning('leader election failed: %s', exc)
+            acquired = False
+
+        if acquired:
+            self._lease_until = started + self._ttl
+            if not was_leader:
+                logger.info('%s became the leader of %s', self._instance_id, self._key)
+        elif was_leader:
+            self._lease_until = 0
+            logger.warning('%s lost the leadership of %s', self._instance_id, self._key)
+
+
+    @abc.abstractmethod
+    def _acquire(self):
+        """
+        :return: True if the lease is taken by the instance (or already held by it)
+        """
+
+    @abc.abstractmethod
+    def _renew(self):
+        """
+        :return: True if the lease held by the instance was extended
+        """
+
+    @abc.abstractmethod
+    def _release(self):
+        pass
+
+
+class RedisLeaderElection(LeaderElectionBase):
+    """
+    Leader election by the means of a redis key holding the leader id with expiration.
+    """
+
+    _RENEW_SCRIPT = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('pexpire', KEYS[1], ARGV[2])
+        end
+        return 0
+    """
+
+    _RELEASE_SCRIPT = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('del', KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(self, redis_client, key, ttl=10, instance_id=None, clock=time):
+        super().__init__(key, ttl, instance_id, clock)
+        self._redis = redis_client
+
+    def _acquire(self):
+        # another process of the instance may hold the lease already
+        return bool(self._redis.set(self._key, self._instance_id, nx=True, px=int(self._ttl * 1000))) \
+            or self._renew()
+
+    def _renew(self):
+        return bool(self._redis.eval(self._RENEW_SCRIPT, 1, self._key, self._instance_id, int(self._ttl * 1000)))
+
+    def _release(self):
+        self._redis.eval(self._RELEASE_SCRIPT, 1, self._key, self._instance_id)
+
+
+class LocalLeaderElection(LeaderElectionBase):
+    """
+    Process-local stand-in for RedisLeaderElection (for tests).
+    """
+
+    _leases = dict()    # key -> (instance id, expiration time)
+    _leases_lock = threading.Lock()
+
+    def _acquire(self):
+        with self._leases_lock:
+            holder, expires = self._leases.get(self._key, (None, 0))
+            if holder not in (None, self._instance_id) and expires > self._clock():
+                return False
+            self._leases[self._key] = (self._instance_id, self._clock() + self._ttl)
+            return True
+
+    def _renew(self):
+        with self._leases_lock:
+            holder, expires = self._leases.get(self._key, (None, 0))
+            if holder != self._instance_id or expires <= self._clock():
+                return False
+            self._leases[self._key] = (self._instance_id, self._clock() + self._ttl)
+            return True
+
+    def _release(self):
+        with self._leases_lock:
+            if self._leases.get(self._key, (None, 0))[0] == self._instance_id:
+                del self._leases[self._key]
+
+
+class NoLeaderElection(object):
+    """
+    Single instance deployment: always the leader.
+    """
+
+    def is_leader(self):
+        return True
+
+    def release(self):
+        pass
+
+
+class NotLeaderError(RuntimeError):
+    def __init__(self):
+        super().__init__('This instance is not the leader, transactions are sent by another one')
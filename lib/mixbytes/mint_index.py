@@ -0,0 +1,163 @@
+
+import struct
+import binascii
+
+
+class MintIndex(object):
+    """
+    Index of mint transactions in redis: for every mint - hashes of transactions sent for it and the cached block
+    in which it was processed.
+
+    Mints are spread over a fixed number of buckets, each bucket is a small redis hash, so redis keeps it in its
+    compact (ziplist/listpack) encoding instead of paying per-key overhead for every mint.
+    The bucket number is the hash tag of its key, so buckets are spread evenly over redis cluster nodes.
+    A mint is a field named by 12 bytes of its key; the value is binary: 16 bytes of the block
+    (number, first 8 bytes of the hash, head at which it was last verified; all zeros - unknown)
+    followed by the 32-byte hash of the first transaction. Values are never longer (48 bytes), so they stay under
+    hash-max-ziplist-value (64 by default): hashes of further transactions of the mint (it's re-sent rarely)
+    go to an overflow list of the mint, in the same cluster slot as the bucket.
+    Keep bucket sizes under hash-max-ziplist-entries (128 by default, so with the default 65536 buckets
+    up to ~8M mints are kept compact; raise it or the number of buckets for more).
+    """
+
+    BLOCK_FORMAT = '>I8sI'
+    BLOCK_SIZE = struct.calcsize(BLOCK_FORMAT)
+    TX_HASH_SIZE = 32
+
+    # Adds tx hash ARGV[2] to field ARGV[1] of KEYS[1] (the first one) or to overflow list KEYS[2] (the rest)
+    # unless it's already there.
+    _ADD_TX_SCRIPT = """
+        local value = redis.call('hget', KEYS[1], ARGV[1])
+        if not value or #value < 48 then
+            redis.call('hset', KEYS[1], ARGV[1], (value or string.rep('\\0', 16)) .. ARGV[2])
+            return 1
+        end
+        if string.sub(value, 17, 48) == ARGV[2] then
+            return 0
+        end
+        for _, tx_hash in ipairs(redis.call('lrange', KEYS[2], 0, -1)) do
+            if tx_hash == ARGV[2] then
+                return 0
+            end
+        end
+        redis.call('rpush', KEYS[2], ARGV[2])
+        return 1
+    """
+
+    # Returns field ARGV[1] of KEYS[1] and overflow list KEYS[2].
+    _GET_SCRIPT = """
+        local value = redis.call('hget', KEYS[1], ARGV[1])
+        if not value or #value < 48 then
+            return {value}
+        end
+        return {value, redis.call('lrange', KEYS[2], 0, -1)}
+    """
+
+    # Replaces the block part of field ARGV[1] of KEYS[1] with ARGV[2] if the field exists.
+    _SET_BLOCK_SCRIPT = """
+        local value = redis.call('hget', KEYS[1], ARGV[1])
+        if not value then
+            return 0
+        end
+        redis.call('hset', KEYS[1], ARGV[1], ARGV[2] .. string.sub(value, 17))
+        return 1
+    """
+
+    def __init__(self, redis_client, bucket_key_fn, buckets=65536):
+        """
+        :param bucket_key_fn: callable(name: bytes, hash_tag: bytes) returning redis key of the bucket
+        :param buckets: number of buckets, can't be changed without migrating the index
+        """
+        self._redis = redis_client
+        self._bucket_key_fn = bucket_key_fn
+        self._buckets = buckets
+        self._add_tx_script = redis_client.register_script(self._ADD_TX_SCRIPT)
+        self._get_script = redis_client.register_script(self._GET_SCRIPT)
+        self._set_block_script = redis_client.register_script(self._SET_BLOCK_SCRIPT)
+
+    def add_tx(self, mint_key, tx_hash):
+        """
+        :param mint_key: 32-byte key of the mint (see MinterService._redis_mint_tx_key)
+        :param tx_hash: 32-byte transaction hash
+        :return: True if the transaction was not known
+        """
+        key, field = self._locate(mint_key)
+        return bool(self._add_tx_script(keys=[key, self._overflow_key(key, field)], args=[field, tx_hash]))
+
+    def get(self, mint_key):
+        """
+        :return: tuple (list of tx hashes, block tuple (number, hash prefix, verified at) or None)
+        """
+        key, field = self._locate(mint_key)
+        result = self._get_script(keys=[key, self._overflow_key(key, field)], args=[field])
+        return _unpack(result[0] if result else None, result[1] if len(result) > 1 else [])
+
+    def set_block(self, mint_key, block_number, block_hash, verified_at):
+        """
+        Caches the block of the mint (if the mint is known)
+        :param block_hash: 32-byte hash of the block (only a prefix is kept)
+        """
+        key, field = self._locate(mint_key)
+        self._set_block_script(keys=[key],
+                               args=[field, struct.pack(self.BLOCK_FORMAT, block_number, block_hash[:8], verified_at)])
+
+    def forget_block(self, mint_key):
+        key, field = self._locate(mint_key)
+        self._set_block_script(keys=[key], args=[field, b'\0' * self.BLOCK_SIZE])
+
+    def delete(self, mint_key):
+        key, field = self._locate(mint_key)
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.hdel(key, field)
+        pipe.delete(self._overflow_key(key, field))
+        pipe.execute()
+
+    def migrate_legacy_keys(self, is_ours_fn, scan_count=1000):
+        """
+        Moves mints from the former layout (a redis list of tx hashes per mint, keyed by the 32-byte mint key,
+        and a 'bh'-prefixed string with the block at which the mint was first seen processed) to the index.
+        The blocks are just dropped (they expire in an hour anyway).
+        :param is_ours_fn: callable(list of tx hashes) telling if the transactions were sent to the contract
+                           of the index, the keys don't tell which contract they belong to
+        :return: tuple (number of migrated mints, number of dropped block keys)
+        """
+        migrated = dropped = 0
+        # any 32 bytes
+        for key in self._redis.scan_iter(match=b'?' * 32, count=scan_count):
+            if 32 != len(key) or b'list' != self._redis.type(key):
+                continue
+            tx_hashes = self._redis.lrange(key, 0, -1)
+            if not all(self.TX_HASH_SIZE == len(tx_hash) for tx_hash in tx_hashes) \
+                    or not is_ours_fn(list(reversed(tx_hashes))):
+                continue    # not ours
+            for tx_hash in reversed(tx_hashes):     # lpush'ed, so the oldest is the last
+                self.add_tx(key, tx_hash)
+            self._redis.delete(key)
+            migrated += 1
+            dropped += self._redis.delete(b'bh' + key)
+        return migrated, dropped
+
+
+    def _locate(self, mint_key):
+        """
+        :return: tuple (bucket key, field)
+        """
+        assert 32 == len(mint_key)
+        return self._bucket_key(int.from_bytes(mint_key[:4], 'big') % self._buckets), mint_key[:12]
+
+    def _bucket_key(self, bucket):
+        return self._bucket_key_fn(b'mi', str(bucket).encode('ascii'))
+
+    def _overflow_key(self, bucket_key, field):
+        # the hash tag of the bucket
+        return self._bucket_key_fn(b'mo:' + binascii.hexlify(field), bucket_key[bucket_key.rindex(b'{') + 1:-1])
+
+
+def _unpack(value, overflow):
+    if not value:
+        return [], None
+
+    block = struct.unpack(MintIndex.BLOCK_FORMAT, value[:MintIndex.BLOCK_SIZE])
+    tx_hashes = [value[offset:offset + MintIndex.TX_HASH_SIZE]
+                 for offset in range(MintIndex.BLOCK_SIZE, len(value), MintIndex.TX_HASH_SIZE)]
+    return tx_hashes + list(overflow), None if 0 == block[0] else block
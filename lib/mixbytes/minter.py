@@ -1,10 +1,11 @@
 
 import os
-import json
+import re
 import logging
-import copy
-import stat
-from time import sleep
+import binascii
+import threading
+from time import time
+from functools import lru_cache
 
 import yaml
 from web3 import Web3, HTTPProvider, IPCProvider
@@ -13,61 +14,333 @@ from web3 import Web3, HTTPProvider, IPCProvider
 
 import redis
 import redis.exceptions
+from redis.sentinel import Sentinel, SentinelManagedConnection
+try:
+    from redis.backoff import ExponentialBackoff
+    from redis.cluster import RedisCluster, ClusterNode
+    from redis.retry import Retry
+except ImportError:
+    # redis-py older than 4.1: no cluster, a timed out command is retried once (see retry_on_timeout)
+    RedisCluster = None
 
-from mixbytes.filelock import FileLock, WouldBlockError
 from mixbytes.conf import ConfigurationBase
+from mixbytes.deadline import deadline, check as check_deadline, remaining as deadline_remaining, \
+    DeadlineExceededError
+from mixbytes.state import FileState, RedisState, MemoryState, ReadOnlyState
+from mixbytes.providers import ProviderSet
+from mixbytes.leader import RedisLeaderElection, LocalLeaderElection, NoLeaderElection, NotLeaderError
+from mixbytes.blocks import HeadTracker, ReceiptWaiter, SharedResults
+from mixbytes.admission import AdmissionController
+from mixbytes.lanes import MintScheduler
+from mixbytes.webhooks import WebhookDispatcher, validate_callback_url
+from mixbytes.journal import MintJournal
+from mixbytes.mint_index import MintIndex
+from mixbytes.contracts import load_built_contract
 
 
 logger = logging.getLogger(__name__)
 
+# Hashes of recently seen mint ids: clients poll statuses of the same mints over and over.
+MINT_KEY_CACHE_SIZE = 16384
+
+# Long-poll waiters a process holds at a time (each occupies a thread): 16 threads per process in start-service.sh.
+DEFAULT_MAX_LONG_POLL_WAITERS = 8
+
+# Seconds after which a journaled transaction unknown to the node is considered dropped: until then the node
+# may be lagging behind the one the transaction was sent to.
+JOURNAL_DROPPED_TX_AGE = 3600
+
 class MinterService(object):
-    TX_BLOCK_HEIGHT_KEY_PREFIX = 'bh'
-    def __init__(self, conf_filename, contracts_directory, wsgi_mode=False):
-        self._conf = _Conf(conf_filename)
+    def __init__(self, conf_filename, contracts_directory, wsgi_mode=False, read_only=None, tenant=None,
+                 shared_with=None, exclusive=False):
+        """
+        :param read_only: serve statuses only, without account and state (None - as configured by read_only setting)
+        :param tenant: tenant to serve if the configuration has tenants
+        :param shared_with: MinterService of another tenant to share node and redis connections and head tracker with
+        :param exclusive: wsgi mode instance of a control command sending transactions (bulk_mint),
+                          which refuses to start while the service is running and keeps it from minting till closed
+        :raises UsageError: if exclusive and the service is running
+        """
+        startup = [('', time())]     # (phase, time it was done)
+
+        assert shared_with is None or shared_with.wsgi_mode == wsgi_mode
+        self._conf = _Conf(conf_filename, tenant)
+        self.tenant = tenant
         self.contracts_directory = contracts_directory
         self.wsgi_mode = wsgi_mode
+        self._exclusive = exclusive
+        self.read_only = self._conf.read_only if read_only is None else read_only
+        if self.read_only:
+            self._conf.check_read_only()
+        startup.append(('conf', time()))
+
+        if shared_with is not None:
+            self._redis = shared_with._redis
+        else:
+            self._redis = self._conf.get_redis() if wsgi_mode else None
+        self.__contract_address_keys = None
+        self._mint_index = (MintIndex(self._redis, self._redis_contract_key,
+                                      int(self._conf.get('mint_index', {}).get('buckets', 65536)))
+                            if wsgi_mode else None)
 
-        self._wsgi_mode_state = self._load_state() if wsgi_mode else None
-        self._w3 = self.create_web3()
-        self._redis = self._conf.get_redis() if wsgi_mode else None
+        if wsgi_mode:
+            self._wsgi_mode_state = (
+                ReadOnlyState(self._conf['minter_contract'], self._conf['minter_contract_block_num'])
+                if self.read_only else self._load_state())
+        else:
+            self._wsgi_mode_state = None
+        startup.append(('state', time()))
+
+        # connections and the activities using them belong to the instance which created them, see close()
+        self._owns_connections = shared_with is None
+        if shared_with is not None:
+            self._w3 = shared_with._w3
+            self._head_tracker = shared_with._head_tracker
+            self._receipt_waiter = shared_with._receipt_waiter
+            self._long_poll_slots = shared_with._long_poll_slots
+        else:
+            self._w3 = self.create_web3()
+            self._head_tracker = HeadTracker(self._w3, self._conf.get('head_poll_interval', 1))
+            self._receipt_waiter = ReceiptWaiter(self._w3, self._head_tracker)
+            # waiters of all tenants hold threads of the same process
+            self._long_poll_slots = threading.BoundedSemaphore(
+                int(self._conf.get('max_long_poll_waiters', DEFAULT_MAX_LONG_POLL_WAITERS)))
+        # statuses computed for long-poll waiters, see wait_minting_status
+        self._shared_statuses = SharedResults()
+        self._leader_election = (self._conf.get_leader_election(self._redis)
+                                 if wsgi_mode and not self.read_only else None)
+        self._webhooks = WebhookDispatcher(self, self._redis, self._conf.get('webhooks', {})) if wsgi_mode else None
+        self._mint_scheduler = MintScheduler(
+            self._conf.get('priority_lanes', {}), lambda: self._w3.eth.gasPrice, self._head_tracker,
+            pending_transactions_fn=self.pending_transactions_count if wsgi_mode and not self.read_only else None)
+        startup.append(('web3', time()))
+
+        self._mint_journal = self._conf.get_mint_journal() if wsgi_mode and not self.read_only else None
+        if self._mint_journal is not None:
+            self.replay_mint_journal()
+            startup.append(('journal', time()))
 
         self.__target_contract = None
         if wsgi_mode:
+            # Everything done here is inherited by workers forked after the app is loaded (see after_fork()).
+            if self.is_contract_deployed():
+                self._target_contract()
+                startup.append(('contract', time()))
             self.unlockAccount()
-           
+            if not self.read_only:
+                # transactions are sent through another node from now on
+                self._w3.providers[0].add_local_node_listener(lambda node_name: self.unlockAccount())
+            startup.append(('unlock', time()))
+
+        # the leadership is held till close(), so the service doesn't mint meanwhile
+        if exclusive and not self.is_leader():
+            self.close()
+            raise UsageError('The service is minting (another instance is the leader), stop it first')
+
+        logger.info('%sstarted in %.1fms (%s)', '' if tenant is None else 'tenant {}: '.format(tenant),
+                    (startup[-1][1] - startup[0][1]) * 1000,
+                    ', '.join('{} {:.1f}ms'.format(phase, (done - startup[i][1]) * 1000)
+                              for i, (phase, done) in enumerate(startup[1:])))
+
+    @classmethod
+    def create_tenants(cls, conf_filename, contracts_directory, wsgi_mode=False, read_only=None):
+        """
+        Creates instances for all tenants of the configuration, sharing node and redis connections and head tracker
+        :return: dict tenant name -> MinterService (empty if the configuration has no tenants)
+        """
+        minters = dict()
+        shared_with = None
+        state_locations = set()
+        for tenant in sorted(ConfigurationBase(conf_filename).get('tenants', None) or {}):
+            minter = cls(conf_filename, contracts_directory, wsgi_mode, read_only, tenant, shared_with)
+            state_location = minter._conf.state_location()
+            if state_location is not None and state_location in state_locations:
+                raise UsageError('tenant {} shares state with another tenant', tenant)
+            state_locations.add(state_location)
+            minters[tenant] = shared_with = minter
+        return minters
+
+    @classmethod
+    def create_offline(cls, minter_contract_address):
+        """
+        Creates wsgi mode instance of the contract without configuration and connections: it only derives redis keys
+        (see _redis_contract_key and _redis_mint_tx_key), e.g. for benchmarks
+        """
+        minter = cls.__new__(cls)
+        minter.tenant = None
+        minter.wsgi_mode = True
+        minter.read_only = True
+        minter._wsgi_mode_state = ReadOnlyState(minter_contract_address, 0)
+        minter.__contract_address_keys = None
+        return minter
+
+    def after_fork(self):
+        """
+        To be called in a worker forked from the process which created the instance (e.g. uwsgi postfork hook):
+        drops inherited connections and starts background activities of the worker right away.
+        """
+        pool = getattr(self._redis, 'connection_pool', None)
+        if pool is not None:
+            pool.reset()
+        # so are keep-alive connections to the nodes: web3 keeps a requests.Session per node url
+        try:
+            from web3.utils.compat.compat_requests import _session_cache
+        except ImportError:
+            pass
+        else:
+            _session_cache.clear()
+        self._head_tracker.ensure_started()
+
+    def replay_mint_journal(self):
+        """
+        Puts transactions of the mint journal segments which are not written anymore back to redis
+        and drops records of the mined ones (see MintJournal.replay). Done on start, then to be called periodically.
+        """
+        if self._mint_journal is None:
+            return
+        pending = self._mint_journal.replay(self._replay_mint)
+        if pending:
+            logger.info('%d transactions from the mint journal are still pending', pending)
+
     def unlockAccount(self):
+        if self.read_only:
+            return
         logger.debug("Unlock account %s" % (self._wsgi_mode_state.get_account_address()))
         self._w3.personal.unlockAccount(self._wsgi_mode_state.get_account_address(),
                                         self._wsgi_mode_state['account']['password'],
                                         600)
 
+    def request_deadline(self):
+        """
+        :return: context manager limiting the time of node and redis calls made within it by request_deadline setting
+                 (nested ones share the time of the outermost)
+        """
+        return deadline(self._conf.get('request_deadline', None))
+
     def blockchain_height(self):
-        return self._w3.eth.blockNumber
+        with self.request_deadline():
+            return self._w3.eth.blockNumber
+
+    def get_block(self, block_number):
+        """
+        :return: block with hashes of its transactions or None if there is no such block
+        """
+        with self.request_deadline():
+            return self._w3.eth.getBlock(block_number)
+
+    def priority_lanes(self):
+        """
+        :return: names of configured priority lanes
+        """
+        return self._mint_scheduler.lanes
+
+    def pending_transactions_count(self):
+        """
+        :return: number of sent but not yet mined transactions of the minting account
+        """
+        address = self._wsgi_mode_state.get_account_address()
+        return (self._w3.eth.getTransactionCount(address, 'pending')
+                - self._w3.eth.getTransactionCount(address, 'latest'))
+
+    def node_latency(self):
+        """
+        :return: typical latency of ethereum node requests in seconds (None if unknown)
+        """
+        return self._w3.providers[0].latency()
 
-    def mint_tokens(self, mint_id, address, tokens):
+    @classmethod
+    def create_admission_controller(cls, minters):
+        """
+        Creates admission control shared by instances serving one configuration
+        :param minters: all instances of the configuration (see create_tenants) or the single one
+        :return: AdmissionController configured by admission setting or None if it's absent
+        """
+        # admission is a common setting (see _Conf.COMMON_SETTINGS), node and redis are shared by tenants
+        first = minters[0]
+        assert first.wsgi_mode
+        if 'admission' not in first._conf:
+            return None
+        sending = [minter for minter in minters if not minter.read_only]
+
+        def pending_transactions_count():
+            return sum(minter.pending_transactions_count() for minter in sending)
+
+        return AdmissionController(first._redis, first._conf['admission'],
+                                   pending_transactions_fn=pending_transactions_count if sending else None,
+                                   node_latency_fn=first.node_latency)
+
+    def is_leader(self):
+        """
+        :return: True if this instance is the one sending transactions (see state_backend setting)
+        """
+        return self._leader_election is not None and self._leader_election.is_leader()
+
+    def next_nonce(self):
+        """
+        :return: nonce of the next transaction of the minting account, counting pending ones
+        """
+        return self._w3.eth.getTransactionCount(self._wsgi_mode_state.get_account_address(), 'pending')
+
+    def mint_tokens(self, mint_id, address, tokens, callback_url=None, priority=None, nonce=None):
         """
         Mints tokens
         :param mint_id: str | bytes, unique mint id for the request
         :param address: valid web3 address
         :param tokens: int, tokens to mint (in wei)
+        :param callback_url: optional http(s) url to POST the outcome of minting to (see WebhookDispatcher)
+        :param priority: optional priority lane (see MintScheduler)
+        :param nonce: optional nonce of the transaction, for callers sending many transactions in a row
+                      (by default the node assigns it)
         :return: hash of the transaction
+        :raises LaneBusyError: if the lane could not send the mint in time
+        :raises NotLeaderError: if the instance is not (or stopped being) the leader, nothing is sent then
+        :raises redis.exceptions.RedisError: if callback_url is given and the mint could not be watched,
+                                             nothing is sent then
         """
         assert self.wsgi_mode
+        if self.read_only:
+            raise UsageError('Minting is not possible in read-only mode')
+        if not self.is_leader():
+            raise NotLeaderError()
 
+        if callback_url is not None:
+            validate_callback_url(callback_url)
+
+        original_mint_id = mint_id
         mint_id = self.__class__._prepare_mint_id(mint_id)
 
-        gas_price = self._w3.eth.gasPrice
         gas_limit = self._gas_limit()
 
-        tx_hash = self._target_contract()\
-            .transact({'from': self._wsgi_mode_state.get_account_address(), 'gasPrice': gas_price, 'gas': gas_limit})\
-            .mint(mint_id, address, tokens)
+        if callback_url is not None:
+            # before sending: the client relies on the callback once the request succeeds
+            self._webhooks.register(original_mint_id, callback_url)
+
+        with self._mint_scheduler.slot(priority) as gas_price:
+            transaction = {'from': self._wsgi_mode_state.get_account_address(), 'gasPrice': gas_price,
+                           'gas': gas_limit}
+            if nonce is not None:
+                transaction['nonce'] = nonce
+
+            # the leadership could be lost while waiting for the turn
+            if not self.is_leader():
+                raise NotLeaderError()
+            # right before sending: a mint which failed earlier isn't reported by the journal replay
+            if self._mint_journal is not None:
+                self._mint_journal.intent(mint_id)
+            tx_hash = self._target_contract().transact(transaction).mint(mint_id, address, tokens)
+
+        if self._mint_journal is not None:
+            try:
+                self._mint_journal.sent(mint_id, tx_hash)
+            except OSError as exc:
+                # the transaction is sent anyway
+                logger.error('mint_tokens(): could not journal tx %s: %s', tx_hash, exc)
 
         # remembering tx hash for get_minting_status references - optional step
-        _silent_redis_call(self._redis.lpush, self._redis_mint_tx_key(mint_id), Web3.toBytes(hexstr=tx_hash))
-        
-        logger.debug('mint_tokens(): mint_id=%s, address=%s, tokens=%d, gas_price=%d, gas=%d: sent tx %s',
-                      Web3.toHex(mint_id), address, tokens, gas_price, gas_limit, tx_hash)
+        _silent_redis_call(self._mint_index.add_tx, self._redis_mint_tx_key(mint_id), _hex_to_bytes(tx_hash))
+
+        logger.debug('mint_tokens(): mint_id=%s, address=%s, tokens=%d, priority=%s, gas_price=%d, gas=%d: sent tx %s',
+                      Web3.toHex(mint_id), address, tokens, priority, gas_price, gas_limit, tx_hash)
 
         return tx_hash
 
@@ -82,30 +355,69 @@ class MinterService(object):
         Query current status of mint request
         :param mint_id: str | bytes, unique mint id for the request
         :return: str, status code
+        :raises DeadlineExceededError: if the check took longer than request_deadline setting
+        """
+        assert self.wsgi_mode
+
+        # one node answers all queries of the check, so that they see the same chain
+        with self.request_deadline(), self._w3.providers[0].session():
+            return self._get_minting_status(mint_id)
+
+    def is_minted_status_final(self):
+        """
+        :return: True if the status "minted" never changes: it's given after require_confirmations blocks,
+                 otherwise a reorganization of the chain may take it back
+        """
+        return int(self._conf.get('require_confirmations', 0)) > 0
+
+    def minting_status_version(self, mint_id):
+        """
+        Cheap fingerprint of everything get_minting_status depends on: the head and the known transactions of the mint.
+        While it stays the same, so does the status (except for the final "minted" one).
+        :param mint_id: str | bytes, unique mint id for the request
+        :return: str or None if it can't be told
+        """
+        assert self.wsgi_mode
+        head = self._head_tracker.head
+        if head is None:
+            return None
+
+        with self.request_deadline():
+            txs = self.known_transactions(mint_id)
+        if txs is None:
+            return None     # redis is not available
+        return '{}-{}'.format(head, len(txs))
+
+    def known_transactions(self, mint_id):
+        """
+        :param mint_id: str | bytes, unique mint id for the request
+        :return: hashes (bytes) of transactions sent for the mint, None if redis is not available
         """
         assert self.wsgi_mode
+        known = _silent_redis_call(self._mint_index.get,
+                                   self._redis_mint_tx_key(self.__class__._prepare_mint_id(mint_id)))
+        return None if known is None else known[0]
 
+    def _get_minting_status(self, mint_id) -> dict:
         mint_id = self.__class__._prepare_mint_id(mint_id)
 
         w3_instance = self._w3
         conf = self._conf
-       
-        if self._get_minting_status_is_confirmed(mint_id):
+        current_block_number = w3_instance.eth.blockNumber
+
+        if self._get_minting_status_is_confirmed(mint_id, current_block_number):
             return self._build_status('minted')
 
         # Checking if it was mined recently (still subject to removal from blockchain!).
         if conf.get('require_confirmations', 0) > 0 and self._target_contract().call().m_processed_mint_id(mint_id):
-            current_block_number = self._w3.eth.blockNumber
-            mint_id_block = _silent_redis_call(self._redis.get, self._redis_mint_tx_key(mint_id, self.TX_BLOCK_HEIGHT_KEY_PREFIX))
-            if not mint_id_block:
-                _silent_redis_call(self._redis.set, self._redis_mint_tx_key(mint_id, self.TX_BLOCK_HEIGHT_KEY_PREFIX), self._w3.eth.blockNumber, ex=3600)
-            
-            start_mint_block = int(mint_id_block or current_block_number)
-            confirmations = current_block_number - start_mint_block
+            mint_block_number = self._get_mint_block_number(mint_id, current_block_number)
+            # unknown if the index of mint transactions was lost
+            confirmations = 0 if mint_block_number is None else max(0, current_block_number - mint_block_number)
             rest_confirmations = conf.get('require_confirmations', 0) - confirmations
             return self._build_status('minting', confirmations=confirmations, rest_confirmations=rest_confirmations)
+
         # finding all known transaction ids which could mint this mint_id
-        tx_bin_ids = _silent_redis_call(self._redis.lrange, self._redis_mint_tx_key(mint_id), 0, -1) or []
+        tx_bin_ids, _ = _silent_redis_call(self._mint_index.get, self._redis_mint_tx_key(mint_id)) or ([], None)
 
         # getting transactions
         txs = list(filter(None, (w3_instance.eth.getTransaction(Web3.toHex(tx_id)) for tx_id in tx_bin_ids)))
@@ -135,6 +447,58 @@ class MinterService(object):
             # There are no signs of minting - now its vise for client to re-mint this mint_id.
             return self._build_status('not_minted')
 
+    def wait_minting_status(self, mint_id, since=None, since_confirmations=None, timeout=None) -> dict:
+        """
+        Long-poll version of get_minting_status: blocks until status of the mint request changes
+        :param mint_id: str | bytes, unique mint id for the request
+        :param since: str, status known to the client (None - return current status immediately)
+        :param since_confirmations: int, confirmations known to the client (None - as observed by the first check)
+        :param timeout: seconds to wait, capped by long_poll_timeout setting
+        :return: the same as get_minting_status
+        """
+        assert self.wsgi_mode
+
+        if not self._long_poll_slots.acquire(blocking=False):
+            # too many waiters already: the client gets the current status and polls again
+            return self._shared_minting_status(mint_id)
+        try:
+            return self._wait_minting_status(mint_id, since, since_confirmations, timeout)
+        finally:
+            self._long_poll_slots.release()
+
+    def _wait_minting_status(self, mint_id, since, since_confirmations, timeout):
+        max_timeout = self._conf.get('long_poll_timeout', 30)
+        timeout = max_timeout if timeout is None else max(0, min(timeout, max_timeout))
+        wait_until = time() + timeout
+
+        while True:
+            # Remembering head before the check so a block mined during the check is not missed.
+            head = self._head_tracker.head
+            status = self._shared_minting_status(mint_id)
+
+            if since is None or status['status'] != since:
+                return status
+            if since_confirmations is None:
+                since_confirmations = status.get('confirmations')
+            elif status.get('confirmations') != since_confirmations:
+                return status
+
+            remaining = wait_until - time()
+            if remaining <= 0:
+                return status
+
+            # Status can only change with a new block, waking up is driven by the head tracker.
+            self._head_tracker.wait_for_change(head, remaining)
+
+    def _shared_minting_status(self, mint_id) -> dict:
+        # All waiters of a mint wake up on the same block: the status is computed once per version of the mint
+        # (see minting_status_version) and shared, instead of being computed by every waiter.
+        version = self.minting_status_version(mint_id)
+        if version is None:
+            return self.get_minting_status(mint_id)
+        key = (self.__class__._prepare_mint_id(mint_id), version)
+        return dict(self._shared_statuses.get(key, lambda: self.get_minting_status(mint_id)))
+
     def init_account(self):
         """
         Initializes ethereum external account to use for minting
@@ -189,11 +553,12 @@ class MinterService(object):
         gas_price = w3_instance.eth.gasPrice
         gas_limit = int(w3_instance.eth.getBlock('latest').gasLimit * 0.9)
 
-        get_bytecode = lambda json_: json_.get('bytecode') or json_['unlinked_binary']
+        built_contract = self._built_contract('ReenterableMinter')
 
         with self._load_state() as state:
-            contract = w3_instance.eth.contract(abi=self._built_contract('ReenterableMinter')['abi'],
-                                                bytecode=get_bytecode(self._built_contract('ReenterableMinter')))
+            contract = w3_instance.eth.contract(abi=built_contract['abi'],
+                                                bytecode=built_contract.get('bytecode') or
+                                                         built_contract['unlinked_binary'])
 
             w3_instance.personal.unlockAccount(state.get_account_address(), state['account']['password'])
 
@@ -245,6 +610,47 @@ class MinterService(object):
         """
         return Web3(self._conf.get_provider())
 
+    def webhooks(self):
+        """
+        :return: WebhookDispatcher of this instance (wsgi mode only)
+        """
+        assert self.wsgi_mode
+        return self._webhooks
+
+    def mint_index(self):
+        """
+        :return: MintIndex of this instance
+        """
+        assert self.wsgi_mode
+        return self._mint_index
+
+    def migrate_mint_index(self):
+        """
+        Moves mints of the contract from the redis layout of earlier versions to the mint index
+        :return: tuple (number of migrated mints, number of dropped block keys)
+        """
+        assert self.wsgi_mode
+        contract_address = self._wsgi_mode_state.get_minter_contract_address().lower()
+
+        def is_ours(tx_hashes):
+            # legacy keys are hashes, the first transaction of the mint tells the contract
+            tx = self._w3.eth.getTransaction(Web3.toHex(tx_hashes[0]))
+            return tx is not None and tx.to is not None and tx.to.lower() == contract_address
+
+        return self._mint_index.migrate_legacy_keys(is_ours)
+
+    def head_tracker(self):
+        """
+        :return: HeadTracker of this instance
+        """
+        return self._head_tracker
+
+    def receipt_waiter(self):
+        """
+        :return: ReceiptWaiter of this instance
+        """
+        return self._receipt_waiter
+
     def __exit__(self, type, value, traceback):
         self.close()
 
@@ -257,9 +663,17 @@ class MinterService(object):
         """
         if self.wsgi_mode:
             self._wsgi_mode_state.close()
+        if self._leader_election is not None:
+            self._leader_election.release()
+        if self._mint_journal is not None:
+            self._mint_journal.close()
+        if self._owns_connections:
+            # instances sharing them (see create_tenants) are closed along with this one
+            self._head_tracker.stop()
+            self._w3.providers[0].close()
 
 
-    def _get_minting_status_is_confirmed(self, prepared_mint_id) -> tuple:
+    def _get_minting_status_is_confirmed(self, prepared_mint_id, current_block_number) -> bool:
         w3_instance = self._w3
         conf = self._conf
 
@@ -268,7 +682,7 @@ class MinterService(object):
 
         # Checking if it was mined enough block ago.
         if 'require_confirmations' in conf:
-            confirmed_block = w3_instance.eth.blockNumber - int(conf['require_confirmations'])
+            confirmed_block = current_block_number - int(conf['require_confirmations'])
             if confirmed_block < 0:
                 # we are at the beginning of blockchain for some reason
                 return False
@@ -276,26 +690,93 @@ class MinterService(object):
                 # its too early, calls to m_processed_mint_id will return 0x
                 return False
 
-            saved_default = w3_instance.eth.defaultBlock
-            w3_instance.eth.defaultBlock = '0x{:x}'.format(confirmed_block)
+            block_identifier = '0x{:x}'.format(confirmed_block)
         else:
-            saved_default = None
+            block_identifier = None
 
-        try:
-            if contract.call().m_processed_mint_id(prepared_mint_id):
-                # TODO background eviction thread/process
-                _silent_redis_call(self._redis.delete, self._redis_mint_tx_key(prepared_mint_id))
+        # Not touching eth.defaultBlock: the instance is shared by concurrent requests.
+        result = w3_instance.eth.call({'to': contract.address,
+                                       'data': contract.encodeABI('m_processed_mint_id', args=[prepared_mint_id])},
+                                      block_identifier)
+        if result not in ('0x', '') and int(result, 16):
+            # TODO background eviction thread/process
+            _silent_redis_call(self._mint_index.delete, self._redis_mint_tx_key(prepared_mint_id))
 
-                return True
-        finally:
-            if 'require_confirmations' in conf:
-                assert saved_default is not None
-                w3_instance.eth.defaultBlock = saved_default
+            return True
 
         return False
 
+    def _get_mint_block_number(self, prepared_mint_id, current_block_number):
+        """
+        Finds the block in which mint request was processed, using receipts of known mint transactions.
+        The block is cached in the mint index together with its hash and the head at which it was last seen
+        in the canonical chain, so while the head stays the same no calls are made, and on a new head only the hash
+        is re-checked.
+        :return: block number or None if it's unknown
+        """
+        key = self._redis_mint_tx_key(prepared_mint_id)
+
+        tx_bin_ids, cached = _silent_redis_call(self._mint_index.get, key) or ([], None)
+        if cached is not None:
+            block_number, block_hash_prefix, verified_at = cached
+            if verified_at == current_block_number:
+                return block_number
+
+            block = self._w3.eth.getBlock(block_number)
+            if block is not None and Web3.toBytes(hexstr=block.hash).startswith(block_hash_prefix):
+                _silent_redis_call(self._mint_index.set_block, key, block_number, block_hash_prefix,
+                                   current_block_number)
+                return block_number
+
+            logger.info('mint_id %s: block %d is no longer in the chain, looking for the receipt again',
+                        Web3.toHex(prepared_mint_id), block_number)
+
+        # The earliest successful transaction is the one which processed the mint (the rest are no-ops).
+        mint_receipt = None
+        for tx_id in tx_bin_ids:
+            receipt = self._w3.eth.getTransactionReceipt(Web3.toHex(tx_id))
+            if receipt is None or receipt.blockNumber is None or 0 == get_receipt_status(receipt):
+                continue
+            if mint_receipt is None or receipt.blockNumber < mint_receipt.blockNumber:
+                mint_receipt = receipt
+
+        if mint_receipt is None:
+            if cached is not None:
+                _silent_redis_call(self._mint_index.forget_block, key)
+            return None
+
+        _silent_redis_call(self._mint_index.set_block, key, mint_receipt.blockNumber,
+                           Web3.toBytes(hexstr=mint_receipt.blockHash), current_block_number)
+        return mint_receipt.blockNumber
+
+    def _replay_mint(self, mint_id, tx_hash, sent_at):
+        # Restores the mint in the index of mint transactions, tells if the transaction doesn't have to be tracked.
+        tx_bin_id = Web3.toBytes(hexstr=tx_hash)
+        try:
+            self._mint_index.add_tx(self._redis_mint_tx_key(mint_id), tx_bin_id)
+            tx = self._w3.eth.getTransaction(tx_hash)
+        except Exception as exc:
+            logger.warning('could not replay tx %s of mint %s: %s', tx_hash, Web3.toHex(mint_id), exc)
+            return False
+
+        if tx is None:
+            if time() - sent_at < JOURNAL_DROPPED_TX_AGE:
+                return False    # the node may be lagging behind
+            logger.warning('tx %s of mint %s was dropped by the node', tx_hash, Web3.toHex(mint_id))
+            return True
+        return tx.blockNumber is not None
+
     def _load_state(self):
-        return _State(os.path.join(self._conf['data_directory'], 'state.yaml'), lock_shared=self.wsgi_mode)
+        if self.read_only:
+            raise UsageError('State is not available in read-only mode')
+        if not self._exclusive:
+            return self._conf.get_state(lock_shared=self.wsgi_mode, redis_client=self._redis)
+
+        # the running service holds the state lock shared
+        try:
+            return self._conf.get_state(redis_client=self._redis)
+        except RuntimeError as exc:
+            raise UsageError('{}, stop it first', exc)
 
     def _gas_limit(self):
         # Strange behaviour was observed on Rinkeby with web3py 3.16:
@@ -309,8 +790,7 @@ class MinterService(object):
         return min(int(self._conf['gas_limit']), limit) if 'gas_limit' in self._conf else limit
 
     def _built_contract(self, contract_name):
-        with open(os.path.join(self.contracts_directory, contract_name + '.json')) as fh:
-            return json.load(fh)
+        return load_built_contract(self.contracts_directory, contract_name)
 
     def _target_contract(self):
         assert self.wsgi_mode
@@ -321,11 +801,8 @@ class MinterService(object):
         return self.__target_contract
 
     def _get_receipt_blocking(self, tx_hash):
-        while True:
-            receipt = self._w3.eth.getTransactionReceipt(tx_hash)
-            if receipt is not None:
-                return receipt
-            sleep(1)
+        return self._receipt_waiter.wait(tx_hash, self._conf.get('receipt_timeout', None))
+
     def token_address(self):
         try:
             return self._target_contract().call().m_token()
@@ -337,11 +814,21 @@ class MinterService(object):
         if not isinstance(mint_id, (str, bytes)):
             raise TypeError('unsupported mint_id type')
 
-        if isinstance(mint_id, str):
-            mint_id = mint_id.encode('utf-8')
+        return _mint_id_hash(mint_id)
 
-        return Web3.toBytes(hexstr=Web3.sha3(mint_id))
 
+    def _redis_contract_key(self, name: bytes, hash_tag: bytes = None):
+        """
+        Creating redis key for current minter contract
+        :param name: key name (bytes)
+        :param hash_tag: keys with the same hash tag are kept by the same redis cluster node,
+                         keys of the contract without hash tag are kept together
+        :return: redis-compatible string
+        """
+        _, address = self._contract_address_keys()
+        if hash_tag is None:
+            return name + b':{' + address + b'}'
+        return name + b':' + address + b':{' + hash_tag + b'}'
 
     def _redis_mint_tx_key(self, mint_id, key_prefix: str = ""):
         """
@@ -349,23 +836,60 @@ class MinterService(object):
         :param mint_id: mint id (bytes)
         :return: redis-compatible string
         """
+        contract_address_bytes, _ = self._contract_address_keys()
+        if not key_prefix:
+            return _mint_tx_key(contract_address_bytes, mint_id)
+        return key_prefix.encode('utf-8') + _mint_tx_key(contract_address_bytes, mint_id)
+
+    def _contract_address_keys(self):
+        """
+        Minter contract address in the forms used by redis keys, computed once: the contract of a wsgi mode instance
+        doesn't change.
+        :return: (address bytes, lowercase hex address as bytes)
+        """
         assert self.wsgi_mode
-        contract_address_bytes = Web3.toBytes(hexstr=self._wsgi_mode_state.get_minter_contract_address())
-        assert 20 == len(contract_address_bytes)
-        
-        if key_prefix is None:
-            key_prefix = ""
-        
-        return key_prefix.encode('utf-8') + Web3.toBytes(hexstr=Web3.sha3(contract_address_bytes + mint_id))
+        if self.__contract_address_keys is None:
+            contract_address_bytes = Web3.toBytes(hexstr=self._wsgi_mode_state.get_minter_contract_address())
+            assert 20 == len(contract_address_bytes)
+            self.__contract_address_keys = (contract_address_bytes, Web3.toHex(contract_address_bytes).encode('ascii'))
+        return self.__contract_address_keys
 
 
 class _Conf(ConfigurationBase):
 
-    def __init__(self, filename):
+    TENANT_RE = re.compile(r'^[A-Za-z0-9_\-]+$')
+
+    # settings of connections and activities shared by tenants
+    COMMON_SETTINGS = ('web3_provider', 'web3_providers', 'provider_set', 'redis', 'head_poll_interval', 'admission',
+                       'max_long_poll_waiters')
+
+    def __init__(self, filename, tenant=None):
         super().__init__(filename)
+        tenants = self._conf.pop('tenants', None) or {}
+        if tenants and tenant is None:
+            raise ValueError('tenants are configured, a tenant has to be chosen')
+        if tenant is not None:
+            if tenant not in tenants or not self.TENANT_RE.match(tenant):
+                raise ValueError('unknown tenant ' + tenant)
+            tenant_conf = tenants[tenant] or {}
+            for name in self.COMMON_SETTINGS:
+                if name in tenant_conf:
+                    raise ValueError('{} is common to all tenants'.format(name))
+            # tenant settings override the common ones
+            self._conf.update(tenant_conf)
+        self.tenant = tenant
+
         self._uses_web3 = True
+        self.read_only = bool(self.get('read_only', False))
 
-        self._check_dirs('data_directory')
+        state_backend = self.get('state_backend', {}).get('class', 'FileState')
+        if state_backend not in ('FileState', 'RedisState', 'MemoryState'):
+            raise TypeError('bad state backend')
+
+        if self.read_only:
+            self.check_read_only()
+        elif 'FileState' == state_backend:
+            self._check_dirs('data_directory')
 
         if 'require_confirmations' in self:
             self._check_ints('require_confirmations')
@@ -373,125 +897,278 @@ class _Conf(ConfigurationBase):
         if 'gas_limit' in self:
             self._check_ints('gas_limit')
 
-        # TODO validate redis
+        if 'long_poll_timeout' in self:
+            self._check_ints('long_poll_timeout')
 
-        if self._uses_web3 and self._conf['web3_provider']['class'] not in ('HTTPProvider', 'IPCProvider'):
-            raise TypeError('bad web3 provider')
+        if 'max_long_poll_waiters' in self:
+            self._check_ints('max_long_poll_waiters')
+            if int(self._conf['max_long_poll_waiters']) <= 0:
+                raise ValueError('max_long_poll_waiters must be positive')
 
-    def get_provider(self):
-        if not self._uses_web3:
-            raise RuntimeError('web3 is not being used')
-        return globals()[self._conf['web3_provider']['class']](*(self._conf['web3_provider']['args']))
+        if 'receipt_timeout' in self:
+            self._check_ints('receipt_timeout')
 
-    def get_redis(self):
-        return redis.StrictRedis(
-                host=self.get('redis', {}).get('host', '127.0.0.1'),
-                port=self.get('redis', {}).get('port', 6379),
-                db=self.get('redis', {}).get('db', 0))
+        if 'request_deadline' in self:
+            self._check_numbers('request_deadline')
 
-    def _check_addresses(self, addresses):
-        self._check_strings(addresses)
-        for address_name in addresses if isinstance(addresses, (list, tuple)) else (addresses, ):
-            if not Web3.isAddress(self._conf[address_name]):
-                raise ValueError(address_name + ' is incorrect')
+        if 'head_poll_interval' in self:
+            self._check_numbers('head_poll_interval')
 
+        if 'redis' in self:
+            self._check_redis()
 
-class _State(object):
+        if self._uses_web3:
+            if 'web3_providers' in self:
+                if not self._conf['web3_providers']:
+                    raise ValueError('web3_providers is empty')
+                for provider in self._conf['web3_providers']:
+                    if provider['class'] not in ('HTTPProvider', 'IPCProvider'):
+                        raise TypeError('bad web3 provider')
+                    if float(provider.get('weight', 1)) <= 0:
+                        raise ValueError('web3 provider weight must be positive')
+            elif self._conf['web3_provider']['class'] not in ('HTTPProvider', 'IPCProvider'):
+                raise TypeError('bad web3 provider')
 
-    def __init__(self, filename, lock_shared=False):
-        self._filename = filename
+    def check_read_only(self):
+        """
+        Validates settings which replace state in read-only mode.
+        """
+        self._check_addresses('minter_contract')
+        self._check_ints('minter_contract_block_num')
 
-        self._lock = FileLock(filename + ".lock", non_blocking=True, shared=lock_shared)
-        try:
-            self._lock.lock()   # implicit unlock is at process termination
-        except WouldBlockError:
-            raise RuntimeError('Can\'t acquire state lock: looks like another instance is running')
-
-        if os.path.isfile(filename):
-            with open(filename) as fh:
-                self._state = yaml.safe_load(fh)
-            self._created = False
+    def get_provider(self):
+        if not self._uses_web3:
+            raise RuntimeError('web3 is not being used')
+        # even a single node is wrapped: ProviderSet enforces deadlines
+        providers = self._conf['web3_providers'] if 'web3_providers' in self else [self._conf['web3_provider']]
+        provider_set_conf = self.get('provider_set', {})
+        return ProviderSet([(' '.join(map(str, provider['args'])), self._create_provider(provider),
+                             provider.get('weight', 1))
+                            for provider in providers],
+                           max_lag=int(provider_set_conf.get('max_lag', 2)),
+                           health_check_interval=float(provider_set_conf.get('health_check_interval', 5)),
+                           ban_time=float(provider_set_conf.get('ban_time', 30)),
+                           hedge=bool(provider_set_conf.get('hedge', False)),
+                           hedge_percentile=float(provider_set_conf.get('hedge_percentile', 95)),
+                           hedge_min_delay=float(provider_set_conf.get('hedge_min_delay', 0.05)),
+                           max_workers=int(provider_set_conf.get('max_workers', 32)))
+
+    def _create_provider(self, provider_conf):
+        return globals()[provider_conf['class']](*(provider_conf['args']))
+
+    def get_state(self, lock_shared=False, redis_client=None):
+        backend = self.get('state_backend', {})
+        state_class = backend.get('class', 'FileState')
+        if 'FileState' == state_class:
+            return FileState(os.path.join(self._conf['data_directory'], 'state.yaml'), lock_shared=lock_shared)
+        elif 'RedisState' == state_class:
+            return RedisState(redis_client or self.get_redis(), backend.get('key', 'minter:state'), lock_shared)
         else:
-            self._state = dict()
-            self._created = True
-
-        self._original = copy.deepcopy(self._state)
-
+            return MemoryState(backend.get('key', 'minter:state'), lock_shared)
 
-    def __enter__(self):
-        assert self._lock is not None, "reuse is not possible"
-        return self     # already locked
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self._lock.unlock()
-        self._lock = None
-
-
-    def __getitem__(self, key):
-        assert self._lock is not None
-        return self._state[key]
-
-    def __setitem__(self, key, value):
-        assert self._lock is not None
-        self._state[key] = value
-
-    def __contains__(self, item):
-        assert self._lock is not None
-        return item in self._state
-
-    def get(self, key, default):
-        assert self._lock is not None
-        return self._state.get(key, default)
+    def get_mint_journal(self):
+        """
+        :return: MintJournal in data directory or None if there is no data directory or the journal is disabled
+        """
+        journal_conf = self.get('mint_journal', {})
+        if 'data_directory' not in self or not journal_conf.get('enabled', True):
+            return None
+        directory = os.path.join(self._conf['data_directory'], 'mint_journal')
+        if self.tenant is not None:
+            # tenants may share the data directory, records of one tenant are resolved against its contract only
+            directory = os.path.join(directory, self.tenant)
+        return MintJournal(directory,
+                           max_delay=float(journal_conf.get('max_delay', 0.005)),
+                           max_batch=int(journal_conf.get('max_batch', 512)),
+                           max_segment_records=int(journal_conf.get('max_segment_records', 10000)))
+
+    def state_location(self):
+        """
+        :return: hashable identifying where the state is kept (None - nowhere)
+        """
+        if self.read_only:
+            return None
+        backend = self.get('state_backend', {})
+        state_class = backend.get('class', 'FileState')
+        if 'FileState' == state_class:
+            return state_class, os.path.realpath(self._conf['data_directory'])
+        return state_class, backend.get('key', 'minter:state')
 
+    def get_leader_election(self, redis_client=None):
+        """
+        Instances sharing the state elect the one which sends transactions, the file state can't be shared.
+        """
+        backend = self.get('state_backend', {})
+        state_class = backend.get('class', 'FileState')
+        key = backend.get('key', 'minter:state') + ':leader'
+        # by default workers forked from one process (uwsgi) are one instance
+        instance_id = backend.get('instance_id')
+        if 'RedisState' == state_class:
+            return RedisLeaderElection(redis_client or self.get_redis(), key, backend.get('leader_ttl', 10),
+                                       instance_id)
+        elif 'MemoryState' == state_class:
+            return LocalLeaderElection(key, backend.get('leader_ttl', 10), instance_id)
+        else:
+            return NoLeaderElection()
 
-    @property
-    def account_address(self):
-        return self.get('account', dict()).get('address')
+    def get_redis(self):
+        """
+        :return: redis client for a single server, a master monitored by sentinels or a cluster (see redis setting)
+        """
+        redis_conf = self.get('redis', {})
+        retries = int(redis_conf.get('retries', 1))
+        options = dict(socket_connect_timeout=float(redis_conf.get('connect_timeout', 1)),
+                       socket_timeout=float(redis_conf.get('read_timeout', 2)),
+                       retry_on_timeout=retries > 0)
+        if RedisCluster is not None:
+            options['retry'] = Retry(ExponentialBackoff(cap=0.5, base=0.05), retries)
+        if redis_conf.get('password') is not None:
+            options['password'] = redis_conf['password']
+        max_connections = int(redis_conf.get('max_connections', 32))
+
+        if 'cluster' in redis_conf:
+            return RedisCluster(startup_nodes=[ClusterNode(host, int(port))
+                                               for host, port in redis_conf['cluster']['nodes']],
+                                max_connections=max_connections, connection_class=_DeadlineConnection, **options)
+
+        if 'sentinel' in redis_conf:
+            sentinel = Sentinel([(host, int(port)) for host, port in redis_conf['sentinel']['nodes']],
+                                sentinel_kwargs=dict(socket_connect_timeout=options['socket_connect_timeout'],
+                                                     socket_timeout=options['socket_timeout']))
+            return sentinel.master_for(redis_conf['sentinel']['master'], redis_class=redis.StrictRedis,
+                                       db=int(redis_conf.get('db', 0)), max_connections=max_connections,
+                                       connection_class=_DeadlineSentinelConnection, **options)
+
+        # threads wait for a free connection instead of failing
+        pool = redis.BlockingConnectionPool(host=redis_conf.get('host', '127.0.0.1'),
+                                            port=int(redis_conf.get('port', 6379)),
+                                            db=int(redis_conf.get('db', 0)),
+                                            max_connections=max_connections,
+                                            timeout=float(redis_conf.get('pool_timeout', 5)),
+                                            connection_class=_DeadlineConnection, **options)
+        return redis.StrictRedis(connection_pool=pool)
+
+    def _check_redis(self):
+        redis_conf = self._conf['redis']
+        if not isinstance(redis_conf, dict):
+            raise TypeError('redis setting is not a mapping')
+        if 'sentinel' in redis_conf and 'cluster' in redis_conf:
+            raise ValueError('redis: sentinel and cluster are mutually exclusive')
+        if 'cluster' in redis_conf and RedisCluster is None:
+            raise ValueError('redis: cluster needs redis-py 4.1 or newer')
+
+        for name, convert in (('port', int), ('db', int), ('max_connections', int), ('retries', int),
+                              ('connect_timeout', float), ('read_timeout', float), ('pool_timeout', float)):
+            if name not in redis_conf:
+                continue
+            try:
+                value = convert(redis_conf[name])
+            except (TypeError, ValueError):
+                raise ValueError('redis: {} is not a number'.format(name))
+            if value < 0 or (0 == value and name in ('max_connections', 'connect_timeout', 'read_timeout')):
+                raise ValueError('redis: bad {}'.format(name))
+
+        for topology in ('sentinel', 'cluster'):
+            if topology not in redis_conf:
+                continue
+            nodes = (redis_conf[topology] or {}).get('nodes')
+            if not nodes or not all(isinstance(node, (list, tuple)) and 2 == len(node) for node in nodes):
+                raise ValueError('redis: {} nodes must be a list of [host, port]'.format(topology))
+        if 'sentinel' in redis_conf and not isinstance(redis_conf['sentinel'].get('master'), str):
+            raise ValueError('redis: sentinel master is not provided')
 
-    def get_account_address(self):
-        if self.account_address is None:
-            raise RuntimeError('account was not initialized')
-        return self.account_address
+    def _check_addresses(self, addresses):
+        self._check_strings(addresses)
+        for address_name in addresses if isinstance(addresses, (list, tuple)) else (addresses, ):
+            if not Web3.isAddress(self._conf[address_name]):
+                raise ValueError(address_name + ' is incorrect')
 
-    def get_minter_contract_address(self):
-        if 'minter_contract' not in self:
-            raise RuntimeError('contract was not deployed')
-        return self['minter_contract']
 
+def get_receipt_status(receipt):
+    return receipt.status if isinstance(receipt.status, int) else int(receipt.status, 16)
 
-    def save(self, sync=False):
-        assert self._lock is not None
-        if self._state == self._original:
-            return
-        with open(self._filename, 'w') as fh:
-            if self._created:
-                os.chmod(self._filename, stat.S_IRUSR | stat.S_IWUSR)
 
-            yaml.safe_dump(self._state, fh, default_flow_style=False)
+@lru_cache(maxsize=MINT_KEY_CACHE_SIZE)
+def _mint_id_hash(mint_id):
+    # str and bytes mint ids never compare equal, so both are cached as given
+    return _hex_to_bytes(Web3.sha3(mint_id.encode('utf-8') if isinstance(mint_id, str) else mint_id))
 
-            if sync:
-                fh.flush()
-                os.fsync(fh.fileno())
 
-    def close(self):
-        if self._lock:
-            self.save()
-            self._lock.unlock()
-            self._lock = None
+@lru_cache(maxsize=MINT_KEY_CACHE_SIZE)
+def _mint_tx_key(contract_address_bytes, prepared_mint_id):
+    return _hex_to_bytes(Web3.sha3(contract_address_bytes + prepared_mint_id))
 
 
-def get_receipt_status(receipt):
-    return receipt.status if isinstance(receipt.status, int) else int(receipt.status, 16)
+def _hex_to_bytes(hexstr):
+    # the same as Web3.toBytes(hexstr=...) for the even-length hex strings returned by web3
+    return binascii.unhexlify(hexstr[2:] if hexstr.startswith(('0x', '0X')) else hexstr)
 
 
 def _silent_redis_call(call_fn, *args, **kwargs):
+    check_deadline()
     try:
         return call_fn(*args, **kwargs)
-    except redis.exceptions.ConnectionError as exc:
+    except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError) as exc:
         logger.warning('could not contact redis: %s', exc)
         return None
 
 
+class _DeadlineConnectionMixin(object):
+    """
+    Caps socket timeouts of a redis connection at the time left till the deadline of the calling thread
+    (see mixbytes.deadline): a slow redis and retries on timeouts can't take the request past its deadline.
+    """
+
+    # seconds to read an answer which is due past the deadline: it's dropped together with the connection
+    MIN_READ_TIMEOUT = 0.001
+
+    def connect(self):
+        configured = self.socket_connect_timeout
+        self.socket_connect_timeout = _capped_by_deadline(configured)
+        try:
+            super().connect()
+        finally:
+            self.socket_connect_timeout = configured
+
+    def send_packed_command(self, *args, **kwargs):
+        # nothing is sent past the deadline
+        timeout = _capped_by_deadline(self.socket_timeout)
+        if self._sock is None:
+            self.connect()
+        self._sock.settimeout(timeout)
+        return super().send_packed_command(*args, **kwargs)
+
+    def read_response(self, *args, **kwargs):
+        if self._sock is not None:
+            try:
+                timeout = _capped_by_deadline(self.socket_timeout)
+            except DeadlineExceededError:
+                # the command was sent: its answer has to be read or the connection dropped (on the timeout)
+                timeout = self.MIN_READ_TIMEOUT
+            self._sock.settimeout(timeout)
+        return super().read_response(*args, **kwargs)
+
+
+class _DeadlineConnection(_DeadlineConnectionMixin, redis.connection.Connection):
+    pass
+
+
+class _DeadlineSentinelConnection(_DeadlineConnectionMixin, SentinelManagedConnection):
+    pass
+
+
+def _capped_by_deadline(timeout):
+    """
+    :param timeout: configured timeout in seconds (None - no timeout)
+    :return: the timeout, not exceeding the time left till the deadline of the current thread
+    :raises DeadlineExceededError: if the deadline has passed
+    """
+    left = deadline_remaining()
+    if left is None:
+        return timeout
+    return left if timeout is None else min(timeout, left)
+
+
 class UsageError(RuntimeError):
     def __init__(self, message, *args):
         self.message = message.format(*args)
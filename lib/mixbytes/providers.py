@@ -0,0 +1,413 @@
+
+import os
+import json
+import random
+import logging
+import threading
+from collections import deque
+from concurrent import futures
+from contextlib import contextmanager
+from time import time
+
+from urllib3.exceptions import NewConnectionError
+from web3.providers.base import BaseProvider
+
+from mixbytes import deadline
+
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderSet(BaseProvider):
+    """
+    web3 provider spreading requests over several ethereum nodes.
+
+    Reads go to healthy nodes chosen at random in proportion to weight / observed latency. Reads made within
+    session() go to one node, so that they see the same chain state (unless a hedged read was answered by another
+    node first, which then serves the rest of the session).
+    Writes and node-local requests (accounts, filters) go to one node: the first healthy node in the configured order
+    (the primary) which then stays in use while it's healthy. A failed write is not resent to another node (it may
+    have been sent already), only a connection which was refused moves node-local requests to the next node.
+    Nodes which are syncing, lag behind the freshest head more than max_lag blocks or fail requests
+    are ejected until the next health check shows they are fine. Health checks are done in the background.
+
+    Requests respect the deadline of the calling thread (see mixbytes.deadline). If hedging is on, a read which
+    was not answered within the hedge_percentile of recent read latencies is duplicated to another node,
+    and the first answer wins.
+    """
+
+    # Hedging starts when the latency distribution is known well enough.
+    MIN_LATENCY_SAMPLES = 20
+
+    # Requests which depend on node-local data: account keys, unlocks, installed filters.
+    NODE_LOCAL_METHOD_PREFIXES = ('personal_', 'eth_send', 'eth_sign', 'eth_accounts', 'eth_coinbase',
+                               'eth_getTransactionCount', 'eth_newFilter', 'eth_newBlockFilter',
+                               'eth_newPendingTransactionFilter', 'eth_getFilterChanges', 'eth_getFilterLogs',
+                               'eth_uninstallFilter')
+
+    def __init__(self, nodes, max_lag=2, health_check_interval=5, ban_time=30,
+                 hedge=False, hedge_percentile=95, hedge_min_delay=0.05, max_workers=32):
+        """
+        :param nodes: list of tuples (name, provider, weight), the first one is the primary
+        :param max_lag: blocks a node may lag behind the freshest one
+        :param health_check_interval: seconds between health checks
+        :param ban_time: seconds a failed node is not used (unless all nodes are unusable)
+        :param hedge: duplicate slow reads to another node
+        :param hedge_percentile: percentile of read latencies after which a read is duplicated
+        :param hedge_min_delay: seconds, lower bound of the hedging delay
+        :param max_workers: threads making requests which are limited in time or hedged
+        """
+        super().__init__()
+        if not nodes:
+            raise ValueError('no nodes provided')
+
+        self._nodes = [_Node(name, provider, weight) for name, provider, weight in nodes]
+        self._max_lag = max_lag
+        self._health_check_interval = health_check_interval
+        self._ban_time = ban_time
+
+        self._hedge = hedge
+        self._hedge_percentile = hedge_percentile
+        self._hedge_min_delay = hedge_min_delay
+        self._read_latencies = deque(maxlen=256)
+
+        self._max_workers = max_workers
+        self._executor = None
+        self._executor_pid = None
+        self._executor_lock = threading.Lock()
+
+        self._health_lock = threading.Lock()
+        self._checked_at = 0
+
+        self._local_node = None
+        self._local_node_lock = threading.Lock()
+        self._local_node_listeners = []
+
+        self._session = threading.local()
+
+    @property
+    def nodes(self):
+        return list(self._nodes)
+
+    def make_request(self, method, params):
+        deadline.check()
+        self._check_health_if_due()
+
+        if method.startswith(self.NODE_LOCAL_METHOD_PREFIXES):
+            return self._request_node_local(method, params)
+
+        in_session = getattr(self._session, 'active', False)
+        session_node = self._session.node if in_session else None
+
+        candidates = self._weighted_candidates()
+        hedge_delay = self._hedge_delay()
+        if session_node is not None:
+            # the node of the session is tried first, its peers are asked only if it's slow or fails
+            candidates = [session_node] + [node for node in candidates if node is not session_node]
+        if hedge_delay is not None and len(candidates) > 1:
+            node, response = self._request_hedged(candidates, method, params, hedge_delay)
+        else:
+            node, response = self._request_in_turn(candidates, method, params, record_latency=True)
+
+        if in_session:
+            self._session.node = node
+        return response
+
+    @contextmanager
+    def session(self):
+        """
+        Sends reads of the current thread made within the block to one node (the first one which answers),
+        e.g. for a computation which must not mix chain states of different nodes. Nested sessions are one session.
+        """
+        if getattr(self._session, 'active', False):
+            yield
+            return
+
+        self._session.active = True
+        self._session.node = None
+        try:
+            yield
+        finally:
+            self._session.active = False
+            self._session.node = None
+
+    def add_local_node_listener(self, listener_fn):
+        """
+        :param listener_fn: function called with the name of the node which node-local requests move to,
+                            e.g. to unlock the account there
+        """
+        self._local_node_listeners.append(listener_fn)
+
+    def latency(self):
+        """
+        :return: latency of the fastest usable node in seconds (None if unknown)
+        """
+        latencies = [node.latency for node in self._usable_nodes() if node.latency is not None]
+        return min(latencies) if latencies else None
+
+    def isConnected(self):
+        return any(node.provider.isConnected() for node in self._nodes)
+
+    def close(self):
+        """
+        Stops the threads of time-limited and hedged requests and of health checks (they are started anew if the
+        provider is used again).
+        """
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None and self._executor_pid == os.getpid():
+            executor.shutdown(wait=False)
+
+
+    def _request_in_turn(self, candidates, method, params, record_latency=False):
+        """
+        :return: tuple (node which answered, response)
+        """
+        last_exc = None
+        for node in candidates:
+            try:
+                response, latency = self._timed_request(node, method, params)
+            except deadline.DeadlineExceededError:
+                raise
+            except Exception as exc:
+                self._on_failure(node, method, exc)
+                last_exc = exc
+            else:
+                if record_latency:
+                    self._read_latencies.append(latency)
+                return node, response
+
+        raise last_exc
+
+    def _request_node_local(self, method, params):
+        tried = []
+        while True:
+            node = self._get_local_node(tried)
+            try:
+                return self._timed_request(node, method, params)[0]
+            except deadline.DeadlineExceededError:
+                raise
+            except Exception as exc:
+                if not _not_sent(exc) or len(tried) + 1 == len(self._nodes):
+                    # Possibly sent: resending to another node could make a duplicate transaction.
+                    logger.warning('node %s failed %s: %s', node.name, method, exc)
+                    raise
+                self._on_failure(node, method, exc)
+                tried.append(node)
+
+    def _get_local_node(self, excluded):
+        # The node in use stays while it's usable, otherwise the first usable one in the configured order is taken.
+        with self._local_node_lock:
+            previous = self._local_node
+            if previous is None or not previous.is_usable() or previous in excluded:
+                candidates = [node for node in self._ordered_candidates() if node not in excluded]
+                self._local_node = candidates[0]
+            node = self._local_node
+
+        if previous is not None and node is not previous:
+            logger.warning('node-local requests move from node %s to node %s', previous.name, node.name)
+            for listener_fn in self._local_node_listeners:
+                try:
+                    listener_fn(node.name)
+                except Exception as exc:
+                    logger.error('node %s listener failed: %s', node.name, exc)
+        return node
+
+    def _timed_request(self, node, method, params):
+        timeout = deadline.remaining()
+        if timeout is None:
+            return node.timed_request(method, params)
+        try:
+            return self._get_executor().submit(node.timed_request, method, params).result(timeout)
+        except futures.TimeoutError:
+            raise deadline.DeadlineExceededError()
+
+    def _request_hedged(self, candidates, method, params, hedge_delay):
+        executor = self._get_executor()
+        candidates = list(candidates)
+        pending = dict()
+        hedged = False
+        last_exc = None
+
+        node = candidates.pop(0)
+        pending[executor.submit(node.timed_request, method, params)] = node
+
+        while pending:
+            timeout = deadline.remaining()
+            if not hedged and candidates:
+                timeout = hedge_delay if timeout is None else min(hedge_delay, timeout)
+
+            done, _ = futures.wait(pending, timeout=timeout, return_when=futures.FIRST_COMPLETED)
+            if not done:
+                if hedged or not candidates:
+                    deadline.check()
+                    continue
+                # taking too long - asking one more node
+                hedged = True
+                node = candidates.pop(0)
+                pending[executor.submit(node.timed_request, method, params)] = node
+                continue
+
+            for future in done:
+                node = pending.pop(future)
+                try:
+                    response, latency = future.result()
+                except Exception as exc:
+                    self._on_failure(node, method, exc)
+                    last_exc = exc
+                else:
+                    self._read_latencies.append(latency)
+                    return node, response
+
+            if not pending and candidates:
+                node = candidates.pop(0)
+                pending[executor.submit(node.timed_request, method, params)] = node
+
+        raise last_exc
+
+    def _hedge_delay(self):
+        if not self._hedge or len(self._read_latencies) < self.MIN_LATENCY_SAMPLES:
+            return None
+        latencies = sorted(self._read_latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * self._hedge_percentile / 100.0))
+        return max(self._hedge_min_delay, latencies[index])
+
+    def _on_failure(self, node, method, exc):
+        logger.warning('node %s failed %s: %s', node.name, method, exc)
+        node.ban(self._ban_time)
+
+    def _get_executor(self):
+        # Threads do not survive fork(), so the pool has to be created in the process which uses it.
+        if self._executor is None or self._executor_pid != os.getpid():
+            with self._executor_lock:
+                if self._executor is None or self._executor_pid != os.getpid():
+                    self._executor = futures.ThreadPoolExecutor(max_workers=self._max_workers)
+                    # a health check running in the parent is not running here
+                    self._health_lock = threading.Lock()
+                    self._executor_pid = os.getpid()
+        return self._executor
+
+    def _usable_nodes(self):
+        usable = [node for node in self._nodes if node.is_usable()]
+        return usable or list(self._nodes)     # better than nothing
+
+    def _ordered_candidates(self):
+        usable = self._usable_nodes()
+        return usable + [node for node in self._nodes if node not in usable]
+
+    def _weighted_candidates(self):
+        usable = self._usable_nodes()
+
+        # weighted random order without replacement
+        keyed = [(random.random() ** (1.0 / node.score()), node) for node in usable]
+        keyed.sort(key=lambda pair: pair[0], reverse=True)
+        ordered = [node for _, node in keyed]
+
+        return ordered + [node for node in self._nodes if node not in ordered]
+
+    def _check_health_if_due(self):
+        # Requests don't wait for health checks: a check is done by the executor while nodes are used
+        # as of the previous one.
+        if time() - self._checked_at < self._health_check_interval:
+            return
+        executor = self._get_executor()
+        if not self._health_lock.acquire(blocking=False):
+            return  # somebody else is checking
+        try:
+            self._checked_at = time()
+            executor.submit(self._check_health_in_background, self._health_lock)
+        except Exception:
+            self._health_lock.release()
+            raise
+
+    def _check_health_in_background(self, health_lock):
+        try:
+            self._check_health()
+        except Exception as exc:
+            logger.error('health check failed: %s', exc)
+        finally:
+            health_lock.release()
+
+    def _check_health(self):
+        for node in self._nodes:
+            try:
+                node.head = int(node.request_result('eth_blockNumber', []), 16)
+                node.syncing = bool(node.request_result('eth_syncing', []))
+                node.healthy = True
+            except Exception as exc:
+                logger.warning('node %s health check failed: %s', node.name, exc)
+                node.healthy = False
+
+        heads = [node.head for node in self._nodes if node.healthy and node.head is not None]
+        freshest = max(heads) if heads else None
+        for node in self._nodes:
+            lagging = freshest is not None and node.head is not None and freshest - node.head > self._max_lag
+            if node.healthy and (node.syncing or lagging):
+                logger.info('node %s is ejected: head %s, freshest head %s, syncing %s',
+                            node.name, node.head, freshest, node.syncing)
+                node.healthy = False
+
+
+def _not_sent(exc):
+    """
+    :return: True if the request surely didn't reach the node: the connection was refused
+    """
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        if isinstance(exc, (ConnectionRefusedError, NewConnectionError)):
+            return True
+        # requests and urllib3 wrap the cause
+        wrapped = [getattr(exc, 'reason', None)] + [arg for arg in exc.args if isinstance(arg, BaseException)]
+        exc = next((cause for cause in wrapped if isinstance(cause, BaseException)), exc.__cause__ or exc.__context__)
+    return False
+
+
+class _Node(object):
+
+    LATENCY_EWMA_WEIGHT = 0.2
+
+    def __init__(self, name, provider, weight):
+        self.name = name
+        self.provider = provider
+        self.weight = float(weight)
+
+        self.latency = None     # exponentially weighted moving average, seconds
+        self.head = None
+        self.syncing = False
+        self.healthy = True
+        self.banned_until = 0
+
+    def is_usable(self):
+        return self.healthy and self.banned_until < time()
+
+    def score(self):
+        return self.weight / max(self.latency or 0.01, 0.001)
+
+    def ban(self, seconds):
+        self.banned_until = time() + seconds
+
+    def request(self, method, params):
+        return self.timed_request(method, params)[0]
+
+    def timed_request(self, method, params):
+        """
+        :return: tuple (response, latency in seconds)
+        """
+        started = time()
+        response = self.provider.make_request(method, params)
+
+        latency = time() - started
+        self.latency = latency if self.latency is None \
+            else self.latency + self.LATENCY_EWMA_WEIGHT * (latency - self.latency)
+        return response, latency
+
+    def request_result(self, method, params):
+        response = self.request(method, params)
+        if isinstance(response, bytes):
+            response = response.decode('utf-8')
+        if isinstance(response, str):
+            response = json.loads(response)
+        if 'error' in response:
+            raise ValueError(response['error'])
+        return response['result']
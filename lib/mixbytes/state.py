@@ -0,0 +1,235 @@
+
+import os
+import abc
+import stat
+import threading
+from types import MappingProxyType
+
+import yaml
+
+from mixbytes.filelock import FileLock, WouldBlockError
+
+
+class StateBase(abc.ABC):
+    """
+    Dictionary-like persistent state of the service (account, minter contract).
+    A writer holds an exclusive lock from construction till close() or the end of with-block. What readers lock
+    depends on the backend: a shared lock excluding writers (FileState) or nothing (RedisState, MemoryState).
+    Only assignments of top-level keys are saved (there is no need to copy the state to find changes), so values
+    are read-only: mappings are read-only views and lists are tuples. To change a nested value assign
+    a changed copy to the top-level key.
+    """
+
+    def __init__(self, state, created):
+        self._state = {key: _freeze(value) for key, value in (state or {}).items()}
+        self._created = created
+        self._modified = False
+        self._locked = True
+
+
+    def __enter__(self):
+        assert self._locked, "reuse is not possible"
+        return self     # already locked
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._unlock()
+        self._locked = False
+
+
+    def __getitem__(self, key):
+        assert self._locked
+        return self._state[key]
+
+    def __setitem__(self, key, value):
+        assert self._locked
+        self._state[key] = _freeze(value)
+        self._modified = True
+
+    def __contains__(self, item):
+        assert self._locked
+        return item in self._state
+
+    def get(self, key, default):
+        assert self._locked
+        return self._state.get(key, default)
+
+
+    @property
+    def account_address(self):
+        return self.get('account', dict()).get('address')
+
+    def get_account_address(self):
+        if self.account_address is None:
+            raise RuntimeError('account was not initialized')
+        return self.account_address
+
+    def get_minter_contract_address(self):
+        if 'minter_contract' not in self:
+            raise RuntimeError('contract was not deployed')
+        return self['minter_contract']
+
+
+    def save(self, sync=False):
+        assert self._locked
+        if not self._modified:
+            return
+        self._save(yaml.safe_dump(_thaw(self._state), default_flow_style=False), sync)
+        self._modified = False
+        self._created = False
+
+    def close(self):
+        if self._locked:
+            self.save()
+            self._unlock()
+            self._locked = False
+
+
+    @abc.abstractmethod
+    def _save(self, serialized, sync):
+        pass
+
+    @abc.abstractmethod
+    def _unlock(self):
+        pass
+
+
+class FileState(StateBase):
+    """
+    State in a yaml file guarded by a flock: only one writer per host.
+    """
+
+    def __init__(self, filename, lock_shared=False):
+        self._filename = filename
+
+        self._lock = FileLock(filename + ".lock", non_blocking=True, shared=lock_shared)
+        try:
+            self._lock.lock()   # implicit unlock is at process termination
+        except WouldBlockError:
+            raise RuntimeError('Can\'t acquire state lock: looks like another instance is running')
+
+        if os.path.isfile(filename):
+            with open(filename) as fh:
+                super().__init__(yaml.safe_load(fh), False)
+        else:
+            super().__init__(dict(), True)
+
+    def _save(self, serialized, sync):
+        with open(self._filename, 'w') as fh:
+            if self._created:
+                os.chmod(self._filename, stat.S_IRUSR | stat.S_IWUSR)
+
+            fh.write(serialized)
+
+            if sync:
+                fh.flush()
+                os.fsync(fh.fileno())
+
+    def _unlock(self):
+        self._lock.unlock()
+
+
+class RedisState(StateBase):
+    """
+    State kept in redis as a yaml document, shared by instances on any number of hosts.
+    Readers don't lock at all, writers (control commands) exclude each other with a redis lock.
+    """
+
+    LOCK_TIMEOUT = 600
+
+    def __init__(self, redis_client, key, lock_shared=False):
+        self._redis = redis_client
+        self._key = key
+
+        self._lock = None
+        if not lock_shared:
+            self._lock = redis_client.lock(key + ':lock', timeout=self.LOCK_TIMEOUT)
+            if not self._lock.acquire(blocking=False):
+                raise RuntimeError('Can\'t acquire state lock: looks like another instance is running')
+
+        serialized = redis_client.get(key)
+        if serialized is not None:
+            super().__init__(yaml.safe_load(serialized.decode('utf-8')), False)
+        else:
+            super().__init__(dict(), True)
+
+    def _save(self, serialized, sync):
+        # redis durability is a matter of its own configuration (appendfsync)
+        self._redis.set(self._key, serialized)
+
+    def _unlock(self):
+        if self._lock is not None:
+            self._lock.release()
+            self._lock = None
+
+
+class MemoryState(StateBase):
+    """
+    Process-local stand-in for RedisState (for tests): same semantics, states are kept in memory by key.
+    """
+
+    _storage = dict()
+    _writers = set()    # keys locked by a writer
+    _storage_lock = threading.Lock()
+
+    def __init__(self, key, lock_shared=False):
+        self._key = key
+        self._lock_shared = lock_shared
+
+        cls = self.__class__
+        with cls._storage_lock:
+            if not lock_shared:
+                if key in cls._writers:
+                    raise RuntimeError('Can\'t acquire state lock: looks like another instance is running')
+                cls._writers.add(key)
+
+            serialized = cls._storage.get(key)
+
+        if serialized is not None:
+            super().__init__(yaml.safe_load(serialized), False)
+        else:
+            super().__init__(dict(), True)
+
+    def _save(self, serialized, sync):
+        with self.__class__._storage_lock:
+            self.__class__._storage[self._key] = serialized
+
+    def _unlock(self):
+        if self._lock_shared:
+            return
+        with self.__class__._storage_lock:
+            self.__class__._writers.discard(self._key)
+
+
+class ReadOnlyState(StateBase):
+    """
+    Stand-in for the state in read-only mode: the contract is taken from the configuration,
+    there are no account, no lock and nothing to save.
+    """
+
+    def __init__(self, minter_contract, minter_contract_block_num):
+        super().__init__({
+            'minter_contract': minter_contract,
+            'minter_contract_block_num': int(minter_contract_block_num),
+        }, False)
+
+    def _save(self, serialized, sync):
+        pass    # nothing to save
+
+    def _unlock(self):
+        pass
+
+
+def _freeze(value):
+    if isinstance(value, (dict, MappingProxyType)):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _thaw(value):
+    if isinstance(value, (dict, MappingProxyType)):
+        return {key: _thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(item) for item in value]
+    return value
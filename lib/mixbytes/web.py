@@ -0,0 +1,34 @@
+from functools import lru_cache
+
+from web3 import Web3
+from flask import current_app, request
+
+
+# Statuses and height change only with new blocks (and mint transactions): clients and proxies revalidate them
+# by ETag, which is answered with 304 after a cheap check. Confirmed mints stay minted (with require_confirmations).
+REVALIDATE_CACHE_CONTROL = 'public, no-cache'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+MINTED_ETAG = 'minted'
+
+
+# Checksum validation hashes the address, clients keep minting to the same addresses.
+is_address = lru_cache(maxsize=4096)(Web3.isAddress)
+
+
+def not_modified(etag, cache_control):
+    """
+    :param etag: current version of the resource (None - unknown)
+    :return: 304 response if the client of the current request has the version, otherwise None
+    """
+    if etag is None or not request.if_none_match.contains_weak(etag):
+        return None
+    return with_cache_headers(current_app.response_class(status=304), etag, cache_control)
+
+
+def with_cache_headers(response, etag, cache_control):
+    if etag is None:
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = cache_control
+    return response
@@ -0,0 +1,253 @@
+
+import json
+import logging
+from time import time, sleep
+from urllib.parse import urlparse
+from urllib.request import Request, urlopen
+
+import redis.exceptions
+from web3 import Web3
+
+
+logger = logging.getLogger(__name__)
+
+
+TERMINAL_STATUSES = ('minted', 'failed')
+
+
+class WebhookDispatcher(object):
+    """
+    Notifies clients about outcomes of their mint requests.
+
+    Watched mints and pending deliveries are kept in redis, so nothing is lost on restart:
+     - a hash of watched mint ids (mint_id -> callback url, last status and when to check it again),
+     - a sorted set of deliveries scored by the time of the next attempt,
+     - a list of deliveries which exhausted all attempts.
+    Only one dispatcher at a time is doing the work, see dispatch_once().
+
+    Statuses of watched mints are checked only when something could have changed them: a new transaction of the mint,
+    a transaction of the mint included in a new block, or the block at which enough confirmations are gathered.
+    """
+
+    LOCK_TIMEOUT = 300
+
+    # New blocks are looked through for transactions of watched mints unless the head jumped too far
+    # (e.g. after a pause), in which case every mint is checked.
+    MAX_BLOCKS_TO_SCAN = 16
+
+    def __init__(self, minter, redis_client, conf=None):
+        conf = conf or dict()
+        self._minter = minter
+        self._redis = redis_client
+
+        self._batch_size = int(conf.get('batch_size', 50))
+        self._max_attempts = int(conf.get('max_attempts', 10))
+        self._retry_base_delay = float(conf.get('retry_base_delay', 5))
+        self._retry_max_delay = float(conf.get('retry_max_delay', 600))
+        self._request_timeout = float(conf.get('request_timeout', 10))
+        self._watch_ttl = int(conf.get('watch_ttl', 86400))
+        self._confirmation_milestones = bool(conf.get('confirmation_milestones', False))
+
+        self._checked_head = None   # head at the end of the last round
+
+    def register(self, mint_id, callback_url):
+        """
+        Starts watching mint request
+        :param mint_id: str | bytes, unique mint id for the request (as given by the client)
+        :param callback_url: http(s) url to POST events to
+        """
+        validate_callback_url(callback_url)
+        self._redis.hset(self._key(b'watch'), _mint_id_bytes(mint_id),
+                         json.dumps({'url': callback_url, 'registered': int(time()), 'confirmations': None}))
+
+    def dispatch_once(self):
+        """
+        Checks watched mints and delivers due events.
+        :return: tuple (number of new events, number of delivered events)
+        """
+        lock = self._redis.lock(self._key(b'lock'), timeout=self.LOCK_TIMEOUT, blocking_timeout=0)
+        if not lock.acquire(blocking=False):
+            return 0, 0     # other dispatcher is at work
+        keeper = _LockKeeper(lock, self.LOCK_TIMEOUT)
+        try:
+            return self._collect_events(keeper), self._deliver_due(keeper)
+        except redis.exceptions.LockError:
+            logger.warning('webhooks: the lock expired during the round, another dispatcher may be at work')
+            return 0, 0
+        finally:
+            try:
+                lock.release()
+            except redis.exceptions.LockError:
+                pass    # expired
+
+    def run(self, head_tracker, interval=5):
+        """
+        Dispatches events forever: after every new block, but at least every interval seconds (for retries).
+        """
+        head = None
+        while True:
+            try:
+                enqueued, delivered = self.dispatch_once()
+                if enqueued or delivered:
+                    logger.info('webhooks: %d new events, %d delivered', enqueued, delivered)
+            except redis.exceptions.RedisError as exc:
+                logger.warning('could not contact redis: %s', exc)
+                sleep(interval)
+            head = head_tracker.wait_for_change(head, interval)
+
+
+    def _collect_events(self, keeper):
+        watch_key = self._key(b'watch')
+        head = self._minter.blockchain_height()
+        mined = self._mined_transactions(head)
+
+        enqueued = 0
+        for mint_id, raw in self._redis.hscan_iter(watch_key):
+            keeper.keep()
+            watch = json.loads(raw.decode('utf-8'))
+
+            if time() - watch['registered'] > self._watch_ttl:
+                logger.warning('webhooks: giving up watching mint_id %s, last status: %s',
+                               mint_id.decode('utf-8', 'replace'), watch.get('status'))
+                self._redis.hdel(watch_key, mint_id)
+                continue
+
+            txs = self._minter.known_transactions(mint_id)
+            if txs is not None and not self._needs_check(watch, [Web3.toHex(tx) for tx in txs], mined, head):
+                continue
+
+            status = self._minter.get_minting_status(mint_id)
+            if status['status'] in TERMINAL_STATUSES:
+                self._enqueue(watch['url'], mint_id, status)
+                self._redis.hdel(watch_key, mint_id)
+                enqueued += 1
+                continue
+
+            if (self._confirmation_milestones and status['status'] == 'minting'
+                    and status.get('confirmations') != watch['confirmations']):
+                self._enqueue(watch['url'], mint_id, status)
+                watch['confirmations'] = status.get('confirmations')
+                enqueued += 1
+
+            watch['status'] = status['status']
+            watch['txs'] = None if txs is None else len(txs)
+            watch['recheck_at'] = None
+            if status['status'] == 'minting':
+                # the next confirmation (milestones) or the one making it minted
+                watch['recheck_at'] = head + (1 if self._confirmation_milestones
+                                              else max(1, status.get('rest_confirmations', 1)))
+            self._redis.hset(watch_key, mint_id, json.dumps(watch))
+
+        self._checked_head = head
+        return enqueued
+
+    def _mined_transactions(self, head):
+        """
+        :return: hashes of transactions included in blocks since the last round (None - unknown, check everything)
+        """
+        previous = self._checked_head
+        if previous is None or not 0 <= head - previous <= self.MAX_BLOCKS_TO_SCAN:
+            return None
+
+        mined = set()
+        for block_number in range(previous + 1, head + 1):
+            block = self._minter.get_block(block_number)
+            if block is None:
+                return None
+            mined.update(tx.lower() for tx in block.transactions)
+        return mined
+
+    @staticmethod
+    def _needs_check(watch, txs, mined, head):
+        if watch.get('txs') != len(txs):
+            return True     # not checked yet or a new transaction was sent
+        if mined is None or any(tx in mined for tx in txs):
+            return True
+        return watch.get('recheck_at') is not None and head >= watch['recheck_at']
+
+    def _enqueue(self, url, mint_id, status):
+        event = dict(status, mint_id=mint_id.decode('utf-8', 'replace'))
+        delivery = json.dumps({'url': url, 'event': event, 'attempts': 0, 'created': time()}, sort_keys=True)
+        self._redis.zadd(self._key(b'queue'), {delivery: time()})
+
+    def _deliver_due(self, keeper):
+        queue_key = self._key(b'queue')
+        due = self._redis.zrangebyscore(queue_key, '-inf', time(), start=0, num=self._batch_size * 10)
+
+        batches = dict()
+        for raw in due:
+            delivery = json.loads(raw.decode('utf-8'))
+            batch = batches.setdefault(delivery['url'], [[]])
+            if len(batch[-1]) >= self._batch_size:
+                batch.append([])
+            batch[-1].append((raw, delivery))
+
+        delivered = 0
+        for url, url_batches in batches.items():
+            for batch in url_batches:
+                keeper.keep()
+                if self._post(url, [delivery['event'] for _, delivery in batch]):
+                    self._redis.zrem(queue_key, *[raw for raw, _ in batch])
+                    delivered += len(batch)
+                else:
+                    for raw, delivery in batch:
+                        self._reschedule(raw, delivery)
+
+        return delivered
+
+    def _reschedule(self, raw, delivery):
+        pipe = self._redis.pipeline()
+        pipe.zrem(self._key(b'queue'), raw)
+
+        attempts = delivery['attempts'] + 1
+        if attempts >= self._max_attempts:
+            logger.error('webhooks: giving up delivering %s to %s', delivery['event'], delivery['url'])
+            pipe.lpush(self._key(b'dead'), raw)
+        else:
+            delivery['attempts'] = attempts
+            delay = min(self._retry_max_delay, self._retry_base_delay * 2 ** (attempts - 1))
+            pipe.zadd(self._key(b'queue'), {json.dumps(delivery, sort_keys=True): time() + delay})
+
+        pipe.execute()
+
+    def _post(self, url, events):
+        request = Request(url, data=json.dumps({'events': events}).encode('utf-8'),
+                          headers={'Content-Type': 'application/json'}, method='POST')
+        try:
+            with urlopen(request, timeout=self._request_timeout) as response:
+                return 200 <= response.status < 300
+        except Exception as exc:
+            logger.warning('webhooks: could not deliver %d events to %s: %s', len(events), url, exc)
+            return False
+
+    def _key(self, name):
+        return self._minter._redis_contract_key(b'wh:' + name)
+
+
+class _LockKeeper(object):
+    """
+    Extends the lock of a dispatcher at work, so a long round doesn't let another dispatcher in.
+    """
+
+    def __init__(self, lock, timeout):
+        self._lock = lock
+        self._timeout = timeout
+        self._extended_at = time()
+
+    def keep(self):
+        """
+        :raises redis.exceptions.LockError: if the lock has already expired
+        """
+        elapsed = time() - self._extended_at
+        if elapsed > self._timeout / 3:
+            self._lock.extend(elapsed)      # back to the full timeout
+            self._extended_at = time()
+
+
+def validate_callback_url(url):
+    if urlparse(url).scheme not in ('http', 'https') or not urlparse(url).netloc:
+        raise ValueError('bad callback url')
+
+
+def _mint_id_bytes(mint_id):
+    return mint_id.encode('utf-8') if isinstance(mint_id, str) else mint_id
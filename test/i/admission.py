@@ -0,0 +1,113 @@
+
+import os
+import sys
+import unittest
+from time import sleep
+from unittest import mock
+
+import redis
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
+
+from mixbytes.admission import AdmissionController
+
+
+class TestAdmissionController(unittest.TestCase):
+    """
+    Token buckets and shedding of status requests. Test requires redis (db 15 is used).
+    """
+
+    def setUp(self):
+        self.redis = redis.StrictRedis(host='127.0.0.1', port=6379, db=15)
+        self.redis.flushdb()
+
+    def tearDown(self):
+        self.redis.flushdb()
+
+    def test_client_bucket(self):
+        admission = AdmissionController(self.redis, {'client_rate': 10, 'client_burst': 2})
+
+        self.assertIsNone(admission.admit('a'))
+        self.assertIsNone(admission.admit('a'))
+        retry_after = admission.admit('a')
+        self.assertGreater(retry_after, 0)
+        self.assertLessEqual(retry_after, 0.1)
+
+        # other clients have their own buckets
+        self.assertIsNone(admission.admit('b'))
+
+        # refilled at the rate
+        sleep(0.15)
+        self.assertIsNone(admission.admit('a'))
+        self.assertIsNotNone(admission.admit('a'))
+
+        # the bucket expires once it's full again
+        self.assertGreater(self.redis.pttl(b'adm:c:a'), 0)
+
+    def test_costly_requests(self):
+        admission = AdmissionController(self.redis, {'client_rate': 1, 'client_burst': 5})
+        self.assertIsNone(admission.admit('a', cost=4))
+        self.assertAlmostEqual(admission.admit('a', cost=4), 3, delta=0.1)
+
+    def test_global_bucket(self):
+        admission = AdmissionController(self.redis, {'client_rate': 100, 'global_rate': 1, 'global_burst': 3})
+        for client in ('a', 'b', 'c'):
+            self.assertIsNone(admission.admit(client))
+        self.assertIsNotNone(admission.admit('d'))
+
+    def test_shedding(self):
+        load = {'pending': 0, 'latency': None}
+        admission = AdmissionController(
+            self.redis, {'max_pending_transactions': 10, 'max_node_latency': 1, 'shed_retry_after': 7,
+                         'load_check_interval': 0},
+            pending_transactions_fn=lambda: load['pending'], node_latency_fn=lambda: load['latency'])
+
+        self.assertIsNone(admission.admit('a'))
+
+        load['pending'] = 11
+        self.assertEqual(admission.admit('a'), 7)
+
+        load['pending'] = 10
+        load['latency'] = 1.5
+        self.assertEqual(admission.admit('a'), 7)
+
+        load['latency'] = 0.5
+        self.assertIsNone(admission.admit('a'))
+
+    def test_unknown_load_is_not_overload(self):
+        def fail():
+            raise ConnectionError('node is down')
+
+        admission = AdmissionController(self.redis, {'max_pending_transactions': 10, 'load_check_interval': 0},
+                                        pending_transactions_fn=fail)
+        self.assertIsNone(admission.admit('a'))
+
+    def test_load_checked_once_per_interval(self):
+        checks = []
+        admission = AdmissionController(self.redis, {'max_pending_transactions': 10, 'load_check_interval': 60},
+                                        pending_transactions_fn=lambda: checks.append(1) or 100)
+        for _ in range(5):
+            self.assertIsNotNone(admission.admit('a'))
+        self.assertEqual(len(checks), 1)
+
+    def test_admits_without_redis(self):
+        admission = AdmissionController(self.redis, {'client_rate': 1, 'client_burst': 1})
+        with mock.patch.object(admission, '_script', side_effect=redis.exceptions.ConnectionError()):
+            for _ in range(3):
+                self.assertIsNone(admission.admit('a'))
+
+    def test_client_id(self):
+        direct = AdmissionController(self.redis, {})
+        self.assertEqual(direct.client_id('10.0.0.1', '1.1.1.1'), '10.0.0.1')
+        self.assertEqual(direct.client_id(None), 'unknown')
+
+        # the client sends "X-Forwarded-For: 1.1.1.1", two proxies append
+        proxied = AdmissionController(self.redis, {'trusted_proxies': 2})
+        self.assertEqual(proxied.client_id('10.0.0.2', '1.1.1.1, 2.2.2.2, 10.0.0.1'), '2.2.2.2')
+        self.assertEqual(proxied.client_id('10.0.0.2', '2.2.2.2, 10.0.0.1'), '2.2.2.2')
+        # around the proxies
+        self.assertEqual(proxied.client_id('3.3.3.3', '1.1.1.1'), '3.3.3.3')
+
+
+if __name__ == '__main__':
+    unittest.main()
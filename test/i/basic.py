@@ -7,13 +7,20 @@ from shutil import rmtree
 from os.path import join
 import logging
 import json
-from time import sleep
+from time import time
+from unittest import mock
+
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from threading import Thread
 
 import yaml
 
 sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
 
 from mixbytes.minter import MinterService, UsageError, get_receipt_status
+from mixbytes.webhooks import WebhookDispatcher
+from mixbytes.blocks import HeadTracker, ReceiptWaiter, ReceiptTimeoutError
+from mixbytes.filelock import FileLock
 
 
 class TestMinterService(unittest.TestCase):
@@ -52,6 +59,9 @@ class TestMinterService(unittest.TestCase):
         with open(cls._conf_file, 'w') as fh:
             yaml.safe_dump(conf, fh, default_flow_style=False)
 
+        w3 = cls.createMinter().create_web3()
+        cls._receipt_waiter = ReceiptWaiter(w3, HeadTracker(w3, 0.1))
+
     @classmethod
     def createMinter(cls, wsgi_mode=False) -> MinterService:
         return MinterService(cls._conf_file, join(cls._install_dir, 'built_contracts'), wsgi_mode)
@@ -138,6 +148,112 @@ class TestMinterService(unittest.TestCase):
         finally:
             minter.close()
 
+    def test_3a_wait_minting_status(self):
+        minter = self.__class__.createMinter(True)
+        try:
+            w3 = minter.create_web3()
+            investor = w3.toBytes(hexstr='0x{:040X}'.format(14))
+
+            # status differs from the known one - no waiting
+            self.assertEqual(minter.wait_minting_status('m1', 'not_minted', timeout=10)['status'], 'minted')
+
+            # nothing happens with unknown mint until the timeout
+            started = time()
+            self.assertEqual(minter.wait_minting_status('xx', 'not_minted', timeout=1)['status'], 'not_minted')
+            self.assertGreaterEqual(time() - started, 1)
+
+            tx_hash = minter.mint_tokens('m4', investor, 1000)
+            self.assertIn(minter.wait_minting_status('m4', 'not_minted', timeout=10)['status'], ('minting', 'minted'))
+            _get_receipt_blocking(tx_hash, w3)
+        finally:
+            minter.close()
+
+    def test_3d_minting_status_version(self):
+        minter = self.__class__.createMinter(True)
+        try:
+            w3 = minter.create_web3()
+            minter.head_tracker().wait_for_change(None, 10)
+
+            version = minter.minting_status_version('m5')
+            self.assertIsNotNone(version)
+            self.assertEqual(minter.minting_status_version('m5'), version)
+
+            # a sent transaction changes the version even before the next block is seen
+            tx_hash = minter.mint_tokens('m5', w3.toBytes(hexstr='0x{:040X}'.format(15)), 1000)
+            self.assertNotEqual(minter.minting_status_version('m5'), version)
+            _get_receipt_blocking(tx_hash, w3)
+        finally:
+            minter.close()
+
+    def test_3b_webhooks(self):
+        received = []
+
+        class Receiver(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                received.extend(json.loads(body.decode('utf-8'))['events'])
+                self.send_response(200 if len(received) > 1 else 500)   # the first delivery fails
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Receiver)
+        Thread(target=server.serve_forever, daemon=True).start()
+
+        minter = self.__class__.createMinter(True)
+        try:
+            w3 = minter.create_web3()
+            investor = w3.toBytes(hexstr='0x{:040X}'.format(15))
+            url = 'http://127.0.0.1:{}/minted'.format(server.server_address[1])
+
+            _get_receipt_blocking(minter.mint_tokens('m5', investor, 1000, callback_url=url), w3)
+
+            dispatcher = WebhookDispatcher(minter, minter._redis, {'retry_base_delay': 0})
+            self.assertEqual(dispatcher.dispatch_once(), (1, 0))
+            self.assertEqual(dispatcher.dispatch_once(), (0, 1))
+            self.assertEqual(dispatcher.dispatch_once(), (0, 0))
+
+            self.assertEqual(received, [{'mint_id': 'm5', 'status': 'minted'}] * 2)
+        finally:
+            minter.close()
+            server.shutdown()
+
+    def test_3c_read_only(self):
+        with open(self.__class__._conf_file) as fh:
+            conf = yaml.safe_load(fh)
+        with open(join(conf['data_directory'], 'state.yaml')) as fh:
+            state = yaml.safe_load(fh)
+
+        del conf['data_directory']
+        conf['read_only'] = True
+        conf['minter_contract'] = state['minter_contract']
+        conf['minter_contract_block_num'] = state['minter_contract_block_num']
+        conf_file = join(self.__class__._install_dir, 'conf', 'read_only.conf')
+        with open(conf_file, 'w') as fh:
+            yaml.safe_dump(conf, fh, default_flow_style=False)
+
+        # no state lock is taken, so any number of replicas can run alongside the writer
+        writer = self.__class__.createMinter(True)
+        with mock.patch.object(FileLock, 'lock', autospec=True, side_effect=FileLock.lock) as lock, \
+                mock.patch('mixbytes.minter._Conf.get_state') as get_state:
+            replicas = [MinterService(conf_file, join(self.__class__._install_dir, 'built_contracts'), True)
+                        for _ in range(2)]
+        self.assertFalse(lock.called)
+        self.assertFalse(get_state.called)
+        try:
+            for replica in replicas:
+                self.assertTrue(replica.read_only)
+                self.assertEqual(replica.get_minting_status('m1')['status'], 'minted')
+                self.assertEqual(replica.get_minting_status('zz')['status'], 'not_minted')
+
+                with self.assertRaises(UsageError):
+                    replica.mint_tokens('m6', '0x{:040X}'.format(16), 1000)
+        finally:
+            writer.close()
+            for replica in replicas:
+                replica.close()
+
     
     def test_4_recover_ether(self):
         minter = self.__class__.createMinter()
@@ -158,6 +274,10 @@ class TestMinterService(unittest.TestCase):
         _get_receipt_blocking(tx_hash, w3)
         self.assertLess(height, minter.blockchain_height())
 
+    def test_6_receipt_waiter_timeout(self):
+        with self.assertRaises(ReceiptTimeoutError):
+            self.__class__._receipt_waiter.wait('0x' + '42' * 32, 0.5)
+
 
     def _token_json(self):
         with open(join(self.__class__._root_dir, 'build', 'contracts', 'SimpleMintableToken.json')) as fh:
@@ -165,8 +285,4 @@ class TestMinterService(unittest.TestCase):
 
 
 def _get_receipt_blocking(tx_hash, w3):
-    while True:
-        receipt = w3.eth.getTransactionReceipt(tx_hash)
-        if receipt is not None:
-            return receipt
-        sleep(0.1)
+    return TestMinterService._receipt_waiter.wait(tx_hash, 60)
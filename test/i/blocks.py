@@ -0,0 +1,60 @@
+import os
+import sys
+import unittest
+from threading import Thread, Event
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
+
+from mixbytes.blocks import SharedResults
+
+
+class TestSharedResults(unittest.TestCase):
+
+    def test_computed_once(self):
+        shared = SharedResults()
+        computing = Event()
+        release = Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            computing.set()
+            release.wait(5)
+            return {'status': 'minting'}
+
+        results = []
+        threads = [Thread(target=lambda: results.append(shared.get(('m1', '10-1'), compute))) for _ in range(8)]
+        threads[0].start()
+        self.assertTrue(computing.wait(5))
+        for thread in threads[1:]:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'status': 'minting'}] * 8)
+
+        # the next block is another key
+        self.assertEqual(shared.get(('m1', '11-1'), lambda: 'minted'), 'minted')
+
+    def test_failure_is_not_shared(self):
+        shared = SharedResults()
+
+        def fail():
+            raise RuntimeError('node is down')
+
+        with self.assertRaises(RuntimeError):
+            shared.get('k', fail)
+        self.assertEqual(shared.get('k', lambda: 42), 42)
+
+    def test_bounded(self):
+        shared = SharedResults(max_entries=2)
+        for key in range(3):
+            shared.get(key, lambda: key)
+        self.assertEqual(shared.get(0, lambda: 'recomputed'), 'recomputed')
+        self.assertEqual(shared.get(2, lambda: 'recomputed'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+from collections import namedtuple
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
+
+from mixbytes.bulk import BulkMinter
+from mixbytes.blocks import ReceiptTimeoutError
+
+
+ADDRESS = '0x' + '11' * 20
+
+
+class TestBulkMinter(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, name, content):
+        filename = os.path.join(self.directory, name)
+        with open(filename, 'w') as fh:
+            fh.write(content)
+        return filename
+
+    def test_validate(self):
+        filename = self._write('mints.csv', 'mint_id,address,amount\n'
+                                            'a,{0},10\n'
+                                            'b,0xbad,10\n'
+                                            'c,{0},-1\n'
+                                            'a,{0},20\n'.format(ADDRESS))
+        rows, errors = BulkMinter(_Minter()).validate(filename)
+        self.assertEqual(rows, 4)
+        self.assertEqual(errors, ['row 2: bad address', 'row 3: bad amount', 'row 4: duplicate mint_id'])
+
+        filename = self._write('mints.jsonl', json.dumps({'mint_id': 'a', 'address': ADDRESS, 'amount': 1}) + '\n'
+                                              + '\n'
+                                              + 'garbage\n')
+        self.assertEqual(BulkMinter(_Minter()).validate(filename), (2, ['row 2: bad mint_id']))
+
+    def test_pipelining_and_resume(self):
+        filename = self._write('mints.csv', ''.join('{},{},{}\n'.format(i, ADDRESS, i + 1) for i in range(10)))
+
+        minter = _Minter(fail_on='5')
+        with self.assertRaises(RuntimeError):
+            BulkMinter(minter, max_in_flight=3).run(filename)
+        self.assertEqual([nonce for _, nonce in minter.sent], [100, 101, 102, 103, 104])
+        # no more than 3 transactions were unmined at a time
+        self.assertEqual(minter.max_in_flight, 3)
+
+        # the rest is sent on restart, mint 5 was not sent by the crashed run
+        minter = _Minter()
+        stats = BulkMinter(minter, max_in_flight=3).run(filename)
+        self.assertEqual([mint_id for mint_id, _ in minter.sent], [str(i) for i in range(5, 10)])
+        self.assertEqual((stats['sent'], stats['mined'], stats['skipped']), (5, 5, 5))
+
+        self.assertEqual(BulkMinter(_Minter()).run(filename)['skipped'], 10)
+
+    def test_interrupted_row(self):
+        filename = self._write('mints.csv', 'a,{0},1\nb,{0},1\n'.format(ADDRESS))
+        with open(filename + '.checkpoint', 'w') as fh:
+            fh.write('{"sent": 1, "tx": "0x01"}\n{"sending": 2}\n')
+
+        # the crashed run did send mint b
+        minter = _Minter(statuses={'b': 'minting'})
+        self.assertEqual(BulkMinter(minter).run(filename)['skipped'], 2)
+        self.assertEqual(minter.sent, [])
+
+    def test_unresolved_rows(self):
+        filename = self._write('mints.csv', 'a,{0},1\nb,{0},1\nc,{0},1\n'.format(ADDRESS))
+
+        # the transaction of mint b is stuck
+        minter = _Minter(stuck='b')
+        stats = BulkMinter(minter, receipt_timeout=5).run(filename)
+        self.assertEqual((stats['sent'], stats['mined'], stats['unresolved']), (3, 2, 1))
+        self.assertEqual(minter.timeouts, [5, 5, 5])
+
+        with open(filename + '.checkpoint') as fh:
+            records = [json.loads(line) for line in fh]
+        self.assertIn({'unresolved': 2, 'tx': '0x{:064x}'.format(2)}, records)
+
+        # it's not sent again
+        self.assertEqual(BulkMinter(_Minter()).run(filename)['skipped'], 3)
+
+
+class _Minter(object):
+
+    def __init__(self, fail_on=None, statuses=None, stuck=None):
+        self.sent = []
+        self.mined = set()
+        self.max_in_flight = 0
+        self.timeouts = []
+        self._fail_on = fail_on
+        self._stuck = stuck
+        self._statuses = statuses or dict()
+
+    def next_nonce(self):
+        return 100
+
+    def mint_tokens(self, mint_id, address, tokens, priority=None, nonce=None):
+        if mint_id == self._fail_on:
+            raise RuntimeError('node is gone')
+        self.sent.append((mint_id, nonce))
+        self.max_in_flight = max(self.max_in_flight, len(self.sent) - len(self.mined))
+        return '0x{:064x}'.format(len(self.sent))
+
+    def get_minting_status(self, mint_id):
+        return {'status': self._statuses.get(mint_id, 'not_minted')}
+
+    def receipt_waiter(self):
+        return self
+
+    def wait(self, tx_hash, timeout=None):
+        self.timeouts.append(timeout)
+        if self._stuck is not None and (self._stuck, tx_hash) in self._sent_hashes():
+            raise ReceiptTimeoutError(tx_hash)
+        self.mined.add(tx_hash)
+        return _Receipt(1)
+
+    def _sent_hashes(self):
+        return {(mint_id, '0x{:064x}'.format(i + 1)) for i, (mint_id, _) in enumerate(self.sent)}
+
+
+_Receipt = namedtuple('_Receipt', ['status'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+
+import os
+import sys
+import unittest
+import tempfile
+from shutil import rmtree
+
+import redis
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
+
+from mixbytes.minter import MinterService
+from fake_node import FakeNode, write_read_only_setup
+
+
+TX1 = '0x' + '0a' * 32
+TX2 = '0x' + '0b' * 32
+
+
+class TestMintBlockNumber(unittest.TestCase):
+    """
+    Confirmations are counted from the block of the mint transaction, which is cached in the mint index.
+    Test requires redis (db 15 is used).
+    """
+
+    def setUp(self):
+        self.redis = redis.StrictRedis(host='127.0.0.1', port=6379, db=15)
+        self.redis.flushdb()
+
+        self.node = FakeNode()
+        self.directory = tempfile.mkdtemp()
+        self.minter = MinterService(*write_read_only_setup(self.directory, self.node.url), wsgi_mode=True)
+
+        self.mint_id = MinterService._prepare_mint_id('m1')
+        self.key = self.minter._redis_mint_tx_key(self.mint_id)
+
+    def tearDown(self):
+        self.minter.close()
+        self.node.close()
+        rmtree(self.directory)
+        self.redis.flushdb()
+
+    def test_unknown_mint(self):
+        self.assertIsNone(self.minter._get_mint_block_number(self.mint_id, self.node.head))
+
+    def test_cached_block(self):
+        mined_at = self._mine(TX1)
+        self.node.add_block()
+
+        self.assertEqual(self.minter._get_mint_block_number(self.mint_id, self.node.head), mined_at)
+        self.assertEqual(self.minter.mint_index().get(self.key)[1], (mined_at, bytes(8), 102))
+
+        # the same head: the node is not asked
+        self.node.calls.clear()
+        self.assertEqual(self.minter._get_mint_block_number(self.mint_id, self.node.head), mined_at)
+        self.assertEqual(self._block_calls(), 0)
+
+        # a new head: only the block hash is checked
+        self.node.add_block()
+        self.assertEqual(self.minter._get_mint_block_number(self.mint_id, self.node.head), mined_at)
+        self.assertEqual(self.node.calls['eth_getBlockByNumber'], 1)
+        self.assertEqual(self.node.calls['eth_getTransactionReceipt'], 0)
+        self.assertEqual(self.minter.mint_index().get(self.key)[1][2], self.node.head)
+
+    def test_reorg(self):
+        mined_at = self._mine(TX1)
+        self.minter._get_mint_block_number(self.mint_id, self.node.head)
+
+        # the block is replaced, the transaction gets into the next one
+        self.node.head = mined_at - 1
+        self.node.add_block(block_hash='0x' + 'ee' * 32)
+        remined_at = self.node.add_block([TX1])
+        self.node.add_receipt(TX1, remined_at)
+
+        self.assertEqual(self.minter._get_mint_block_number(self.mint_id, self.node.head), remined_at)
+        self.assertEqual(self.minter.mint_index().get(self.key)[1][0], remined_at)
+
+        # the transaction is not in the chain anymore
+        self.node.head = mined_at - 1
+        self.node.add_block(block_hash='0x' + 'dd' * 32)
+        del self.node.receipts[TX1]
+        self.assertIsNone(self.minter._get_mint_block_number(self.mint_id, self.node.head))
+        self.assertIsNone(self.minter.mint_index().get(self.key)[1])
+
+    def test_earliest_successful_transaction(self):
+        failed_at = self._mine(TX1, status=0)
+        mined_at = self._mine(TX2)
+        self.assertGreater(mined_at, failed_at)
+        self.assertEqual(self.minter._get_mint_block_number(self.mint_id, self.node.head), mined_at)
+
+    def test_minting_status_confirmations(self):
+        mined_at = self._mine(TX1)
+        self.node.processed_mint_ids[self.mint_id] = mined_at
+        self.node.add_block()
+
+        self.assertEqual(self.minter.get_minting_status('m1'),
+                         {'status': 'minting', 'confirmations': 1, 'rest_confirmations': 2})
+
+        for _ in range(2):
+            self.node.add_block()
+        self.assertEqual(self.minter.get_minting_status('m1'), {'status': 'minted'})
+
+
+    def _mine(self, tx_hash, status=1):
+        self.minter.mint_index().add_tx(self.key, bytes.fromhex(tx_hash[2:]))
+        block_number = self.node.add_block([tx_hash])
+        self.node.add_receipt(tx_hash, block_number, status)
+        return block_number
+
+    def _block_calls(self):
+        return self.node.calls['eth_getBlockByNumber'] + self.node.calls['eth_getTransactionReceipt']
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+
+import os
+import sys
+import json
+import importlib
+import threading
+from collections import Counter
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from time import sleep
+from unittest import mock
+
+import yaml
+
+
+# the part of ReenterableMinter abi used by the service
+MINTER_ABI = [
+    {'constant': False, 'inputs': [{'name': 'mint_id', 'type': 'bytes32'}, {'name': 'to', 'type': 'address'},
+                                   {'name': 'amount', 'type': 'uint256'}],
+     'name': 'mint', 'outputs': [], 'payable': False, 'type': 'function'},
+    {'constant': True, 'inputs': [], 'name': 'm_token', 'outputs': [{'name': '', 'type': 'address'}],
+     'payable': False, 'type': 'function'},
+    {'constant': True, 'inputs': [{'name': '', 'type': 'bytes32'}], 'name': 'm_processed_mint_id',
+     'outputs': [{'name': '', 'type': 'bool'}], 'payable': False, 'type': 'function'},
+]
+
+MINTER_CONTRACT = '0x' + '5a' * 20
+
+
+def write_read_only_setup(directory, node_url, **settings):
+    """
+    Writes configuration of a read-only instance served by the node (redis db 15) and the contract it needs
+    :param settings: settings to add or override
+    :return: tuple (configuration filename, contracts directory)
+    """
+    contracts_directory = os.path.join(directory, 'built_contracts')
+    os.makedirs(contracts_directory, exist_ok=True)
+    with open(os.path.join(contracts_directory, 'ReenterableMinter.json'), 'w') as fh:
+        json.dump({'contractName': 'ReenterableMinter', 'abi': MINTER_ABI, 'bytecode': '0x'}, fh)
+
+    conf = {
+        'read_only': True,
+        'minter_contract': MINTER_CONTRACT,
+        'minter_contract_block_num': 1,
+        'web3_provider': {'class': 'HTTPProvider', 'args': [node_url]},
+        'redis': {'host': '127.0.0.1', 'port': 6379, 'db': 15},
+        'require_confirmations': 3,
+        'head_poll_interval': 0.05,
+    }
+    conf.update(settings)
+    conf_filename = os.path.join(directory, 'minter.conf')
+    with open(conf_filename, 'w') as fh:
+        yaml.safe_dump(conf, fh, default_flow_style=False)
+    return conf_filename, contracts_directory
+
+
+def import_wsgi_app(conf_filename, contracts_directory):
+    """
+    Imports bin/wsgi_app anew, serving the configuration
+    :return: the module (the caller closes its minters)
+    """
+    bin_directory = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..', 'bin'))
+    if bin_directory not in sys.path:
+        sys.path.append(bin_directory)
+    sys.modules.pop('wsgi_app', None)
+    with mock.patch.dict(os.environ, {'MINTER_CONF': conf_filename, 'MINTER_CONTRACTS_DIRECTORY': contracts_directory,
+                                      'LOG_LEVEL': 'WARNING'}):
+        return importlib.import_module('wsgi_app')
+
+
+class FakeNode(object):
+    """
+    Ethereum node answering JSON-RPC from in-memory chain data, for tests which need neither contracts
+    nor a real chain. Tests change the attributes directly.
+    """
+
+    def __init__(self):
+        self.head = 100
+        self.syncing = False
+        self.blocks = dict()        # number -> {'hash': ..., 'transactions': [tx hash, ...]}
+        self.transactions = dict()  # tx hash -> transaction dict (hex values)
+        self.receipts = dict()      # tx hash -> receipt dict (hex values)
+        self.processed_mint_ids = dict()    # prepared mint id -> block since which m_processed_mint_id() is true
+        self.delay = 0              # seconds to answer
+        self.calls = Counter()      # method -> number of requests
+        self.called_contracts = Counter()   # lowercase contract address -> number of eth_call requests
+
+        node = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+                body = json.dumps(node._answer(request)).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self._server.server_address[1])
+
+    def add_block(self, transactions=(), block_hash=None):
+        """
+        Mines a block on top of the head
+        :return: number of the block
+        """
+        self.head += 1
+        self.blocks[self.head] = {'hash': block_hash or '0x{:064x}'.format(self.head),
+                                  'transactions': list(transactions)}
+        return self.head
+
+    def add_receipt(self, tx_hash, block_number, status=1):
+        self.receipts[tx_hash] = {'transactionHash': tx_hash, 'blockNumber': hex(block_number),
+                                  'blockHash': self.blocks[block_number]['hash'], 'status': hex(status)}
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+    def _answer(self, request):
+        method, params = request['method'], request.get('params', [])
+        self.calls[method] += 1
+        if self.delay:
+            sleep(self.delay)
+
+        if 'eth_blockNumber' == method:
+            result = hex(self.head)
+        elif 'eth_syncing' == method:
+            result = {'startingBlock': '0x0', 'currentBlock': hex(self.head), 'highestBlock': hex(self.head + 100)} \
+                if self.syncing else False
+        elif 'net_version' == method:
+            result = '1'
+        elif 'personal_unlockAccount' == method:
+            result = True
+        elif 'eth_gasPrice' == method:
+            result = hex(20 * 10 ** 9)
+        elif 'eth_getBlockByNumber' == method:
+            number = self.head if 'latest' == params[0] else int(params[0], 16)
+            block = self.blocks.get(number, {'hash': '0x{:064x}'.format(number), 'transactions': []}) \
+                if number <= self.head else None
+            result = None if block is None else dict(block, number=hex(number), gasLimit=hex(8000000))
+        elif 'eth_getTransactionByHash' == method:
+            result = self.transactions.get(params[0])
+        elif 'eth_getTransactionReceipt' == method:
+            result = self.receipts.get(params[0])
+        elif 'eth_call' == method:
+            # the only function called is m_processed_mint_id(bytes32)
+            self.called_contracts[params[0]['to'].lower()] += 1
+            mint_id = bytes.fromhex(params[0]['data'][-64:])
+            block = params[1] if len(params) > 1 else 'latest'
+            block_number = self.head if block in ('latest', 'pending') else int(block, 16)
+            result = '0x{:064x}'.format(1 if self.processed_mint_ids.get(mint_id, block_number + 1) <= block_number
+                                        else 0)
+        else:
+            return {'jsonrpc': '2.0', 'id': request['id'], 'error': {'code': -32601, 'message': 'no ' + method}}
+
+        return {'jsonrpc': '2.0', 'id': request['id'], 'result': result}
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
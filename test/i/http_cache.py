@@ -0,0 +1,131 @@
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+import redis
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
+
+from mixbytes.minter import MinterService
+from fake_node import FakeNode, write_read_only_setup, import_wsgi_app
+
+
+class TestHttpCache(unittest.TestCase):
+    """
+    ETags and Cache-Control of status and height responses. Test requires redis (db 15 is used).
+    """
+
+    def setUp(self):
+        self.redis = redis.StrictRedis(host='127.0.0.1', port=6379, db=15)
+        self.redis.flushdb()
+        self.node = FakeNode()
+        self.directory = tempfile.mkdtemp()
+        self.wsgi_app = None
+
+    def tearDown(self):
+        if self.wsgi_app is not None:
+            self.wsgi_app.wsgi_minter.close()
+        self.node.close()
+        shutil.rmtree(self.directory)
+        self.redis.flushdb()
+
+    def test_minting_status(self):
+        client = self._client()
+        head = self.wsgi_app.wsgi_minter.head_tracker().wait_for_change(None, 5)
+
+        response = client.get('/getMintingStatus?mint_id=m1')
+        self.assertEqual(response.get_json()['status'], 'not_minted')
+        etag = 'W/"{}-0"'.format(head)
+        self._assert_cache_headers(response, etag, 'public, no-cache')
+
+        # revalidated without asking the node
+        calls = self._status_calls()
+        response = client.get('/getMintingStatus?mint_id=m1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self._assert_cache_headers(response, etag, 'public, no-cache')
+        self.assertEqual(self._status_calls(), calls)
+
+        # a new block may change the status
+        self.node.processed_mint_ids[MinterService._prepare_mint_id('m1')] = self.node.add_block()
+        for _ in range(3):
+            self.node.add_block()
+        self.wsgi_app.wsgi_minter.head_tracker().wait_for_change(head, 5)
+        self.assertEqual(self.wsgi_app.wsgi_minter.head_tracker().head, self.node.head)
+
+        response = client.get('/getMintingStatus?mint_id=m1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['status'], 'minted')
+        # confirmed mints stay minted
+        self._assert_cache_headers(response, 'W/"minted"', 'public, max-age=31536000, immutable')
+
+        calls = self._status_calls()
+        for if_none_match in ('W/"minted"', '"minted"', '{}, W/"minted"'.format(etag)):
+            response = client.get('/getMintingStatus?mint_id=m1', headers={'If-None-Match': if_none_match})
+            self.assertEqual(response.status_code, 304, if_none_match)
+            self._assert_cache_headers(response, 'W/"minted"', 'public, max-age=31536000, immutable')
+        self.assertEqual(self._status_calls(), calls)
+
+    def test_unconfirmed_minting_status(self):
+        # without confirmations a reorganization of the chain may take "minted" back
+        client = self._client(require_confirmations=0)
+        self.node.processed_mint_ids[MinterService._prepare_mint_id('m1')] = self.node.add_block()
+        head = self.wsgi_app.wsgi_minter.head_tracker().wait_for_change(None, 5)
+        self.assertFalse(self.wsgi_app.wsgi_minter.is_minted_status_final())
+
+        response = client.get('/getMintingStatus?mint_id=m1', headers={'If-None-Match': 'W/"minted"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['status'], 'minted')
+        etag = 'W/"{}-0"'.format(head)
+        self._assert_cache_headers(response, etag, 'public, no-cache')
+
+        response = client.get('/getMintingStatus?mint_id=m1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self._assert_cache_headers(response, etag, 'public, no-cache')
+
+    def test_blockchain_height(self):
+        # the head tracker is polled once at start, then lags behind the node
+        client = self._client(head_poll_interval=60)
+        tracked = self.wsgi_app.wsgi_minter.head_tracker().wait_for_change(None, 5)
+
+        response = client.get('/blockChainHeight')
+        self.assertEqual(response.get_json(), tracked)
+        self._assert_cache_headers(response, 'W/"{}"'.format(tracked), 'public, no-cache')
+
+        calls = self.node.calls['eth_blockNumber']
+        response = client.get('/blockChainHeight', headers={'If-None-Match': 'W/"{}"'.format(tracked)})
+        self.assertEqual(response.status_code, 304)
+        self._assert_cache_headers(response, 'W/"{}"'.format(tracked), 'public, no-cache')
+        self.assertEqual(self.node.calls['eth_blockNumber'], calls)
+
+        self.node.add_block()
+        # the height is taken from the node, the version of the client is still the tracked head
+        response = client.get('/blockChainHeight')
+        self.assertEqual(response.get_json(), tracked + 1)
+        self._assert_cache_headers(response, 'W/"{}"'.format(tracked + 1), 'public, no-cache')
+
+        # the client knowing the newer height isn't answered from the stale head
+        response = client.get('/blockChainHeight', headers={'If-None-Match': 'W/"{}"'.format(tracked + 1)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), tracked + 1)
+
+
+    def _status_calls(self):
+        # the head tracker polls eth_blockNumber meanwhile, status checks make calls it doesn't
+        return sum(self.node.calls[method] for method in ('eth_call', 'eth_getTransactionByHash',
+                                                          'eth_getTransactionReceipt', 'eth_syncing'))
+
+    def _client(self, **settings):
+        self.wsgi_app = import_wsgi_app(*write_read_only_setup(self.directory, self.node.url, **settings))
+        return self.wsgi_app.app.test_client()
+
+    def _assert_cache_headers(self, response, etag, cache_control):
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(response.headers['Cache-Control'], cache_control)
+
+
+if __name__ == '__main__':
+    unittest.main()
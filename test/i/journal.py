@@ -0,0 +1,205 @@
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from contextlib import contextmanager
+from threading import Thread
+from time import time
+
+import redis
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
+
+from mixbytes import journal
+from mixbytes.journal import MintJournal
+from mixbytes.lanes import LaneBusyError
+from mixbytes.leader import NotLeaderError
+from mixbytes.minter import MinterService, JOURNAL_DROPPED_TX_AGE
+from fake_node import FakeNode, write_read_only_setup
+
+
+class TestMintJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_group_commit(self):
+        syncs = []
+        original_fdatasync = journal._fdatasync
+        journal._fdatasync = lambda fd: syncs.append(fd) or original_fdatasync(fd)
+        try:
+            mint_journal = MintJournal(self.directory, max_delay=0.05)
+            threads = [Thread(target=mint_journal.sent, args=(bytes([i]) * 32, '0x{:064x}'.format(i)))
+                       for i in range(20)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            mint_journal.close()
+        finally:
+            journal._fdatasync = original_fdatasync
+
+        # all mints became durable, sharing fsyncs
+        self.assertLess(len(syncs), 20)
+        segments = os.listdir(self.directory)
+        self.assertEqual(len(segments), 1)
+        with open(os.path.join(self.directory, segments[0])) as fh:
+            self.assertEqual(len(fh.readlines()), 20)
+
+    def test_replay(self):
+        live = MintJournal(self.directory)
+        live.sent(b'\x00' * 32, '0x00')
+
+        # a segment of a crashed process: one mined, one pending, one about to be sent, torn last line
+        with open(os.path.join(self.directory, '1.0.log'), 'w') as fh:
+            fh.write(json.dumps({'t': 'i', 'm': '01' * 32, 'ts': 0}) + '\n')
+            fh.write(json.dumps({'t': 's', 'm': '01' * 32, 'tx': '0x01', 'ts': 0}) + '\n')
+            fh.write(json.dumps({'t': 's', 'm': '02' * 32, 'tx': '0x02', 'ts': 0}) + '\n')
+            fh.write(json.dumps({'t': 'i', 'm': '03' * 32, 'ts': 0}) + '\n')
+            fh.write('{"t": "s", "m"')
+
+        replayed = []
+
+        def resolve(mint_id, tx_hash, sent_at):
+            replayed.append((mint_id, tx_hash))
+            return '0x01' == tx_hash
+
+        with self.assertLogs('mixbytes.journal', 'WARNING'):
+            self.assertEqual(MintJournal(self.directory).replay(resolve), 1)
+        # the live segment is left alone
+        self.assertEqual(replayed, [(b'\x01' * 32, '0x01'), (b'\x02' * 32, '0x02')])
+
+        # pending transaction is tracked till it's resolved
+        self.assertEqual(MintJournal(self.directory).replay(lambda mint_id, tx_hash, sent_at: True), 0)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, '1.0.log')))
+        live.close()
+
+    def test_rotation(self):
+        live = MintJournal(self.directory, max_segment_records=2)
+        for i in range(5):
+            live.sent(bytes([i]) * 32, '0x{:02x}'.format(i))
+
+        # full segments are replayed while the process is alive, the current one is not
+        replayed = []
+        MintJournal(self.directory).replay(lambda mint_id, tx_hash, sent_at: replayed.append(tx_hash) or True)
+        self.assertEqual(replayed, ['0x00', '0x01', '0x02', '0x03'])
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+        live.close()
+        MintJournal(self.directory).replay(lambda mint_id, tx_hash, sent_at: replayed.append(tx_hash) or True)
+        self.assertEqual(replayed[4:], ['0x04'])
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+class TestReplayMint(unittest.TestCase):
+    """
+    Resolving journaled transactions with the node. Test requires redis (db 15 is used).
+    """
+
+    def setUp(self):
+        self.redis = redis.StrictRedis(host='127.0.0.1', port=6379, db=15)
+        self.redis.flushdb()
+
+        self.node = FakeNode()
+        self.directory = tempfile.mkdtemp()
+        self.minter = MinterService(*write_read_only_setup(self.directory, self.node.url), wsgi_mode=True)
+        self.mint_id = MinterService._prepare_mint_id('m1')
+
+    def tearDown(self):
+        self.minter.close()
+        self.node.close()
+        shutil.rmtree(self.directory)
+        self.redis.flushdb()
+
+    def test_unknown_transaction(self):
+        tx_hash = '0x' + '0a' * 32
+
+        # the node may be lagging
+        self.assertFalse(self.minter._replay_mint(self.mint_id, tx_hash, time()))
+        self.assertEqual(self.minter.known_transactions('m1'), [b'\x0a' * 32])
+
+        # dropped
+        self.assertTrue(self.minter._replay_mint(self.mint_id, tx_hash, time() - JOURNAL_DROPPED_TX_AGE))
+
+    def test_mined_transaction(self):
+        tx_hash = '0x' + '0b' * 32
+        self.node.transactions[tx_hash] = _transaction(tx_hash, None)
+        self.assertFalse(self.minter._replay_mint(self.mint_id, tx_hash, time()))
+
+        self.node.transactions[tx_hash] = _transaction(tx_hash, self.node.add_block([tx_hash]))
+        self.assertTrue(self.minter._replay_mint(self.mint_id, tx_hash, time()))
+
+
+class TestSending(unittest.TestCase):
+    """
+    Journal and leadership checks of mint_tokens around sending. Test requires redis (db 15 is used).
+    """
+
+    def setUp(self):
+        self.redis = redis.StrictRedis(host='127.0.0.1', port=6379, db=15)
+        self.redis.flushdb()
+
+        self.node = FakeNode()
+        self.directory = tempfile.mkdtemp()
+        self.minter = MinterService(*write_read_only_setup(self.directory, self.node.url), wsgi_mode=True)
+
+        # a minting instance, as far as mint_tokens goes
+        self.minter.read_only = False
+        self.minter._mint_journal = mock.Mock()
+        self.minter._target_contract = mock.Mock()
+        self.minter._wsgi_mode_state.get_account_address = mock.Mock(return_value='0x' + '11' * 20)
+        self.slot_error = None
+
+        @contextmanager
+        def slot(priority):
+            if self.slot_error is not None:
+                raise self.slot_error
+            yield 1
+        self.minter._mint_scheduler.slot = slot
+
+    def tearDown(self):
+        self.minter.read_only = True
+        self.minter.close()
+        self.node.close()
+        shutil.rmtree(self.directory)
+        self.redis.flushdb()
+
+    def test_leadership_lost_while_waiting(self):
+        self.minter.is_leader = mock.Mock(side_effect=[True, False])
+        with self.assertRaises(NotLeaderError):
+            self.minter.mint_tokens('m1', '0x' + '22' * 20, 1)
+        self.minter._mint_journal.intent.assert_not_called()
+        self.minter._target_contract.assert_not_called()
+
+    def test_intent_is_journaled_when_sending(self):
+        self.minter.is_leader = lambda: True
+
+        # not sent: replay has nothing to report
+        self.slot_error = LaneBusyError('default', 'busy')
+        with self.assertRaises(LaneBusyError):
+            self.minter.mint_tokens('m1', '0x' + '22' * 20, 1)
+        self.minter._mint_journal.intent.assert_not_called()
+
+        self.slot_error = None
+        self.minter._target_contract.return_value.transact.return_value.mint.return_value = '0x' + '0c' * 32
+        self.assertEqual(self.minter.mint_tokens('m1', '0x' + '22' * 20, 1), '0x' + '0c' * 32)
+        self.minter._mint_journal.intent.assert_called_once_with(MinterService._prepare_mint_id('m1'))
+        self.minter._mint_journal.sent.assert_called_once_with(MinterService._prepare_mint_id('m1'),
+                                                               '0x' + '0c' * 32)
+
+
+def _transaction(tx_hash, block_number):
+    return {'hash': tx_hash, 'blockNumber': None if block_number is None else hex(block_number),
+            'blockHash': None, 'from': '0x' + '11' * 20, 'to': '0x' + '5a' * 20, 'nonce': '0x1', 'value': '0x0',
+            'gas': '0x5208', 'gasPrice': '0x1', 'input': '0x', 'transactionIndex': None}
+
+
+if __name__ == '__main__':
+    unittest.main()
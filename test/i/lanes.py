@@ -0,0 +1,114 @@
+
+import os
+import sys
+import unittest
+from threading import Thread, Event
+from time import sleep
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
+
+from mixbytes.lanes import MintScheduler, LaneBusyError
+
+
+LANES = {
+    'max_concurrency': 1,
+    'lanes': {
+        'critical': {'priority': 0, 'gas_price_multiplier': 2},
+        'normal': {'priority': 1},
+        'bulk': {'priority': 2, 'max_gas_price': 100, 'max_wait': 0.3},
+    },
+}
+
+
+class TestMintScheduler(unittest.TestCase):
+
+    def test_priorities(self):
+        scheduler = MintScheduler(LANES, lambda: 50, _HeadTracker())
+        sent = []
+        started = Event()
+
+        def mint(lane):
+            with scheduler.slot(lane):
+                started.set()
+                sent.append(lane)
+                sleep(0.05)
+
+        threads = [Thread(target=mint, args=('normal', ))]
+        threads[0].start()
+        started.wait()
+
+        # while the slot is busy, mints of all lanes are queued
+        for lane in ('bulk', 'normal', 'critical'):
+            threads.append(Thread(target=mint, args=(lane, )))
+            threads[-1].start()
+            sleep(0.01)
+
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sent, ['normal', 'critical', 'normal', 'bulk'])
+
+    def test_gas_prices(self):
+        scheduler = MintScheduler(LANES, lambda: 70, _HeadTracker())
+        for lane, expected in (('critical', 140), ('normal', 70), ('bulk', 70), (None, 70)):
+            with scheduler.slot(lane) as gas_price:
+                self.assertEqual(gas_price, expected)
+
+        with self.assertRaises(ValueError):
+            with scheduler.slot('unknown'):
+                pass
+
+    def test_bulk_waits_for_cheap_gas(self):
+        gas_prices = [200, 150, 90]
+        scheduler = MintScheduler(LANES, lambda: gas_prices[0] if len(gas_prices) == 1 else gas_prices.pop(0),
+                                  _HeadTracker())
+        with scheduler.slot('bulk') as gas_price:
+            self.assertEqual(gas_price, 90)
+
+        scheduler = MintScheduler(LANES, lambda: 200, _HeadTracker())
+        with self.assertRaises(LaneBusyError):
+            with scheduler.slot('bulk'):
+                pass
+
+
+    def test_pending_transactions(self):
+        lanes = {
+            'max_pending': 3,
+            'default': 'critical',
+            'lanes': {
+                'critical': {'priority': 0},
+                'bulk': {'priority': 1, 'max_pending': 2, 'max_wait': 0.1},
+            },
+        }
+        pending = [1]
+        scheduler = MintScheduler(lanes, lambda: 50, _HeadTracker(), pending_transactions_fn=lambda: pending[0])
+
+        with scheduler.slot('bulk'):
+            # one pending plus one being sent
+            with self.assertRaises(LaneBusyError):
+                with scheduler.slot('bulk'):
+                    pass
+            with scheduler.slot('critical'):
+                pass
+
+        # transactions get mined
+        pending[0] = 3
+        mined = Thread(target=lambda: sleep(0.05) or pending.__setitem__(0, 1))
+        mined.start()
+        with scheduler.slot('critical'):
+            self.assertEqual(pending[0], 1)
+        mined.join()
+
+    def test_waiting_is_limited(self):
+        lanes = {'default': 'bulk', 'lanes': {'bulk': {'max_gas_price': 100}}}
+        scheduler = MintScheduler(lanes, lambda: 200, _HeadTracker())
+        self.assertEqual(scheduler._get_lane('bulk').max_wait, MintScheduler.DEFAULT_MAX_WAIT)
+
+
+class _HeadTracker(object):
+    """
+    A new block every 10 milliseconds.
+    """
+
+    def wait_for_change(self, known_head, timeout):
+        sleep(min(timeout, 0.01))
+        return (known_head or 0) + 1
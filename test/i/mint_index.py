@@ -0,0 +1,95 @@
+
+import os
+import sys
+import unittest
+
+import redis
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
+
+from mixbytes.mint_index import MintIndex
+
+
+CONTRACT_ADDRESS = b'0x' + b'22' * 20
+
+
+class TestMintIndex(unittest.TestCase):
+
+    def setUp(self):
+        # the same redis as the rest of integration tests, scratch db
+        self.redis = redis.StrictRedis(host='127.0.0.1', port=6379, db=15)
+        self.redis.flushdb()
+        self.index = MintIndex(self.redis, _bucket_key, buckets=16)
+
+    def tearDown(self):
+        self.redis.flushdb()
+
+    def test_txs_and_block(self):
+        mint_key = b'\x01' * 32
+        self.assertEqual(self.index.get(mint_key), ([], None))
+
+        # the block of an unknown mint is not cached
+        self.index.set_block(mint_key, 10, b'\xaa' * 32, 12)
+        self.assertEqual(self.index.get(mint_key), ([], None))
+
+        self.assertTrue(self.index.add_tx(mint_key, b'\x0a' * 32))
+        self.assertTrue(self.index.add_tx(mint_key, b'\x0b' * 32))
+        self.assertTrue(self.index.add_tx(mint_key, b'\x0c' * 32))
+        self.assertFalse(self.index.add_tx(mint_key, b'\x0a' * 32))
+        self.assertFalse(self.index.add_tx(mint_key, b'\x0c' * 32))
+        self.index.set_block(mint_key, 10, b'\xaa' * 32, 12)
+        txs = [b'\x0a' * 32, b'\x0b' * 32, b'\x0c' * 32]
+        self.assertEqual(self.index.get(mint_key), (txs, (10, b'\xaa' * 8, 12)))
+
+        self.index.forget_block(mint_key)
+        self.assertEqual(self.index.get(mint_key), (txs, None))
+
+        # values are never longer than one transaction, the rest overflows
+        for key in self.redis.keys(b'mi:*'):
+            self.assertTrue(all(len(value) <= 48 for value in self.redis.hvals(key)))
+        self.assertEqual(len(self.redis.keys(b'mo:*')), 1)
+
+        # mints sharing a bucket don't interfere
+        other_key = b'\x01' * 4 + b'\x02' * 28
+        self.index.add_tx(other_key, b'\x0c' * 32)
+        self.index.delete(mint_key)
+        self.assertEqual(self.index.get(mint_key), ([], None))
+        self.assertEqual(self.index.get(other_key), ([b'\x0c' * 32], None))
+        self.assertEqual(self.redis.keys(b'mo:*'), [])
+
+        # buckets stay compact
+        for key in self.redis.keys(b'mi:*'):
+            self.assertIn(self.redis.object('encoding', key), (b'ziplist', b'listpack'))
+
+    def test_migrate_legacy_keys(self):
+        # as written by earlier versions
+        mint_key = b'\x03' * 32
+        self.redis.lpush(mint_key, b'\x0a' * 32)
+        self.redis.lpush(mint_key, b'\x0b' * 32)
+        self.redis.set(b'bh' + mint_key, 12, ex=3600)
+        # a mint of another contract and something else
+        self.redis.lpush(b'\x05' * 32, b'\x0f' * 32)
+        self.redis.lpush(b'\x04' * 32, b'not a tx hash')
+
+        checked = []
+
+        def is_ours(tx_hashes):
+            checked.append(tx_hashes)
+            return b'\x0a' * 32 == tx_hashes[0]
+
+        self.assertEqual(self.index.migrate_legacy_keys(is_ours), (1, 1))
+        self.assertEqual(self.index.get(mint_key), ([b'\x0a' * 32, b'\x0b' * 32], None))
+        self.assertFalse(self.redis.exists(mint_key))
+        self.assertFalse(self.redis.exists(b'bh' + mint_key))
+        self.assertTrue(self.redis.exists(b'\x05' * 32))
+        self.assertTrue(self.redis.exists(b'\x04' * 32))
+        self.assertEqual(sorted(checked), [[b'\x0a' * 32, b'\x0b' * 32], [b'\x0f' * 32]])
+
+
+def _bucket_key(name, hash_tag):
+    # the same as MinterService._redis_contract_key
+    return name + b':' + CONTRACT_ADDRESS + b':{' + hash_tag + b'}'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+
+import os
+import sys
+import json
+import unittest
+from time import sleep, time
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
+
+from mixbytes.providers import ProviderSet
+from mixbytes.deadline import deadline, DeadlineExceededError
+
+
+class TestProviderSet(unittest.TestCase):
+    """
+    Routing of requests by ProviderSet, nodes are simulated.
+    """
+
+    def test_reads_avoid_lagging_and_syncing_nodes(self):
+        fresh, lagging, syncing = _FakeNode(100), _FakeNode(90), _FakeNode(100, syncing=True)
+        provider = _provider_set(fresh, lagging, syncing)
+
+        for _ in range(20):
+            self.assertEqual(_result(provider.make_request('eth_getBalance', [])), 100)
+        self.assertEqual(fresh.calls['eth_getBalance'], 20)
+
+    def test_reads_are_spread_by_weight(self):
+        heavy, light = _FakeNode(100), _FakeNode(100)
+        provider = ProviderSet([('heavy', heavy, 9), ('light', light, 1)])
+
+        for _ in range(1000):
+            provider.make_request('eth_getBalance', [])
+        self.assertGreater(heavy.calls['eth_getBalance'], light.calls['eth_getBalance'])
+        self.assertGreater(light.calls['eth_getBalance'], 0)
+
+    def test_writes_stick_to_one_node(self):
+        primary, secondary = _FakeNode(100), _FakeNode(100)
+        provider = _provider_set(primary, secondary)
+        moves = []
+        provider.add_local_node_listener(moves.append)
+
+        provider.make_request('eth_sendTransaction', [{}])
+        self.assertEqual(primary.calls['eth_sendTransaction'], 1)
+        self.assertNotIn('eth_sendTransaction', secondary.calls)
+
+        # the transaction may have been sent: not resent to another node
+        primary.broken = True
+        with self.assertRaises(ConnectionResetError):
+            provider.make_request('eth_sendTransaction', [{}])
+        self.assertEqual(primary.calls['eth_sendTransaction'], 2)
+        self.assertNotIn('eth_sendTransaction', secondary.calls)
+        self.assertEqual(moves, [])
+
+        # refused connection: surely not sent
+        primary.broken = False
+        primary.down = True
+        provider.make_request('eth_sendTransaction', [{}])
+        self.assertEqual(secondary.calls['eth_sendTransaction'], 1)
+        self.assertEqual(moves, ['node1'])
+
+        # the node stays in use
+        primary.down = False
+        provider.make_request('eth_sendTransaction', [{}])
+        provider.make_request('eth_getTransactionCount', [])
+        self.assertEqual(primary.calls['eth_sendTransaction'], 2)
+        self.assertEqual(secondary.calls['eth_sendTransaction'], 2)
+        self.assertEqual(secondary.calls['eth_getTransactionCount'], 1)
+
+    def test_session_reads_one_node(self):
+        nodes = [_FakeNode(100) for _ in range(3)]
+        provider = _provider_set(*nodes)
+
+        for _ in range(10):
+            before = [node.calls.get('eth_getBalance', 0) for node in nodes]
+            with provider.session():
+                for _ in range(5):
+                    provider.make_request('eth_getBalance', [])
+            self.assertEqual(sorted(node.calls.get('eth_getBalance', 0) - calls
+                                    for node, calls in zip(nodes, before)), [0, 0, 5])
+
+    def test_deadline(self):
+        slow = _FakeNode(100, delay=1)
+        provider = _provider_set(slow)
+        provider.make_request('eth_blockNumber', [])   # health check is done
+
+        started = time()
+        with self.assertRaises(DeadlineExceededError):
+            with deadline(0.2):
+                provider.make_request('eth_getBalance', [])
+        self.assertLess(time() - started, 0.5)
+
+    def test_health_check_does_not_delay_requests(self):
+        node = _FakeNode(100, health_delay=1)
+        provider = _provider_set(node)
+
+        # the first request finds the health check due
+        started = time()
+        with deadline(0.2):
+            self.assertEqual(_result(provider.make_request('eth_getBalance', [])), 100)
+        self.assertLess(time() - started, 0.2)
+
+    def test_hedged_reads(self):
+        nodes = [_FakeNode(100, delay=0.01), _FakeNode(100, delay=0.01)]
+        provider = ProviderSet([('node{}'.format(i), node, 1) for i, node in enumerate(nodes)],
+                               hedge=True, hedge_min_delay=0.01)
+        for _ in range(ProviderSet.MIN_LATENCY_SAMPLES):
+            provider.make_request('eth_getBalance', [])
+
+        # one of the nodes stalls, reads are answered by the other one in about a hedging delay
+        nodes[0].delay = 1
+        started = time()
+        for _ in range(5):
+            self.assertEqual(_result(provider.make_request('eth_getBalance', [])), 100)
+        self.assertLess(time() - started, 1)
+
+    def test_hedged_session_reads(self):
+        nodes = [_FakeNode(100, delay=0.01), _FakeNode(100, delay=0.01)]
+        provider = ProviderSet([('node{}'.format(i), node, 1) for i, node in enumerate(nodes)],
+                               hedge=True, hedge_min_delay=0.01)
+        for _ in range(ProviderSet.MIN_LATENCY_SAMPLES):
+            provider.make_request('eth_getBalance', [])
+
+        with provider.session():
+            provider.make_request('eth_getBalance', [])
+            pinned = provider._session.node
+            stalled = nodes[0] if pinned.provider is nodes[0] else nodes[1]
+
+            # the pinned node stalls, its peer answers and serves the rest of the session
+            stalled.delay = 1
+            started = time()
+            for _ in range(5):
+                self.assertEqual(_result(provider.make_request('eth_getBalance', [])), 100)
+            self.assertLess(time() - started, 1)
+            self.assertIsNot(provider._session.node, pinned)
+
+
+def _provider_set(*nodes):
+    return ProviderSet([('node{}'.format(i), node, 1) for i, node in enumerate(nodes)])
+
+
+def _result(response):
+    return json.loads(response.decode('utf-8'))['result']
+
+
+class _FakeNode(object):
+
+    def __init__(self, head, syncing=False, delay=0, health_delay=0):
+        self.head = head
+        self.syncing = syncing
+        self.delay = delay
+        self.health_delay = health_delay
+        self.down = False       # refuses connections
+        self.broken = False     # fails requests after receiving them
+        self.calls = dict()
+
+    def make_request(self, method, params):
+        if self.down:
+            raise ConnectionRefusedError('node is down')
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.broken:
+            raise ConnectionResetError('node is broken')
+        delay = self.health_delay if method in ('eth_blockNumber', 'eth_syncing') else self.delay
+        if delay:
+            sleep(delay)
+
+        if 'eth_blockNumber' == method:
+            result = hex(self.head)
+        elif 'eth_syncing' == method:
+            result = {'currentBlock': hex(self.head)} if self.syncing else False
+        else:
+            result = self.head
+        return json.dumps({'jsonrpc': '2.0', 'id': 1, 'result': result}).encode('utf-8')
+
+    def isConnected(self):
+        return not self.down
@@ -0,0 +1,106 @@
+
+import os
+import sys
+import socket
+import shutil
+import tempfile
+import unittest
+
+import yaml
+from time import time
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
+
+from mixbytes import minter
+from mixbytes.minter import _Conf
+from mixbytes.deadline import deadline, DeadlineExceededError
+
+
+class TestRedisConf(unittest.TestCase):
+    """
+    Validation of the redis section of the configuration.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_valid(self):
+        for redis_conf in ({'host': 'redis', 'port': '6379', 'db': 2},
+                           {'max_connections': 8, 'pool_timeout': 0, 'connect_timeout': 0.5, 'read_timeout': 1,
+                            'retries': 0, 'password': 'secret'},
+                           {'sentinel': {'master': 'mymaster', 'nodes': [['s1', 26379], ['s2', 26379]]}}):
+            self._conf(redis_conf)
+
+    def test_cluster(self):
+        redis_conf = {'cluster': {'nodes': [['c1', 7000]]}}
+        if minter.RedisCluster is None:
+            # redis-py older than 4.1
+            with self.assertRaises(ValueError):
+                self._conf(redis_conf)
+        else:
+            self._conf(redis_conf)
+
+    def test_invalid(self):
+        for redis_conf, error in (
+                (['127.0.0.1'], TypeError),
+                ({'port': 'redis'}, ValueError),
+                ({'db': -1}, ValueError),
+                ({'max_connections': 0}, ValueError),
+                ({'read_timeout': 0}, ValueError),
+                ({'connect_timeout': 'soon'}, ValueError),
+                ({'retries': -1}, ValueError),
+                ({'sentinel': {'master': 'mymaster', 'nodes': []}}, ValueError),
+                ({'sentinel': {'master': 'mymaster', 'nodes': ['s1:26379']}}, ValueError),
+                ({'sentinel': {'nodes': [['s1', 26379]]}}, ValueError),
+                ({'cluster': None}, ValueError),
+                ({'cluster': {'nodes': [['c1', 7000]]},
+                  'sentinel': {'master': 'mymaster', 'nodes': [['s1', 26379]]}}, ValueError)):
+            with self.assertRaises(error, msg=repr(redis_conf)):
+                self._conf(redis_conf)
+
+    def test_connection_options(self):
+        pool = self._conf({'host': 'redis', 'port': 6380, 'db': 3, 'max_connections': 8, 'pool_timeout': 0.5,
+                           'connect_timeout': 0.3, 'read_timeout': 0.7, 'retries': 2}).get_redis().connection_pool
+        self.assertEqual(pool.max_connections, 8)
+        self.assertEqual(pool.timeout, 0.5)
+        kwargs = pool.connection_kwargs
+        self.assertEqual((kwargs['host'], kwargs['port'], kwargs['db']), ('redis', 6380, 3))
+        self.assertEqual((kwargs['socket_connect_timeout'], kwargs['socket_timeout']), (0.3, 0.7))
+        self.assertTrue(kwargs['retry_on_timeout'])
+        if minter.RedisCluster is not None:
+            self.assertIsInstance(kwargs['retry'], minter.Retry)
+
+    def test_deadline(self):
+        # redis which accepts connections and never answers
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        try:
+            client = self._conf({'port': server.getsockname()[1], 'read_timeout': 5,
+                                 'retries': 2}).get_redis()
+            # the read times out at the deadline, the retry isn't sent
+            started = time()
+            with self.assertRaises(DeadlineExceededError), deadline(0.2):
+                client.get('key')
+            self.assertLess(time() - started, 1)
+
+            with self.assertRaises(DeadlineExceededError), deadline(0):
+                client.get('key')
+        finally:
+            server.close()
+
+
+    def _conf(self, redis_conf):
+        filename = os.path.join(self.directory, 'minter.conf')
+        with open(filename, 'w') as fh:
+            yaml.safe_dump({'read_only': True, 'minter_contract': '0x' + '5a' * 20, 'minter_contract_block_num': 1,
+                            'web3_provider': {'class': 'HTTPProvider', 'args': ['http://127.0.0.1:8545']},
+                            'redis': redis_conf}, fh)
+        return _Conf(filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
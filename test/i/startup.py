@@ -0,0 +1,176 @@
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+from threading import Thread
+from time import sleep, time
+from unittest import mock
+
+import yaml
+import redis
+from web3.utils.compat import compat_requests
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
+
+from mixbytes import contracts
+from mixbytes.contracts import minimize_built_contract, load_built_contract, MINIMAL_SUFFIX
+from mixbytes.minter import MinterService, UsageError
+from mixbytes.state import MemoryState
+from fake_node import FakeNode, write_read_only_setup, MINTER_ABI
+
+
+class TestBuiltContracts(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        contracts._cache.clear()
+
+    def tearDown(self):
+        contracts._cache.clear()
+        shutil.rmtree(self.directory)
+
+    def test_minimize(self):
+        self._write('Minter.json', {'contractName': 'Minter', 'abi': MINTER_ABI, 'bytecode': '0x60',
+                                    'source': 'contract Minter {}', 'ast': {'nodes': []}})
+        self._write('Old.json', {'contract_name': 'Old', 'abi': [], 'unlinked_binary': '0x61'})
+
+        minimize_built_contract(self.directory, 'Minter')
+        minimize_built_contract(self.directory, 'Old')
+
+        self.assertEqual(self._read('Minter' + MINIMAL_SUFFIX),
+                         {'contractName': 'Minter', 'abi': MINTER_ABI, 'bytecode': '0x60'})
+        self.assertEqual(self._read('Old' + MINIMAL_SUFFIX), {'abi': [], 'bytecode': '0x61'})
+
+    def test_load(self):
+        self._write('Minter.json', {'contractName': 'Minter', 'abi': [], 'bytecode': '0x60', 'source': ''})
+        self.assertIn('source', load_built_contract(self.directory, 'Minter'))
+
+        # the minimal version is preferred, once loaded the contract is not read again
+        contracts._cache.clear()
+        minimize_built_contract(self.directory, 'Minter')
+        loaded = load_built_contract(self.directory, 'Minter')
+        self.assertNotIn('source', loaded)
+
+        os.unlink(os.path.join(self.directory, 'Minter' + MINIMAL_SUFFIX))
+        self.assertIs(load_built_contract(self.directory, 'Minter'), loaded)
+
+        with self.assertRaises(FileNotFoundError):
+            load_built_contract(self.directory, 'Unknown')
+
+
+    def _write(self, name, content):
+        with open(os.path.join(self.directory, name), 'w') as fh:
+            json.dump(content, fh)
+
+    def _read(self, name):
+        with open(os.path.join(self.directory, name)) as fh:
+            return json.load(fh)
+
+
+class TestAfterFork(unittest.TestCase):
+    """
+    Test requires redis (db 15 is used).
+    """
+
+    def setUp(self):
+        self.redis = redis.StrictRedis(host='127.0.0.1', port=6379, db=15)
+        self.redis.flushdb()
+        self.node = FakeNode()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.node.close()
+        shutil.rmtree(self.directory)
+        self.redis.flushdb()
+
+    def test_after_fork(self):
+        with MinterService(*write_read_only_setup(self.directory, self.node.url), wsgi_mode=True) as minter:
+            # nothing is running before the fork
+            self.assertIsNone(minter.head_tracker()._thread)
+
+            # sessions of web3 are in use
+            self.assertIsNotNone(minter.blockchain_height())
+            sessions = [session for _, session in compat_requests._session_cache.items()]
+            self.assertTrue(sessions)
+
+            with mock.patch.object(minter._redis, 'connection_pool') as pool:
+                minter.after_fork()
+            # connections inherited from the parent are dropped
+            pool.reset.assert_called_once_with()
+            self.assertFalse(any(session in sessions for _, session in compat_requests._session_cache.items()))
+
+            # the head is tracked right away
+            self.assertEqual(minter.head_tracker().wait_for_change(None, 5), self.node.head)
+
+    def test_close(self):
+        minter = MinterService(*write_read_only_setup(self.directory, self.node.url), wsgi_mode=True)
+        tracker = minter.head_tracker()
+        tracker.wait_for_change(None, 5)
+        provider = minter._w3.providers[0]
+        provider._get_executor()
+
+        minter.close()
+        tracker._thread.join(5)
+        self.assertFalse(tracker._thread.is_alive())
+        self.assertIsNone(provider._executor)
+
+        # the node isn't polled anymore
+        calls = self.node.calls['eth_blockNumber']
+        sleep(0.2)
+        self.assertEqual(self.node.calls['eth_blockNumber'], calls)
+
+    def test_long_poll_waiters_are_limited(self):
+        with MinterService(*write_read_only_setup(self.directory, self.node.url, max_long_poll_waiters=1),
+                           wsgi_mode=True) as minter:
+            waiter = Thread(target=minter.wait_minting_status, args=('m1', 'not_minted'), kwargs={'timeout': 1})
+            waiter.start()
+            sleep(0.2)
+
+            # no thread to spare: the status is returned without waiting
+            started = time()
+            self.assertEqual(minter.wait_minting_status('m2', 'not_minted', timeout=1)['status'], 'not_minted')
+            self.assertLess(time() - started, 0.5)
+
+            waiter.join()
+            started = time()
+            self.assertEqual(minter.wait_minting_status('m2', 'not_minted', timeout=0.3)['status'], 'not_minted')
+            self.assertGreaterEqual(time() - started, 0.3)
+
+    def test_exclusive(self):
+        # a minting instance, the state is kept in a file or shared by instances
+        state = {'account': {'address': '0x' + '11' * 20, 'password': 'secret'},
+                 'minter_contract': '0x' + '5a' * 20, 'minter_contract_block_num': 1}
+        with open(os.path.join(self.directory, 'state.yaml'), 'w') as fh:
+            yaml.safe_dump(state, fh)
+        with MemoryState('test_exclusive') as shared_state:
+            for name, value in state.items():
+                shared_state[name] = value
+            shared_state.save()
+
+        for shared in (False, True):
+            settings = {'state_backend': {'class': 'MemoryState', 'key': 'test_exclusive'}} if shared else {}
+            setup = write_read_only_setup(self.directory, self.node.url, read_only=False,
+                                          data_directory=self.directory, **settings)
+
+            # refused while the service is running
+            service = MinterService(*setup, wsgi_mode=True)
+            self.assertTrue(service.is_leader())
+            with self.assertRaises(UsageError, msg=shared):
+                MinterService(*setup, wsgi_mode=True, exclusive=True)
+            service.close()
+
+            # nor does the service mint meanwhile
+            with MinterService(*setup, wsgi_mode=True, exclusive=True) as exclusive:
+                self.assertTrue(exclusive.is_leader())
+                if shared:
+                    with MinterService(*setup, wsgi_mode=True) as service:
+                        self.assertFalse(service.is_leader())
+                else:
+                    with self.assertRaises(RuntimeError):
+                        MinterService(*setup, wsgi_mode=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
+
+from mixbytes.state import MemoryState
+from mixbytes.leader import LocalLeaderElection
+
+
+class TestSharedState(unittest.TestCase):
+    """
+    Shared state semantics, using process-local stand-ins of redis backends.
+    """
+
+    def test_state_locking(self):
+        with MemoryState('test_state_locking') as state:
+            state['minter_contract'] = '0x' + '11' * 20
+            state.save(True)
+
+            # writers exclude each other
+            with self.assertRaises(RuntimeError):
+                MemoryState('test_state_locking')
+
+            # readers don't lock, as in RedisState
+            reader = MemoryState('test_state_locking', lock_shared=True)
+            self.assertEqual(reader.get_minter_contract_address(), '0x' + '11' * 20)
+
+        # nor do they exclude writers
+        MemoryState('test_state_locking').close()
+        reader.close()
+        MemoryState('test_state_locking').close()
+
+    def test_nested_values_are_read_only(self):
+        with MemoryState('test_nested_values') as state:
+            state['account'] = {'address': '0x' + '22' * 20, 'keys': ['a']}
+            state.save()
+
+            # changes which would not be saved
+            with self.assertRaises(TypeError):
+                state['account']['address'] = '0x' + '33' * 20
+            with self.assertRaises(AttributeError):
+                state['account']['keys'].append('b')
+
+            account = dict(state['account'], address='0x' + '33' * 20)
+            state['account'] = account
+            account['address'] = '0x' + '44' * 20   # a copy is kept
+            state.save()
+
+        reader = MemoryState('test_nested_values', lock_shared=True)
+        self.assertEqual(reader.get_account_address(), '0x' + '33' * 20)
+        self.assertEqual(reader['account']['keys'], ('a', ))
+        reader.close()
+
+    def test_leader_election(self):
+        clock = _Clock()
+        # the lease is renewed in the background every ttl/3 (real) seconds, campaigns are driven by the test
+        instances = [LocalLeaderElection('test_leader_election', ttl=60, clock=clock) for _ in range(3)]
+        leaders = [instance for instance in instances if instance.is_leader()]
+        self.assertEqual(len(leaders), 1)
+
+        # the leader keeps the lease
+        for _ in range(3):
+            clock.now += 20
+            self._campaign(instances)
+        self.assertEqual([instance for instance in instances if instance.is_leader()], leaders)
+
+        # and gives it up
+        leaders[0].release()
+        self.assertFalse(leaders[0].is_leader())
+        self._campaign(instances)
+        new_leaders = [instance for instance in instances if instance.is_leader()]
+        self.assertEqual(len(new_leaders), 1)
+        self.assertIsNot(new_leaders[0], leaders[0])
+
+        # a leader which stopped renewing steps down before anybody can take over
+        others = [instance for instance in instances if instance is not new_leaders[0]]
+        clock.now += 41
+        self.assertEqual([instance for instance in instances if instance.is_leader()], [])
+        self._campaign(others)
+        self.assertEqual([instance for instance in instances if instance.is_leader()], [])
+        clock.now += 20
+        self._campaign(others)
+        self.assertEqual(len([instance for instance in others if instance.is_leader()]), 1)
+
+        for instance in instances:
+            instance.release()
+
+    def test_processes_of_instance_lead_together(self):
+        clock = _Clock()
+        workers = [LocalLeaderElection('test_processes_of_instance', ttl=60, instance_id='host-a', clock=clock)
+                   for _ in range(2)]
+        other = LocalLeaderElection('test_processes_of_instance', ttl=60, instance_id='host-b', clock=clock)
+
+        self.assertTrue(all(worker.is_leader() for worker in workers))
+        self.assertFalse(other.is_leader())
+
+        # any of them keeps the lease of the instance
+        clock.now += 30
+        self._campaign([workers[1], other])
+        clock.now += 30
+        self._campaign([workers[1], other])
+        self.assertFalse(other.is_leader())
+        self.assertTrue(workers[1].is_leader())
+
+        for instance in workers + [other]:
+            instance.release()
+
+
+    def _campaign(self, instances):
+        for instance in instances:
+            if not instance._released:
+                instance._campaign()
+
+
+class _Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import redis
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
+
+from mixbytes.minter import MinterService, UsageError, _Conf
+from fake_node import FakeNode, write_read_only_setup, import_wsgi_app, MINTER_CONTRACT
+
+
+CONTRACT_B = '0x' + 'b0' * 20
+
+
+class TestTenants(unittest.TestCase):
+    """
+    Test requires redis (db 15 is used).
+    """
+
+    def setUp(self):
+        self.redis = redis.StrictRedis(host='127.0.0.1', port=6379, db=15)
+        self.redis.flushdb()
+        self.node = FakeNode()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.node.close()
+        shutil.rmtree(self.directory)
+        self.redis.flushdb()
+
+    def test_conf(self):
+        conf_filename, _ = self._setup({'a': {'require_confirmations': 7, 'data_directory': self.directory},
+                                        'b': None})
+
+        a = _Conf(conf_filename, 'a')
+        self.assertEqual((a['require_confirmations'], a['head_poll_interval']), (7, 0.05))
+        self.assertNotIn('tenants', a)
+        b = _Conf(conf_filename, 'b')
+        self.assertEqual(b['require_confirmations'], 3)
+
+        for tenant in (None, 'c', '../a'):
+            with self.assertRaises(ValueError, msg=tenant):
+                _Conf(conf_filename, tenant)
+
+        # journals of tenants sharing the data directory are kept apart
+        a = _Conf(self._setup({'a': None, 'b': None}, data_directory=self.directory)[0], 'a')
+        b = _Conf(self._setup({'a': None, 'b': None}, data_directory=self.directory)[0], 'b')
+        journals = [conf.get_mint_journal() for conf in (a, b)]
+        self.assertEqual([journal._directory for journal in journals],
+                         [os.path.join(self.directory, 'mint_journal', 'a'),
+                          os.path.join(self.directory, 'mint_journal', 'b')])
+        for journal in journals:
+            journal.close()
+
+    def test_common_settings(self):
+        for name, value in (('redis', {'host': '127.0.0.1', 'db': 14}), ('head_poll_interval', 1),
+                            ('admission', {'client_rate': 1})):
+            conf_filename, _ = self._setup({'a': {name: value}})
+            with self.assertRaises(ValueError, msg=name):
+                _Conf(conf_filename, 'a')
+
+    def test_create_tenants(self):
+        self.assertEqual(MinterService.create_tenants(*self._setup(None)), {})
+
+        minters = MinterService.create_tenants(*self._setup({'a': None, 'b': {'minter_contract': CONTRACT_B}}),
+                                               wsgi_mode=True)
+        try:
+            self.assertEqual(sorted(minters), ['a', 'b'])
+            self.assertEqual([minter.tenant for minter in (minters['a'], minters['b'])], ['a', 'b'])
+            # connections and the head tracker are shared
+            self.assertIs(minters['a']._w3, minters['b']._w3)
+            self.assertIs(minters['a']._redis, minters['b']._redis)
+            self.assertIs(minters['a'].head_tracker(), minters['b'].head_tracker())
+            self.assertEqual(minters['b']._wsgi_mode_state.get_minter_contract_address(), CONTRACT_B)
+        finally:
+            for minter in minters.values():
+                minter.close()
+
+        # minting tenants can't share the state
+        state_directory = os.path.join(self.directory, 'data')
+        os.makedirs(state_directory)
+        with self.assertRaises(UsageError):
+            MinterService.create_tenants(*self._setup({'a': None, 'b': None}, read_only=False,
+                                                      data_directory=state_directory))
+
+    def test_shared_admission(self):
+        minters = MinterService.create_tenants(
+            *self._setup({'a': None, 'b': None, 'c': None},
+                         admission={'max_pending_transactions': 10, 'load_check_interval': 0}),
+            wsgi_mode=True)
+        try:
+            self.assertIsNone(MinterService.create_admission_controller(list(minters.values())).admit('x'))
+
+            # pending transactions of all minting tenants count
+            for tenant, pending in (('a', 6), ('b', 6)):
+                minters[tenant].read_only = False
+                minters[tenant].pending_transactions_count = mock.Mock(return_value=pending)
+            minters['c'].pending_transactions_count = mock.Mock(return_value=100)
+
+            admission = MinterService.create_admission_controller(list(minters.values()))
+            self.assertIsNotNone(admission.admit('x'))
+            minters['c'].pending_transactions_count.assert_not_called()
+        finally:
+            for minter in minters.values():
+                minter.read_only = True
+                minter.close()
+
+    def test_routing(self):
+        wsgi_app = import_wsgi_app(*self._setup({'a': None, 'b': {'minter_contract': CONTRACT_B}}))
+        try:
+            client = wsgi_app.app.test_client()
+
+            for path, contract in (('/a/getMintingStatus?mint_id=m1', MINTER_CONTRACT),
+                                   ('/b/getMintingStatus?mint_id=m1', CONTRACT_B),
+                                   ('/getMintingStatus?mint_id=m1&tenant=b', CONTRACT_B)):
+                self.node.called_contracts.clear()
+                response = client.get(path)
+                self.assertEqual(response.status_code, 200, path)
+                self.assertEqual(response.get_json()['status'], 'not_minted')
+                self.assertEqual(set(self.node.called_contracts), {contract.lower()}, path)
+
+            self.assertEqual(client.get('/a/blockChainHeight').get_json(), self.node.head)
+            for path in ('/c/blockChainHeight', '/blockChainHeight', '/blockChainHeight?tenant=c'):
+                self.assertEqual(client.get(path).status_code, 404, path)
+            # read-only tenants
+            self.assertEqual(client.get('/a/mintTokens?mint_id=m1&address={}&tokens_amount=1'
+                                        .format(MINTER_CONTRACT)).status_code, 403)
+        finally:
+            for minter in wsgi_app.all_minters:
+                minter.close()
+
+        # without tenants tenant paths are unknown
+        wsgi_app = import_wsgi_app(*self._setup(None))
+        try:
+            client = wsgi_app.app.test_client()
+            self.assertEqual(client.get('/blockChainHeight').status_code, 200)
+            self.assertEqual(client.get('/a/blockChainHeight').status_code, 404)
+        finally:
+            wsgi_app.wsgi_minter.close()
+
+
+    def _setup(self, tenants, **settings):
+        if tenants is not None:
+            settings['tenants'] = tenants
+        return write_read_only_setup(self.directory, self.node.url, **settings)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from time import sleep
+from unittest import mock
+
+import redis
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
+
+from mixbytes.webhooks import WebhookDispatcher
+from mixbytes.minter import MinterService
+from fake_node import FakeNode, write_read_only_setup
+
+
+TX1 = b'\x0a' * 32
+TX2 = b'\x0b' * 32
+
+
+class TestWebhookDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        # the same redis as the rest of integration tests, scratch db
+        self.redis = redis.StrictRedis(host='127.0.0.1', port=6379, db=15)
+        self.redis.flushdb()
+        self.minter = _Minter()
+
+    def tearDown(self):
+        self.redis.flushdb()
+
+    def test_checks_only_on_changes(self):
+        dispatcher = WebhookDispatcher(self.minter, self.redis, {'retry_base_delay': 0})
+        dispatcher.register('m1', 'http://127.0.0.1:1/minted')
+        minter = self.minter
+
+        self.assertEqual(dispatcher.dispatch_once(), (0, 0))
+        self.assertEqual(minter.checks, 1)
+
+        # nothing has happened
+        minter.head += 1
+        self.assertEqual(dispatcher.dispatch_once(), (0, 0))
+        self.assertEqual(minter.checks, 1)
+
+        # a transaction is sent
+        minter.txs = [TX1]
+        minter.status = {'status': 'minting', 'confirmations': 0, 'rest_confirmations': 3}
+        dispatcher.dispatch_once()
+        self.assertEqual(minter.checks, 2)
+
+        # a block without transactions of the mint
+        minter.head += 1
+        minter.blocks[minter.head] = ['0x' + '0c' * 32]
+        dispatcher.dispatch_once()
+        self.assertEqual(minter.checks, 2)
+
+        # the transaction is mined
+        minter.head += 1
+        minter.blocks[minter.head] = ['0x' + '0A' * 32]
+        minter.status = {'status': 'minting', 'confirmations': 0, 'rest_confirmations': 3}
+        dispatcher.dispatch_once()
+        self.assertEqual(minter.checks, 3)
+
+        # checked again when the confirmations may be enough
+        minter.status = {'status': 'minted'}
+        for _ in range(2):
+            minter.head += 1
+            dispatcher.dispatch_once()
+        self.assertEqual(minter.checks, 3)
+        minter.head += 1
+        self.assertEqual(dispatcher.dispatch_once(), (1, 0))
+        self.assertEqual(minter.checks, 4)
+
+    def test_head_jump_checks_everything(self):
+        dispatcher = WebhookDispatcher(self.minter, self.redis)
+        dispatcher.register('m1', 'http://127.0.0.1:1/minted')
+        self.minter.txs = [TX1, TX2]
+        dispatcher.dispatch_once()
+
+        self.minter.head += WebhookDispatcher.MAX_BLOCKS_TO_SCAN + 1
+        dispatcher.dispatch_once()
+        self.assertEqual(self.minter.checks, 2)
+
+    def test_lock_kept_during_long_round(self):
+        dispatcher = WebhookDispatcher(self.minter, self.redis)
+        dispatcher.LOCK_TIMEOUT = 0.6
+        other = WebhookDispatcher(self.minter, self.redis)
+        for mint in range(4):
+            dispatcher.register('m{}'.format(mint), 'http://127.0.0.1:1/minted')
+
+        others_rounds = []
+
+        def slow_status():
+            sleep(0.3)
+            if 4 == self.minter.checks:
+                # the round took longer than the lock timeout
+                others_rounds.append(other.dispatch_once())
+
+        self.minter.on_check = slow_status
+        self.assertEqual(dispatcher.dispatch_once(), (0, 0))
+        self.assertEqual(others_rounds, [(0, 0)])
+        self.assertEqual(self.minter.checks, 4)
+
+
+class TestMintRegistration(unittest.TestCase):
+    """
+    Watching a mint requested with callback_url. Test requires redis (db 15 is used).
+    """
+
+    def setUp(self):
+        self.redis = redis.StrictRedis(host='127.0.0.1', port=6379, db=15)
+        self.redis.flushdb()
+        self.node = FakeNode()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.node.close()
+        shutil.rmtree(self.directory)
+        self.redis.flushdb()
+
+    def test_not_sent_unless_watched(self):
+        with MinterService(*write_read_only_setup(self.directory, self.node.url), wsgi_mode=True) as minter:
+            # a minting instance, as far as mint_tokens goes
+            minter.read_only = False
+            minter.is_leader = lambda: True
+            minter._target_contract = mock.Mock()
+
+            with mock.patch.object(minter.webhooks(), '_redis') as client:
+                client.hset.side_effect = redis.exceptions.ConnectionError()
+                with self.assertRaises(redis.exceptions.ConnectionError):
+                    minter.mint_tokens('m1', '0x' + '11' * 20, 1, callback_url='http://127.0.0.1:1/minted')
+            minter._target_contract.assert_not_called()
+
+
+class _Minter(object):
+    # what WebhookDispatcher uses of MinterService
+
+    def __init__(self):
+        self.head = 100
+        self.blocks = dict()
+        self.txs = []
+        self.status = {'status': 'not_minted'}
+        self.checks = 0
+        self.on_check = None
+
+    def blockchain_height(self):
+        return self.head
+
+    def get_block(self, block_number):
+        return _Block(self.blocks.get(block_number, []))
+
+    def known_transactions(self, mint_id):
+        return self.txs
+
+    def get_minting_status(self, mint_id):
+        self.checks += 1
+        if self.on_check is not None:
+            self.on_check()
+        return dict(self.status)
+
+    def _redis_contract_key(self, name):
+        return name + b':{0x' + b'22' * 20 + b'}'
+
+
+class _Block(object):
+    def __init__(self, transactions):
+        self.transactions = transactions
+
+
+if __name__ == '__main__':
+    unittest.main()